@@ -1,147 +1,284 @@
 # app.py
 import os
+import time
+import logging
 import psycopg2
 import json
 import base64 # For sharing feature
-from psycopg2 import pool # Use connection pooling
-from werkzeug.security import generate_password_hash, check_password_hash
+import hashlib
+from functools import partial, wraps
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    session, flash, jsonify
+    session, flash, jsonify, Response, stream_with_context, g, current_app
 )
 from dotenv import load_dotenv
-# Assuming utils.py contains the necessary functions (format_gemini_prompt, call_gemini_api, etc.)
-from utils import (
-    format_gemini_prompt, call_gemini_api, mock_recipe,
-    validate_email, validate_password, get_substitutions
-)
 
-# Load environment variables from .env file
+# Load environment variables from .env file (before local modules read their settings)
 load_dotenv()
 
-app = Flask(__name__)
-# Ensure SECRET_KEY is set, essential for sessions
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
-if not app.config['SECRET_KEY']:
-    print("FATAL: SECRET_KEY environment variable not set. Sessions will not work.")
-    # In a real app, you might raise an exception or exit here
-    # raise ValueError("SECRET_KEY environment variable is required for session management.")
-
-# --- Database Configuration ---
-DB_NAME = os.getenv('DB_NAME')
-DB_USER = os.getenv('DB_USER')
-DB_PASSWORD = os.getenv('DB_PASSWORD')
-DB_HOST = os.getenv('DB_HOST')
-DB_PORT = os.getenv('DB_PORT')
-
-# Database Connection Pooling
-db_pool = None # Initialize to None
-try:
-    # Use minconn=1, maxconn=5 or adjust based on expected load
-    db_pool = psycopg2.pool.SimpleConnectionPool(
-        minconn=1,
-        maxconn=10, # Increased max connections slightly
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST,
-        port=DB_PORT,
-        # Keepalive settings can help prevent connection drops on idle networks
-        # keepalives=1,
-        # keepalives_idle=30,
-        # keepalives_interval=10,
-        # keepalives_count=5
-    )
-    print("Database connection pool created successfully.")
-except psycopg2.OperationalError as e:
-    print(f"FATAL: Could not connect to database to create pool: {e}")
-    # The app might run but DB operations will fail.
-except Exception as e:
-    print(f"FATAL: An unexpected error occurred creating the DB pool: {e}")
-
-
-# --- DB Helper Functions ---
-def get_db_conn():
-    """Gets a connection from the pool."""
-    if db_pool:
-        try:
-            conn = db_pool.getconn()
-            if conn:
-                # print("DEBUG: Acquired DB connection from pool.") # Optional debug log
-                return conn
-            else:
-                print("Error: db_pool.getconn() returned None.")
-                return None
-        except Exception as e:
-            print(f"Error getting DB connection from pool: {e}")
-            return None
-    print("DB connection pool is not available.")
-    return None
+from logging_config import configure_logging, new_request_id
+configure_logging() # Queue-based JSON logging; see LOG_LEVEL / LOG_FORMAT in .env
+logger = logging.getLogger(__name__)
 
-def put_db_conn(conn):
-    """Returns a connection to the pool."""
-    if db_pool and conn:
-        try:
-             db_pool.putconn(conn)
-             # print("DEBUG: Returned DB connection to pool.") # Optional debug log
-        except Exception as e:
-             print(f"Error returning DB connection to pool: {e}")
-             # If putting back fails, try closing it to prevent leaks
-             try:
-                 conn.close()
-             except Exception as close_e:
-                 print(f"Error closing connection after putconn failed: {close_e}")
-
-
-def init_db():
-    """Initializes the database (creates table if not exists)."""
-    conn = get_db_conn()
-    if not conn:
-        print("Database connection unavailable for init_db.")
-        return False # Indicate failure
-    created = False
+# Assuming utils.py contains the necessary functions (format_gemini_prompt, call_gemini_api, etc.)
+from utils import (
+    format_gemini_prompt, call_gemini_api, is_valid_recipe, recipe_or_mock,
+    validate_email, validate_password, get_substitutions, set_response_cache, decode_share_data,
+    gemini_breaker, gemini_limiter, get_cached_result, get_precomputed_result, get_router_stats, get_warm_cache, set_warm_cache
+)
+from db import PoolError
+from circuit_breaker import deadline_after
+from compression import build_response_compressor
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, ADMISSION_REJECTIONS, HTTP_REQUEST_DURATION,
+    RATE_LIMITED_REQUESTS, SHOPPING_LIST_READS, Gauge, render_metrics
+)
+from normalize import normalize_ingredients, normalize_request
+from streaming import stream_recipe_events
+from assets import build_asset_manifest, fingerprint_static_url, send_asset
+from batch import generate_batch
+from categories import categorize, category_order, get_category_index
+from jobs import QueueFull
+from jsoncodec import FastJSONProvider
+from passwords import HasherBusy, hash_password, rehash_if_needed, verify_password
+from rate_limit import retry_after_header
+from recipe_store import ensure_recipes_schema
+from services import DeferredSessionInterface, Services
+from substitutions import CONTEXTS as SUBSTITUTION_CONTEXTS, get_substitution_store
+
+
+def _flag(name, default):
+    return os.getenv(name, default).lower() in ['true', '1', 't', 'yes', 'on']
+
+def default_config():
+    """App settings read from the environment (.env); create_app(config) overrides any of them."""
+    return {
+        'SECRET_KEY': os.getenv('SECRET_KEY'),
+        # --- Database Configuration ---
+        'DB_NAME': os.getenv('DB_NAME'),
+        'DB_USER': os.getenv('DB_USER'),
+        'DB_PASSWORD': os.getenv('DB_PASSWORD'),
+        'DB_HOST': os.getenv('DB_HOST'),
+        'DB_PORT': os.getenv('DB_PORT'),
+        'DB_CONNECT_TIMEOUT': int(os.getenv('DB_CONNECT_TIMEOUT', '5')),
+        'DB_POOL_MIN': int(os.getenv('DB_POOL_MIN', '1')),
+        'DB_POOL_MAX': int(os.getenv('DB_POOL_MAX', '10')),
+        'DB_POOL_TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', '5')),
+        'DB_POOL_MAX_LIFETIME': float(os.getenv('DB_POOL_MAX_LIFETIME', '1800')),
+        # Server-side sessions: the cookie only carries an opaque ID ('cookie' restores signed cookies)
+        'SESSION_BACKEND': os.getenv('SESSION_BACKEND', 'sqlite').lower(),
+        # Over the per-user/IP limit: 'degrade' (answer without Gemini where possible) or 'reject'
+        'RATE_LIMIT_OVERFLOW': os.getenv('RATE_LIMIT_OVERFLOW', 'degrade').lower(),
+        # Recipe history/corpus: generated recipes are written by a background thread and
+        # reused for later /generate requests with the same (or a superset of) ingredients
+        'RECIPE_HISTORY_ENABLED': _flag('RECIPE_HISTORY_ENABLED', '1'),
+        'RECIPE_CORPUS_LOOKUP': _flag('RECIPE_CORPUS_LOOKUP', '1'),
+        # Shared LLM response cache tier in Postgres (opt-in via GEMINI_CACHE_BACKEND=postgres)
+        'GEMINI_CACHE_BACKEND': os.getenv('GEMINI_CACHE_BACKEND', 'memory').lower(),
+        # Rendered home page per login state, reused for this many seconds (0 = render every time)
+        'PAGE_CACHE_TTL': int(os.getenv('PAGE_CACHE_TTL', '300')),
+    }
+
+
+# --- Application Factory ---
+# create_app() does no I/O: the DB pool, stores and rate limiter live in
+# Services and are built on first use in each process (after fork under
+# gunicorn --preload), and the Gemini client is per-process too (see
+# gemini_client.py). Tables are created by `flask --app app init-db`.
+
+_routes = [] # (rule, view, options) registered on every app create_app() builds
+
+def route(rule, **options):
+    """Like @app.route, for views defined before the app exists. Endpoint names stay the function names."""
+    def decorator(view):
+        _routes.append((rule, view, options))
+        return view
+    return decorator
+
+def create_app(config=None):
+    """Builds the Flask app. `config` (a dict) overrides default_config()."""
+    app = Flask(__name__, static_folder=None) # 'static' is served by assets.send_asset
+    app.json = FastJSONProvider(app) # orjson for jsonify/get_json when installed
+    app.config.from_mapping(default_config())
+    if config:
+        app.config.from_mapping(config)
+    # Ensure SECRET_KEY is set, essential for sessions
+    if not app.config['SECRET_KEY']:
+        logger.critical("SECRET_KEY environment variable not set. Sessions will not work.")
+
+    services = Services(app.config, job_handler=partial(run_generation_job, app))
+    app.extensions['services'] = services
+    if app.config['SESSION_BACKEND'] != 'cookie':
+        app.session_interface = DeferredSessionInterface(services)
+
+    for rule, view, options in _routes:
+        app.add_url_rule(rule, view_func=view, **options)
+    # Content-hashed static URLs with far-future caching; pre-compressed copies via `python -m assets build`
+    app.extensions['assets'] = build_asset_manifest(auto_reload=app.debug)
+    app.add_url_rule('/static/<path:filename>', endpoint='static', view_func=send_asset)
+    app.url_defaults(fingerprint_static_url)
+    app.before_request(start_request_timer)
+    app.before_request(bind_caches)
+    app.after_request(observe_request_duration)
+    compressor = build_response_compressor()
+    if compressor is not None:
+        app.after_request(compressor) # Registered last, so it runs first and the other hooks see final headers
+    app.teardown_appcontext(handle_app_context_teardown)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Creates or updates the database tables."""
+        if not init_db(services.db_pool):
+            raise SystemExit(1)
+
+    return app
+
+def get_services(app=None):
+    """Per-process resources of `app` (default: the app handling this request)."""
+    return (app or current_app).extensions['services']
+
+def warm_up(app):
+    """Loads local data ahead of the first request; gunicorn.conf.py calls this in each worker."""
+    get_substitution_store()
+    get_category_index()
+    set_warm_cache(get_services(app).warm_cache)
+    get_services(app).retrieval_index
+    app.extensions['assets'].version # Hashes the static files
+
+
+# --- Request Hooks ---
+
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.request_id = new_request_id(request.headers.get('X-Request-ID'))
+
+def observe_request_duration(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Label by URL rule, not raw path, to keep the series count bounded
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - started,
+                                      method=request.method, route=route, status=response.status_code)
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+def bind_caches():
+    """
+    Binds this app's response cache (for its GEMINI_CACHE_BACKEND) and warm
+    cache file into utils the first time this process needs them.
+    """
+    services = get_services()
+    if services.peek('response_cache') is None:
+        set_response_cache(services.response_cache)
+    warm = services.warm_cache
+    if get_warm_cache() is not warm:
+        set_warm_cache(warm)
+
+
+# --- Metrics ---
+# Scrape-time gauges; request/LLM/DB/password series are recorded where they happen.
+# They describe the module-level `app`; resources not built yet in this process read as empty.
+
+def _pool_gauge():
+    pool = get_services(app).peek('db_pool')
+    return {(pool.name, state): pool.stats()[state] for state in ('in_use', 'idle')} if pool else {}
+
+def _retrieval_rows_gauge():
+    index = get_services(app).peek('retrieval_index')
+    return index.stats()['rows'] if index is not None else 0
+
+Gauge('db_pool_connections', 'DB pool connections by state.', ['pool', 'state'], fn=_pool_gauge)
+Gauge('gemini_circuit_breaker_open', '1 while the Gemini circuit breaker rejects calls.',
+      fn=lambda: 1 if gemini_breaker.state == 'open' else 0)
+Gauge('gemini_concurrency', 'Adaptive cap on concurrent Gemini calls and calls in flight.', ['kind'],
+      fn=lambda: {(kind,): gemini_limiter.stats()[kind] for kind in ('limit', 'in_flight')})
+Gauge('retrieval_index_rows', 'Recipes in the nearest-recipe index.', fn=_retrieval_rows_gauge)
+Gauge('warm_cache_entries', 'Precomputed answers in the mapped warm cache file.', fn=lambda: len(get_services(app).peek('warm_cache') or ()))
+Gauge('gemini_hedge_delay_seconds', 'Current wait before a backup Gemini call is fired, by tier.', ['tier'],
+      fn=lambda: {(tier,): stats['hedge_delay'] for tier, stats in get_router_stats().items()})
+
+
+def init_db(db_pool):
+    """Initializes the database (creates tables if not exists). Returns False if login_details is unavailable."""
     try:
-        with conn.cursor() as cur:
-            print("DEBUG: Attempting to create login_details table...")
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS login_details (
-                    user_id SERIAL PRIMARY KEY,
-                    email VARCHAR(255) UNIQUE NOT NULL,
-                    password_hash VARCHAR(255) NOT NULL,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
-            # Optionally check if table exists after attempting creation for confirmation
-            # cur.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_schema = 'public' AND table_name = 'login_details');")
-            # table_exists = cur.fetchone()[0]
-            # if table_exists:
-            #     print("Database table 'login_details' checked/created successfully.")
-            #     created = True
-            # else:
-            #     print("ERROR: login_details table check failed after CREATE IF NOT EXISTS.")
-
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                logger.debug("Attempting to create login_details table...")
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS login_details (
+                        user_id SERIAL PRIMARY KEY,
+                        email VARCHAR(255) UNIQUE NOT NULL,
+                        password_hash VARCHAR(255) NOT NULL,
+                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    );
+                """)
             conn.commit() # Commit the transaction
-            print("Database table 'login_details' checked/created successfully (commit executed).")
-            created = True
-
+            logger.info("Database table 'login_details' checked/created successfully.")
+
+            # Separate transaction: recipe history is optional, logins are not
+            try:
+                with conn.cursor() as cur:
+                    ensure_recipes_schema(cur)
+                conn.commit()
+                logger.info("Database table 'recipes' and its indexes checked/created successfully.")
+            except Exception as e:
+                conn.rollback()
+                logger.warning("Could not create the recipes table; recipe history and corpus lookups will fail: %s", e)
+            return True
+    except PoolError as e:
+        logger.error("Database connection unavailable for init_db: %s", e)
     except psycopg2.Error as e:
-        print(f"Error initializing database table: {e}")
-        conn.rollback() # Rollback any partial changes
+        logger.error("Error initializing database table: %s", e)
     except Exception as e:
-        print(f"Unexpected error during init_db: {e}")
-        conn.rollback()
-    finally:
-        put_db_conn(conn) # Always return the connection
-    return created
+        logger.exception("Unexpected error during init_db: %s", e)
+    return False # Indicate failure
+
+# --- Conditional Pages ---
+
+def conditional_page(body, etag, cache_control):
+    """HTML response with an ETag; answers 304 when the client already has this version."""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='text/html')
+    # Weak, so the tag stays valid for the gzip/br copies ResponseCompressor sends
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Cookie') # The page reflects login state
+    return response
+
+def render_home(logged_in):
+    """(body, etag) of the home page. Only login state varies it, so it is rendered once per state."""
+    cache = get_services().page_cache
+    key = ('home', bool(logged_in), request.script_root)
+    # Pending flash messages appear in the page, and in debug mode templates may change under us
+    cacheable = current_app.config['PAGE_CACHE_TTL'] > 0 and '_flashes' not in session and not current_app.debug
+    page = cache.get(key) if cacheable else None
+    if page is None:
+        body = render_template('index.html', logged_in=logged_in).encode('utf-8')
+        page = (body, hashlib.sha256(body).hexdigest()[:32])
+        if cacheable:
+            cache.set(key, page)
+    return page
+
+def share_etag(digest, logged_in):
+    # The page also reflects login state and links to the current assets, so both are part of the validator
+    return f"{digest[:32]}-{int(bool(logged_in))}-{current_app.extensions['assets'].version}"
+
+def share_cache_control():
+    return f"private, max-age={int(os.getenv('SHARE_MAX_AGE', '300'))}"
+
 
 # --- Routes ---
 
-@app.route('/')
+@route('/')
 def home():
     """Main application page. Allows access even if not logged in."""
-    return render_template('index.html', logged_in=session.get('logged_in', False))
+    body, etag = render_home(session.get('logged_in', False))
+    return conditional_page(body, etag, 'private, no-cache')
 
-@app.route('/register', methods=['GET', 'POST'])
+@route('/register', methods=['GET', 'POST'])
 def register():
     """Handles user registration."""
     if session.get('logged_in'):
@@ -171,55 +308,52 @@ def register():
             return render_template('register.html'), 400
 
         # Database Interaction
-        conn = None # Ensure conn is defined outside try
-        cur = None # Ensure cur is defined outside try
         try:
-            conn = get_db_conn()
-            if not conn:
-                flash("Registration service temporarily unavailable [DB Pool Error]. Please try again later.", "error")
-                return render_template('register.html'), 503
-
-            cur = conn.cursor()
-            # Check if email already exists
-            cur.execute("SELECT user_id FROM login_details WHERE email = %s;", (email,))
-            existing_user = cur.fetchone()
-
-            if existing_user:
-                flash("Email address already registered. Please log in.", "warning")
-                return render_template('register.html'), 409 # Conflict
-
-            # Hash password and insert new user
-            hashed_password = generate_password_hash(password)
-            cur.execute(
-                "INSERT INTO login_details (email, password_hash) VALUES (%s, %s);",
-                (email, hashed_password)
-            )
-            conn.commit()
+            # Hashed in the pool before checking out a DB connection, so the connection isn't held meanwhile
+            hashed_password = hash_password(password)
+            with get_services().db_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    # Check if email already exists
+                    cur.execute("SELECT user_id FROM login_details WHERE email = %s;", (email,))
+                    existing_user = cur.fetchone()
+
+                    if existing_user:
+                        flash("Email address already registered. Please log in.", "warning")
+                        return render_template('register.html'), 409 # Conflict
+
+                    # Insert new user
+                    cur.execute(
+                        "INSERT INTO login_details (email, password_hash) VALUES (%s, %s);",
+                        (email, hashed_password)
+                    )
+                conn.commit()
             flash("Registration successful! Please log in.", "success")
             return redirect(url_for('login'))
 
+        except HasherBusy as e:
+            logger.warning("Password hashing overloaded during registration: %s", e)
+            flash("Registration is busy right now. Please try again in a moment.", "error")
+            return render_template('register.html'), 503
+        except PoolError as e:
+            logger.error("DB pool error during registration: %s", e)
+            flash("Registration service temporarily unavailable [DB Pool Error]. Please try again later.", "error")
+            return render_template('register.html'), 503
         except psycopg2.Error as e:
-            if conn: conn.rollback() # Rollback only if connection exists
-            print(f"Database error during registration: {e}")
+            # The pool rolls back the transaction when the connection is returned
+            logger.error("Database error during registration: %s", e)
             flash("An error occurred during registration. Please try again.", "error")
             # Check for specific errors if needed (e.g., unique constraint violation if check failed somehow)
             return render_template('register.html'), 500 # Internal Server Error
         except Exception as e:
-            if conn: conn.rollback()
-            print(f"Unexpected error during registration: {e}")
+            logger.exception("Unexpected error during registration: %s", e)
             flash("An unexpected error occurred. Please try again.", "error")
             return render_template('register.html'), 500
-        finally:
-            if cur:
-                cur.close()
-            if conn:
-                put_db_conn(conn)
 
     # For GET request
     return render_template('register.html')
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('/login', methods=['GET', 'POST'])
 def login():
     """Handles user login."""
     if session.get('logged_in'):
@@ -237,19 +371,18 @@ def login():
              flash("Invalid email format.", "error")
              return render_template('login.html'), 400
 
-        conn = None
-        cur = None
         try:
-            conn = get_db_conn()
-            if not conn:
-                flash("Login service temporarily unavailable [DB Pool Error]. Please try again later.", "error")
-                return render_template('login.html'), 503
+            with get_services().db_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT user_id, email, password_hash FROM login_details WHERE email = %s;", (email,))
+                    user = cur.fetchone() # Returns tuple (id, email, hash) or None
 
-            cur = conn.cursor()
-            cur.execute("SELECT user_id, email, password_hash FROM login_details WHERE email = %s;", (email,))
-            user = cur.fetchone() # Returns tuple (id, email, hash) or None
+            password_ok = False
+            if user:
+                password_ok = verify_password(user[2], password) # user[2] is password_hash
 
-            if user and check_password_hash(user[2], password): # user[2] is password_hash
+            if password_ok:
+                upgrade_password_hash(user[0], user[2], password)
                 # Login successful - Set up session
                 session.clear() # Prevent session fixation attacks
                 session['logged_in'] = True
@@ -263,25 +396,50 @@ def login():
                 flash("Invalid email or password.", "error")
                 return render_template('login.html'), 401 # Unauthorized
 
+        except HasherBusy as e:
+            logger.warning("Password hashing overloaded during login: %s", e)
+            flash("Login is busy right now. Please try again in a moment.", "error")
+            return render_template('login.html'), 503
+        except PoolError as e:
+            logger.error("DB pool error during login: %s", e)
+            flash("Login service temporarily unavailable [DB Pool Error]. Please try again later.", "error")
+            return render_template('login.html'), 503
         except psycopg2.Error as e:
-            print(f"Database error during login: {e}")
+            logger.error("Database error during login: %s", e)
             flash("An error occurred during login. Please try again.", "error")
             return render_template('login.html'), 500
         except Exception as e:
-            print(f"Unexpected error during login: {e}")
+            logger.exception("Unexpected error during login: %s", e)
             flash("An unexpected error occurred. Please try again.", "error")
             return render_template('login.html'), 500
-        finally:
-            if cur:
-                cur.close()
-            if conn:
-                put_db_conn(conn)
 
     # For GET request or if login fails/validation fails
     return render_template('login.html')
 
 
-@app.route('/logout')
+def upgrade_password_hash(user_id, stored_hash, password):
+    """
+    Rehashes a just-verified password if its stored hash predates the current
+    PASSWORD_HASH_METHOD. Failures are only logged: the login still succeeds.
+    """
+    try:
+        new_hash = rehash_if_needed(stored_hash, password)
+        if new_hash is None:
+            return
+        with get_services().db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                # Only replaces the hash that was verified, never a password changed meanwhile
+                cur.execute(
+                    "UPDATE login_details SET password_hash = %s WHERE user_id = %s AND password_hash = %s;",
+                    (new_hash, user_id, stored_hash)
+                )
+            conn.commit()
+        logger.info("Upgraded password hash for user %s to %s.", user_id, new_hash.split('$', 1)[0])
+    except Exception as e:
+        logger.warning("Could not upgrade password hash for user %s: %s", user_id, e)
+
+
+@route('/logout')
 def logout():
     """Logs the user out by clearing the session."""
     session.clear() # Clears all session data
@@ -289,45 +447,284 @@ def logout():
     return redirect(url_for('login'))
 
 
+# --- Rate Limiting ---
+
+def rate_limit_key():
+    """Logged-in users are limited per account, everyone else per client IP."""
+    user_id = session.get('user_id')
+    return f"user:{user_id}" if user_id else f"ip:{request.remote_addr}"
+
+def rate_limited(degrade=None, cost=None):
+    """
+    Applies the per-client token bucket to an LLM endpoint. Over the limit,
+    the request is answered at once: by `degrade()` (a response built without
+    calling Gemini, or None if it can't help) when RATE_LIMIT_OVERFLOW=degrade,
+    otherwise with 429 and Retry-After. `cost()` prices the request in tokens.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            rejection = check_rate_limit(degrade, cost)
+            return rejection if rejection is not None else view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def check_rate_limit(degrade=None, cost=None):
+    """
+    The check behind rate_limited() for the current request: None if it may
+    proceed, else the response to send instead. The native ASGI routes call
+    it directly (see asgi.py).
+    """
+    rate_limiter = get_services().rate_limiter
+    if rate_limiter is None:
+        return None
+    decision = rate_limiter.take(rate_limit_key(), cost() if cost else 1)
+    if decision.allowed:
+        return None
+
+    ADMISSION_REJECTIONS.inc(reason='rate_limit')
+    if degrade and current_app.config['RATE_LIMIT_OVERFLOW'] == 'degrade':
+        response = degrade()
+        if response is not None:
+            RATE_LIMITED_REQUESTS.inc(endpoint=request.endpoint, action='degraded')
+            response.headers['X-RateLimit-Degraded'] = '1'
+            return response
+    RATE_LIMITED_REQUESTS.inc(endpoint=request.endpoint, action='rejected')
+    response = jsonify({"error": "Too many requests. Please slow down.", "retry_after": round(decision.retry_after, 2)})
+    response.status_code = 429
+    response.headers['Retry-After'] = retry_after_header(decision.retry_after)
+    return response
+
+def degraded_generate():
+    """A /generate answer that never calls Gemini: cached or stored recipe, else mock_recipe."""
+    data = request.get_json(silent=True)
+    ingredients, filters, description = parse_generate_payload(data)
+    normalized = normalize_request(ingredients, filters, description)
+    prompt = format_gemini_prompt(normalized.ingredients, normalized.filters, normalized.description)
+    recipe_data = get_cached_result(prompt)
+    if recipe_data is None:
+        recipe_data = find_stored_recipe(normalized)
+    return jsonify(recipe_or_mock(recipe_data, ingredients))
+
+def degraded_substitute():
+    """A /substitute answer from the local knowledge base only (None on a miss)."""
+    data = request.get_json(silent=True)
+    ingredient = data.get('ingredient') if isinstance(data, dict) else None
+    if not isinstance(ingredient, str) or not ingredient.strip():
+        return None
+    known = get_substitution_store().lookup(ingredient, parse_substitution_context(data))
+    if not known:
+        return None
+    return jsonify({"ingredient": ingredient, "substitutions": known})
+
+def batch_cost():
+    data = request.get_json(silent=True)
+    specs = data.get('specs') if isinstance(data, dict) else None
+    return len(specs) if isinstance(specs, list) and specs else 1
+
+
 # --- API Endpoints ---
 
-@app.route('/generate', methods=['POST'])
+@route('/generate', methods=['POST'])
+@rate_limited(degrade=degraded_generate)
 def generate_recipe_api():
     """API endpoint to generate recipes using LLM."""
     if not request.is_json:
         return jsonify({"error": "Request must be JSON"}), 400
 
-    data = request.get_json()
-    ingredients = data.get('ingredients') if isinstance(data.get('ingredients'), list) else []
-    filters = data.get('filters') if isinstance(data.get('filters'), dict) else {}
-    description = data.get('description') if isinstance(data.get('description'), str) else ''
+    ingredients, filters, description = parse_generate_payload(request.get_json())
 
-    prompt = format_gemini_prompt(ingredients, filters, description)
-    print(f"--- Sending Recipe Prompt to Gemini ---") # Avoid logging full prompt if sensitive
+    # Canonicalize so equivalent requests build the same prompt (and cache key)
+    normalized = normalize_request(ingredients, filters, description)
+    user_id = session.get('user_id')
 
-    recipe_data = call_gemini_api(prompt) # Returns parsed JSON or None
+    if request.args.get('async', '').lower() in ['1', 'true', 'yes']:
+        return submit_generation_job(normalized, ingredients, filters, description, user_id)
 
-    # Perform recipe-specific validation
-    if (recipe_data
-            and isinstance(recipe_data, dict)
-            and all(k in recipe_data for k in ['title', 'ingredients', 'steps'])
-            and isinstance(recipe_data.get('ingredients'), list)
-            and isinstance(recipe_data.get('steps'), list)
-            and isinstance(recipe_data.get('title'), str) and recipe_data['title'].strip()):
+    prompt = format_gemini_prompt(normalized.ingredients, normalized.filters, normalized.description)
 
-        print(f"--- Received Valid Recipe Data ---")
-        return jsonify(recipe_data), 200 # OK
-    else:
-        print("--- LLM call failed or returned invalid recipe structure, using mock recipe ---")
-        if recipe_data:
-            print(f"--- Received Data (Invalid Structure): {json.dumps(recipe_data, indent=2)} ---")
-        else:
-            print("--- Received No Data from LLM API call ---")
-        mock = mock_recipe(ingredients)
-        return jsonify(mock), 200 # Return mock recipe with 200 OK status
+    known_recipe = find_known_recipe(user_id, normalized, prompt)
+    if known_recipe is not None:
+        return jsonify(known_recipe), 200
+
+    logger.debug("Sending recipe prompt to Gemini") # Avoid logging full prompt if sensitive
+
+    # Returns parsed JSON or None; never waits past the request deadline
+    fetched = []
+    recipe_data = call_gemini_api(prompt, validator=is_valid_recipe, deadline=request_deadline(), on_fetched=fetched.append)
+    if is_valid_recipe(recipe_data):
+        # Only the request that made the Gemini call adds the recipe to the corpus and index
+        record_generated_recipe(user_id, normalized, recipe_data, source='gemini' if fetched else 'cache')
+
+    # Valid LLM recipe, or mock recipe with 200 OK status on failure/invalid structure
+    return jsonify(recipe_or_mock(recipe_data, ingredients)), 200
+
+
+def find_known_recipe(user_id, normalized, prompt):
+    """
+    A recipe that answers a /generate request without calling Gemini, kept
+    in the user's history, or None. Cheapest first: the warm cache file
+    (microseconds, no I/O), the response cache (before any DB round trip),
+    then a stored recipe for these ingredients.
+    """
+    for source, lookup in (('warm', lambda: get_precomputed_result(prompt)),
+                           ('cache', lambda: get_cached_result(prompt)),
+                           ('corpus', lambda: find_stored_recipe(normalized))):
+        recipe_data = lookup()
+        if recipe_data is not None:
+            record_generated_recipe(user_id, normalized, recipe_data, source=source)
+            return recipe_data
+    return None
+
+
+def record_generated_recipe(user_id, normalized, recipe_data, source='gemini'):
+    """
+    Queues a recipe for history and, if Gemini just made it (source 'gemini'),
+    the retrieval index, both written off the request path. Recipes served
+    from the warm cache, response cache or corpus only go to a user's history.
+    """
+    services = get_services()
+    if current_app.config['RECIPE_HISTORY_ENABLED'] and (user_id or source == 'gemini'):
+        services.recipe_writer.submit(user_id, normalized, recipe_data, source=source)
+    if source == 'gemini' and services.retrieval_index is not None:
+        services.retrieval_index.submit(normalized, recipe_data)
+
+
+# --- Generation Jobs ---
+# POST /generate?async=1 answers 202 with a job ID at once; the recipe is
+# generated by the job queue's worker threads (see jobs.py) and fetched
+# from GET /jobs/<id>, which can long-poll with ?wait=<seconds>.
+
+def submit_generation_job(normalized, ingredients, filters, description, user_id):
+    try:
+        job_id, created = get_services().job_queue.submit(
+            normalized.fingerprint,
+            {"ingredients": ingredients, "filters": filters, "description": description},
+            user_id,
+        )
+    except QueueFull:
+        ADMISSION_REJECTIONS.inc(reason='job_queue_full')
+        response = jsonify({"error": "Too many recipes in progress. Please try again shortly."})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    except Exception as e:
+        logger.error("Error queueing generation job: %s", e)
+        return jsonify({"error": "Recipe jobs temporarily unavailable"}), 503
+    status_url = url_for('generation_job_api', job_id=job_id)
+    response = jsonify({"job_id": job_id, "status_url": status_url, "deduplicated": not created})
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+
+def run_generation_job(app, data, user_id):
+    """
+    Job body for POST /generate?async=1: the same work as the synchronous
+    path, with JOB_DEADLINE_SECONDS instead of the request SLO. Returns
+    (recipe, reusable); mock fallbacks are not reused by later submits.
+    """
+    with app.app_context():
+        ingredients, filters, description = parse_generate_payload(data)
+        normalized = normalize_request(ingredients, filters, description)
+        prompt = format_gemini_prompt(normalized.ingredients, normalized.filters, normalized.description)
+        known_recipe = find_known_recipe(user_id, normalized, prompt)
+        if known_recipe is not None:
+            return known_recipe, True
+
+        deadline = deadline_after(float(os.getenv('JOB_DEADLINE_SECONDS', '60')))
+        fetched = []
+        recipe_data = call_gemini_api(prompt, validator=is_valid_recipe, deadline=deadline, on_fetched=fetched.append)
+        if not is_valid_recipe(recipe_data):
+            return recipe_or_mock(recipe_data, ingredients), False
+        record_generated_recipe(user_id, normalized, recipe_data, source='gemini' if fetched else 'cache')
+        return recipe_data, True
+
+
+@route('/jobs/<job_id>')
+def generation_job_api(job_id):
+    """
+    Status of a generation job: 202 {"status": "queued" | "running"} while
+    pending, 200 {"status": "done", "recipe": {...}} or {"status": "failed",
+    "error": "..."} when finished, 404 once unknown or expired.
+    ?wait=N holds the request up to N seconds (max JOB_MAX_WAIT) for it to finish.
+    """
+    if len(job_id) > 32:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    try:
+        wait = max(0.0, min(float(request.args.get('wait', '0')), float(os.getenv('JOB_MAX_WAIT', '20'))))
+    except ValueError:
+        return jsonify({"error": "'wait' must be a number of seconds"}), 400
+    try:
+        job = get_services().job_queue.get(job_id, wait=wait)
+    except Exception as e:
+        logger.error("Error loading generation job %s: %s", job_id, e)
+        return jsonify({"error": "Recipe jobs temporarily unavailable"}), 503
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+
+    payload = {"job_id": job_id, "status": job['status']}
+    if job['status'] == 'done':
+        payload["recipe"] = job['result']
+        return jsonify(payload), 200
+    if job['status'] == 'failed':
+        payload["error"] = job['error']
+        return jsonify(payload), 200
+    response = jsonify(payload)
+    response.status_code = 202
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+@route('/generate/stream', methods=['POST'])
+@rate_limited()
+def generate_recipe_stream_api():
+    """Streams recipe generation as Server-Sent Events (title, ingredients, steps, then the full recipe)."""
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    ingredients, filters, description = parse_generate_payload(request.get_json())
+    normalized = normalize_request(ingredients, filters, description)
+    prompt = format_gemini_prompt(normalized.ingredients, normalized.filters, normalized.description)
+    logger.debug("Streaming recipe prompt to Gemini")
+
+    return Response(
+        stream_with_context(stream_recipe_events(prompt, ingredients, deadline=request_deadline())),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'} # Disable proxy buffering
+    )
+
+
+@route('/generate/batch', methods=['POST'])
+@rate_limited(cost=batch_cost)
+def generate_recipe_batch_api():
+    """
+    Generates several recipes in one request (e.g. a meal plan).
+    Body: {"specs": [{"ingredients": [...], "filters": {...}, "description": "..."}, ...], "pack": false}
+    Returns {"recipes": [...]} in the same order as the specs.
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    data = request.get_json()
+    specs = data.get('specs') if isinstance(data, dict) else None
+    if not isinstance(specs, list) or not specs:
+        return jsonify({"error": "Missing or invalid 'specs' list"}), 400
+
+    max_specs = int(os.getenv('BATCH_MAX_SPECS', '25'))
+    if len(specs) > max_specs:
+        return jsonify({"error": f"Too many specs (max {max_specs})"}), 400
+
+    parsed_specs = [parse_generate_payload(spec) for spec in specs]
+    pack = bool(data.get('pack', False))
+    logger.info("Generating batch of %d recipes (pack=%s)", len(parsed_specs), pack)
 
+    recipes = generate_batch(parsed_specs, pack=pack, deadline=request_deadline())
+    return jsonify({"recipes": recipes}), 200
 
-@app.route('/substitute', methods=['POST'])
+
+@route('/substitute', methods=['POST'])
+@rate_limited(degrade=degraded_substitute)
 def substitute_ingredient_api():
     """API endpoint for ingredient substitutions."""
     if not request.is_json:
@@ -335,12 +732,219 @@ def substitute_ingredient_api():
 
     data = request.get_json()
     ingredient = data.get('ingredient')
+    context = parse_substitution_context(data)
 
     if not ingredient or not isinstance(ingredient, str) or not ingredient.strip():
         return jsonify({"error": "Missing or invalid 'ingredient' field"}), 400
 
-    suggestions = get_substitutions(ingredient) # Uses the function from utils
+    suggestions = get_substitutions(ingredient, context, deadline=request_deadline()) # Uses the function from utils
+    payload, status_code = build_substitution_response(ingredient, suggestions)
+    return jsonify(payload), status_code
+
+
+# --- Recipe History & Search ---
+
+@route('/recipes/history')
+def recipe_history_api():
+    """
+    The logged-in user's recipes, newest first.
+    Query: ?limit=20&cursor=<next_cursor from the previous page>
+    Returns {"recipes": [...], "next_cursor": "..." | null}.
+    """
+    if not session.get('logged_in'):
+        return jsonify({"error": "Login required"}), 401
+    try:
+        items, next_cursor = get_services().recipe_corpus.history(
+            session['user_id'], limit=parse_limit(request.args.get('limit')), cursor=request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("Error loading recipe history: %s", e)
+        return jsonify({"error": "Recipe history temporarily unavailable"}), 503
+    return jsonify({"recipes": items, "next_cursor": next_cursor}), 200
+
+
+@route('/recipes/search')
+def recipe_search_api():
+    """
+    Searches previously generated recipes.
+      ?q=garlic noodles           full-text over titles and steps
+      ?ingredients=egg,rice,leek  recipes that need nothing beyond these
+    Returns {"recipes": [...]}.
+    """
+    limit = parse_limit(request.args.get('limit'))
+    query = request.args.get('q', '').strip()
+    ingredients = normalize_ingredients(request.args.get('ingredients', '').split(','))
+    if not query and not ingredients:
+        return jsonify({"error": "Provide 'q' or 'ingredients'"}), 400
+    try:
+        if ingredients:
+            results = get_services().recipe_corpus.with_ingredients(ingredients, limit=limit)
+        else:
+            results = get_services().recipe_corpus.search(query, limit=limit)
+    except Exception as e:
+        logger.error("Error searching recipes: %s", e)
+        return jsonify({"error": "Recipe search temporarily unavailable"}), 503
+    return jsonify({"recipes": results}), 200
+
+
+# --- Shopping List ---
+
+@route('/shopping-list')
+def get_shopping_list():
+    """
+    The logged-in user's shopping list:
+      {"version": 7, "full": true, "items": [...], "categories": [aisle order]}
+    ?since=<version> returns only what changed after it:
+      {"version": 9, "full": false, "items": [changed], "deleted": [ids]}
+    If-None-Match is answered with 304 after reading just the version.
+    """
+    if not session.get('logged_in'):
+        return jsonify({"error": "Login required"}), 401
+    user_id = session['user_id']
+    since = request.args.get('since')
+    try:
+        since = int(since) if since is not None else None
+    except ValueError:
+        return jsonify({"error": "'since' must be a list version"}), 400
+    store = get_services().shopping_lists
+    try:
+        etag = shopping_list_etag(user_id, store.version(user_id))
+        if request.if_none_match.contains_weak(etag):
+            SHOPPING_LIST_READS.inc(response='not_modified')
+            return conditional_json(None, etag)
+        payload = store.get(user_id, since=since)
+    except Exception as e:
+        logger.error("Error loading shopping list: %s", e)
+        return jsonify({"error": "Shopping list temporarily unavailable"}), 503
+    SHOPPING_LIST_READS.inc(response='full' if payload['full'] else 'delta')
+    return conditional_json(payload, shopping_list_etag(user_id, payload['version']))
+
+
+@route('/shopping-list', methods=['PATCH'])
+def patch_shopping_list():
+    """
+    Applies a batch of edits in one round trip:
+      {"base_version": 7, "ops": [
+          {"op": "add", "id": "<client id>", "name": "2 onions", "recipe": "Dal"},
+          {"op": "update", "id": "...", "checked": true},
+          {"op": "delete", "id": "..."},
+          {"op": "clear", "checked_only": true}]}
+    Returns the changes since base_version (same shape as GET ?since=)
+    plus "conflicts" for ops that lost to another device's edits.
+    """
+    if not session.get('logged_in'):
+        return jsonify({"error": "Login required"}), 401
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be an object"}), 400
+    user_id = session['user_id']
+    try:
+        payload = get_services().shopping_lists.patch(user_id, data.get('ops'), base_version=data.get('base_version'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("Error updating shopping list: %s", e)
+        return jsonify({"error": "Shopping list temporarily unavailable"}), 503
+    return conditional_json(payload, shopping_list_etag(user_id, payload['version']))
+
+
+@route('/shopping-list/categorize', methods=['POST'])
+def categorize_items():
+    """
+    Aisles for a batch of item names, for lists kept in the browser:
+    {"items": ["2 onions", "feta"]} -> {"categories": {"2 onions": "Produce", ...}, "order": [...]}.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+        return jsonify({"error": "'items' must be a list of strings"}), 400
+    if len(items) > int(os.getenv('SHOPPING_LIST_MAX_ITEMS', '500')):
+        return jsonify({"error": "Too many items"}), 413
+    return jsonify({"categories": {item: categorize(item) for item in items}, "order": category_order()}), 200
+
+
+def shopping_list_etag(user_id, version):
+    return f"list-{user_id}-{version}"
+
+def conditional_json(payload, etag):
+    """JSON response carrying a weak ETag, or a 304 when payload is None."""
+    response = jsonify(payload) if payload is not None else Response(status=304)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+def parse_limit(value, default=20, maximum=50):
+    """Page size from a query parameter, clamped to [1, maximum]."""
+    try:
+        return max(1, min(maximum, int(value)))
+    except (TypeError, ValueError):
+        return default
+
+
+def find_stored_recipe(normalized):
+    """
+    A previously generated recipe that can answer this request, or None:
+    the nearest-recipe index first (in memory), then the recipes table.
+    """
+    services = get_services()
+    if services.retrieval_index is not None:
+        try:
+            stored_recipe = services.retrieval_index.lookup(normalized)
+        except Exception as e:
+            logger.error("Retrieval index lookup failed: %s", e)
+            stored_recipe = None
+        if stored_recipe is not None:
+            return stored_recipe
+    if current_app.config['RECIPE_CORPUS_LOOKUP']:
+        return services.recipe_corpus.lookup(normalized)
+    return None
+
+
+def request_deadline():
+    """
+    Deadline for LLM work in this request. Defaults to GENERATE_SLO_SECONDS;
+    clients may ask for a tighter budget with an X-Request-Timeout header
+    (seconds), but never a looser one.
+    """
+    return slo_deadline(request.headers.get('X-Request-Timeout'))
+
+def slo_deadline(header=None):
+    """request_deadline() for an X-Request-Timeout value read elsewhere (the ASGI handlers)."""
+    slo = float(os.getenv('GENERATE_SLO_SECONDS', '20'))
+    budget = slo
+    if header:
+        try:
+            budget = min(slo, max(0.5, float(header)))
+        except ValueError:
+            pass # Ignore malformed values and keep the default SLO
+    return deadline_after(budget)
+
+
+def parse_generate_payload(data):
+    """Pulls (ingredients, filters, description) out of a /generate JSON body, with defaults."""
+    if not isinstance(data, dict):
+        data = {}
+    ingredients = data.get('ingredients') if isinstance(data.get('ingredients'), list) else []
+    filters = data.get('filters') if isinstance(data.get('filters'), dict) else {}
+    description = data.get('description') if isinstance(data.get('description'), str) else ''
+    return ingredients, filters, description
 
+
+def parse_substitution_context(data):
+    """Optional 'context' hint for /substitute ('baking' or 'savory'); anything else is ignored."""
+    context = data.get('context') if isinstance(data, dict) else None
+    if isinstance(context, str) and context.strip().lower() in SUBSTITUTION_CONTEXTS:
+        return context.strip().lower()
+    return None
+
+
+def build_substitution_response(ingredient, suggestions):
+    """Builds the /substitute JSON payload and status code from the suggestions list."""
     # Determine status code based on suggestion result
     status_code = 200 # Default OK
     if suggestions and isinstance(suggestions, list) and len(suggestions) > 0:
@@ -353,33 +957,77 @@ def substitute_ingredient_api():
          status_code = 500
          suggestions = ["Error processing substitution request."] # Provide error message
 
-    return jsonify({"ingredient": ingredient, "substitutions": suggestions}), status_code
+    return {"ingredient": ingredient, "substitutions": suggestions}, status_code
+
+
+# --- Recipe Sharing Routes ---
 
+@route('/share', methods=['POST'])
+def create_share_link():
+    """
+    Stores a recipe and returns a short link: {"id": "...", "url": ".../s/<id>"}.
+    The same recipe always maps to the same ID.
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    if request.content_length and request.content_length > int(os.getenv('SHARE_MAX_BYTES', '65536')):
+        return jsonify({"error": "Recipe too large to share"}), 413
+
+    data = request.get_json()
+    recipe = data.get('recipe', data) if isinstance(data, dict) else None
+    try:
+        share_id = get_services().share_store.save(recipe)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error saving shared recipe: %s", e)
+        return jsonify({"error": "Could not create share link"}), 503
+    return jsonify({"id": share_id, "url": url_for('short_shared_recipe', share_id=share_id, _external=True)}), 201
 
-# --- Recipe Sharing Route ---
 
-@app.route('/share')
+@route('/s/<share_id>')
+def short_shared_recipe(share_id):
+    """Serves a stored shared recipe. Responses carry an ETag so repeat visits can be answered with 304."""
+    if len(share_id) > 43:
+        flash("Invalid or missing share data in the link.", "warning")
+        return redirect(url_for('home'))
+    try:
+        entry = get_services().share_store.load(share_id)
+    except Exception as e:
+        logger.exception("Error loading shared recipe %s: %s", share_id, e)
+        flash("An unexpected error occurred loading the shared recipe.", "error")
+        return redirect(url_for('home'))
+    if entry is None:
+        flash("This shared recipe link was not found.", "warning")
+        return redirect(url_for('home'))
+
+    recipe_data, digest = entry
+    logged_in = session.get('logged_in', False)
+    etag = share_etag(digest, logged_in)
+    if request.if_none_match.contains_weak(etag):
+        return conditional_page(None, etag, share_cache_control())
+    return conditional_page(render_template('index.html', shared_recipe=recipe_data, logged_in=logged_in),
+                            etag, share_cache_control())
+
+
+@route('/share')
 def shared_recipe():
-    """Handles incoming shared recipe links (Stateless)."""
+    """Handles legacy stateless links that carry the whole recipe in ?data=. Repeat visits get a 304."""
     encoded_data = request.args.get('data')
 
     if not encoded_data:
         flash("Invalid or missing share data in the link.", "warning")
         return redirect(url_for('home'))
 
-    try:
-        # Decode URL-safe Base64 data
-        # Need to add padding back if it was stripped during JS encoding
-        # Python's urlsafe_b64decode often handles this, but manual padding can be safer
-        missing_padding = len(encoded_data) % 4
-        if missing_padding:
-            encoded_data += '=' * (4 - missing_padding)
-
-        decoded_bytes = base64.urlsafe_b64decode(encoded_data)
-        decoded_str = decoded_bytes.decode('utf-8')
+    # The link is the recipe, so its hash identifies the page without decoding anything
+    logged_in = session.get('logged_in', False)
+    etag = share_etag(hashlib.sha256(encoded_data.encode('utf-8')).hexdigest(), logged_in)
+    if request.if_none_match.contains_weak(etag):
+        return conditional_page(None, etag, share_cache_control())
 
-        # Parse the JSON string back into a recipe object
-        recipe_data = json.loads(decoded_str)
+    try:
+        # Decode URL-safe Base64 data and parse the JSON back into a recipe object
+        recipe_data = decode_share_data(encoded_data)
 
         # Basic validation of the decoded data structure
         if not isinstance(recipe_data, dict) or not all(k in recipe_data for k in ['title', 'ingredients', 'steps']):
@@ -387,57 +1035,65 @@ def shared_recipe():
              return redirect(url_for('home'))
 
         # Render the main template, passing the recipe data
-        print(f"Displaying shared recipe via URL: {recipe_data.get('title', 'Untitled')}")
-        return render_template('index.html',
+        logger.info("Displaying shared recipe via URL: %s", recipe_data.get('title', 'Untitled'))
+        body = render_template('index.html',
                                shared_recipe=recipe_data, # Pass data to template
-                               logged_in=session.get('logged_in', False)) # Maintain login status view
+                               logged_in=logged_in) # Maintain login status view
+        return conditional_page(body, etag, share_cache_control())
 
     except (base64.binascii.Error, ValueError) as e:
-        print(f"Error decoding Base64 share data: {e}. Input: {encoded_data[:50]}...") # Log partial input
+        logger.warning("Error decoding Base64 share data: %s. Input: %s...", e, encoded_data[:50]) # Log partial input
         flash("Could not decode the shared recipe link. It might be incomplete or corrupted.", "error")
         return redirect(url_for('home'))
     except json.JSONDecodeError as e:
-        print(f"Error parsing JSON from shared data: {e}")
+        logger.warning("Error parsing JSON from shared data: %s", e)
         flash("Could not read the shared recipe data format.", "error")
         return redirect(url_for('home'))
     except Exception as e:
-        print(f"Unexpected error handling shared link: {e}")
+        logger.exception("Unexpected error handling shared link: %s", e)
         flash("An unexpected error occurred loading the shared recipe.", "error")
         return redirect(url_for('home'))
 
 
+# --- Metrics & Health Check ---
+
+@route('/metrics')
+def metrics_endpoint():
+    """Prometheus text-format metrics (summed across workers when METRICS_MULTIPROC_DIR is set)."""
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+@route('/healthz')
+def health_check():
+    """Reports DB reachability plus pool gauges (in-use, idle, wait times)."""
+    db_pool = get_services().db_pool
+    db_ok = db_pool.health_check()
+    return jsonify({"status": "ok" if db_ok else "degraded", "db": db_ok, "db_pool": db_pool.stats()}), 200 if db_ok else 503
+
+
 # --- Application Context Teardown ---
-@app.teardown_appcontext
 def handle_app_context_teardown(exception=None):
     """Placeholder for any request-specific cleanup if needed."""
     # *** DO NOT CLOSE THE DB POOL HERE ***
-    # Connections are returned to the pool via put_db_conn() in routes.
-    # Pool is managed globally for the app's lifetime.
+    # Connections are returned to the pool by db_pool.connection() in routes.
+    # Each process keeps its pool for its lifetime (see services.py).
     if exception:
          # Log any exceptions that caused the context to tear down abnormally
-         print(f"App context teardown triggered by exception: {exception}")
+         logger.error("App context teardown triggered by exception: %s", exception)
+
+
+# Default app for `flask --app app`, asgi.py and the benches; building it does no I/O
+app = create_app()
 
 
 # --- Main Execution ---
 if __name__ == '__main__':
-    # Attempt to initialize DB schema only if the pool was created
-    if db_pool:
-        init_success = init_db()
-        if not init_success:
-             print("WARNING: Database initialization failed. Table 'login_details' might be missing.")
-    else:
-         print("WARNING: Database connection pool is unavailable. DB features will fail.")
+    # Development server only. Create tables first with `flask --app app init-db`;
+    # production runs under gunicorn (see gunicorn.conf.py).
 
     # Determine debug mode from environment variable or default to True for development
     # Set FLASK_DEBUG=0 or FLASK_ENV=production in .env for production
     debug_mode = os.getenv('FLASK_DEBUG', '1').lower() in ['true', '1', 't', 'yes', 'on']
-    print(f"Starting Flask app with debug mode: {debug_mode}")
+    logger.info("Starting Flask app with debug mode: %s", debug_mode)
 
     # Use host='0.0.0.0' to make accessible on network
     app.run(host='0.0.0.0', port=5000, debug=debug_mode)
-
-    # Code here will run after the server stops (e.g., Ctrl+C)
-    # Proper place to close the pool if needed, though Python exit usually handles it
-    # print("Flask server shutting down. Closing DB pool.")
-    # if db_pool:
-    #     db_pool.closeall()
\ No newline at end of file
@@ -0,0 +1,227 @@
+# asgi.py
+"""
+ASGI entry point for the async serving mode:
+
+    uvicorn asgi:application --workers 4
+
+POST /generate and /substitute are served natively on the event loop, so a
+Gemini round trip holds a coroutine rather than a worker thread. They are
+admitted like the Flask routes: the same per-client rate limit (and
+degraded answers) and the same outbound Gemini concurrency limit, and
+/generate checks stored recipes and records new ones (history, retrieval
+index) exactly as the Flask route does. All other routes (pages, auth,
+sharing), and POST /generate?async=1 (a queued job), are delegated to the
+regular Flask app. The WSGI entry point (app.py / flask run) keeps working
+unchanged.
+"""
+import asyncio
+import time
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import session
+from werkzeug.test import EnvironBuilder
+
+from app import (
+    app as flask_app, build_substitution_response, check_rate_limit, degraded_generate, degraded_substitute,
+    find_known_recipe, parse_generate_payload, parse_substitution_context, record_generated_recipe, slo_deadline, warm_up
+)
+import jsoncodec
+from normalize import normalize_request
+from utils import format_gemini_prompt, is_valid_recipe, recipe_or_mock
+from gemini_async import call_gemini_api_async, get_substitutions_async, close_async_gemini_client
+from metrics import HTTP_REQUEST_DURATION
+from logging_config import new_request_id
+
+wsgi_application = WsgiToAsgi(flask_app)
+
+MAX_BODY_BYTES = 1024 * 1024 # Reject oversized JSON bodies early
+
+# --- Helpers ---
+
+async def _read_body(receive):
+    """Returns the raw request body, or raises ValueError if it is too large."""
+    body = bytearray()
+    more_body = True
+    while more_body:
+        message = await receive()
+        body.extend(message.get('body', b''))
+        more_body = message.get('more_body', False)
+        if len(body) > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+    return bytes(body)
+
+def _parse_json_body(scope, body):
+    """Returns the parsed JSON body, or raises ValueError if it isn't JSON."""
+    headers = dict(scope.get('headers') or [])
+    content_type = headers.get(b'content-type', b'').decode('latin-1').lower()
+    if 'json' not in content_type:
+        raise ValueError("Request must be JSON")
+    try:
+        return jsoncodec.loads(body or b'null')
+    except jsoncodec.JSONDecodeError:
+        raise ValueError("Request must be JSON")
+
+def _flask_environ(scope, body):
+    """A WSGI environ for the ASGI request, so Flask's session (user ID) and client IP read as in the Flask routes."""
+    client = scope.get('client') or ('', 0)
+    return EnvironBuilder(
+        path=scope['path'], method=scope['method'], data=body,
+        query_string=scope.get('query_string', b'').decode('latin-1'),
+        headers=[(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope.get('headers') or []],
+        environ_base={'REMOTE_ADDR': client[0]},
+    ).get_environ()
+
+def _check_rate_limit(scope, body, degrade):
+    """
+    app.check_rate_limit in a Flask request context rebuilt from the ASGI
+    request, so the session (user ID), client IP and degraded answers are
+    exactly the Flask routes'. Returns None or (status, headers, body).
+    """
+    with flask_app.request_context(_flask_environ(scope, body)):
+        response = check_rate_limit(degrade)
+        if response is None:
+            return None
+        return response.status_code, response.headers.to_wsgi_list(), response.get_data()
+
+async def _admit(scope, body, degrade, send):
+    """Returns True if the request may proceed; otherwise sends the rate limit answer and returns False."""
+    # A thread, since the limiter and session stores may hit SQLite/Postgres
+    rejection = await asyncio.to_thread(_check_rate_limit, scope, body, degrade)
+    if rejection is None:
+        return True
+    status, headers, payload = rejection
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+    return False
+
+def _find_known_recipe(scope, body, normalized, prompt):
+    """app.find_known_recipe for a native route. Returns (user ID, recipe or None)."""
+    with flask_app.request_context(_flask_environ(scope, body)):
+        user_id = session.get('user_id')
+        return user_id, find_known_recipe(user_id, normalized, prompt)
+
+def _record_generated_recipe(user_id, normalized, recipe_data, source):
+    with flask_app.app_context():
+        record_generated_recipe(user_id, normalized, recipe_data, source=source)
+
+def _request_deadline(scope):
+    """app.request_deadline for a native route: GENERATE_SLO_SECONDS, or a tighter X-Request-Timeout."""
+    headers = dict(scope.get('headers') or [])
+    return slo_deadline(headers.get(b'x-request-timeout', b'').decode('latin-1'))
+
+async def _send_json(send, payload, status=200):
+    body = jsoncodec.dumps_bytes(payload)
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+# --- Async Routes ---
+
+async def generate_recipe_async(scope, receive, send):
+    """Async equivalent of app.generate_recipe_api."""
+    try:
+        body = await _read_body(receive)
+    except ValueError as e:
+        return await _send_json(send, {"error": str(e)}, 400)
+    if not await _admit(scope, body, degraded_generate, send):
+        return
+    try:
+        data = _parse_json_body(scope, body)
+    except ValueError as e:
+        return await _send_json(send, {"error": str(e)}, 400)
+
+    ingredients, filters, description = parse_generate_payload(data)
+    normalized = normalize_request(ingredients, filters, description)
+    prompt = format_gemini_prompt(normalized.ingredients, normalized.filters, normalized.description)
+
+    # Threads, since the session store, recipes table and retrieval index may block on SQLite/Postgres/disk
+    user_id, known_recipe = await asyncio.to_thread(_find_known_recipe, scope, body, normalized, prompt)
+    if known_recipe is not None:
+        return await _send_json(send, known_recipe, 200)
+
+    fetched = []
+    recipe_data = await call_gemini_api_async(prompt, validator=is_valid_recipe, deadline=_request_deadline(scope),
+                                              on_fetched=fetched.append)
+    if is_valid_recipe(recipe_data):
+        await asyncio.to_thread(_record_generated_recipe, user_id, normalized, recipe_data,
+                                'gemini' if fetched else 'cache')
+    await _send_json(send, recipe_or_mock(recipe_data, ingredients), 200)
+
+async def substitute_ingredient_async(scope, receive, send):
+    """Async equivalent of app.substitute_ingredient_api."""
+    try:
+        body = await _read_body(receive)
+    except ValueError as e:
+        return await _send_json(send, {"error": str(e)}, 400)
+    if not await _admit(scope, body, degraded_substitute, send):
+        return
+    try:
+        data = _parse_json_body(scope, body)
+    except ValueError as e:
+        return await _send_json(send, {"error": str(e)}, 400)
+
+    ingredient = data.get('ingredient') if isinstance(data, dict) else None
+    if not ingredient or not isinstance(ingredient, str) or not ingredient.strip():
+        return await _send_json(send, {"error": "Missing or invalid 'ingredient' field"}, 400)
+
+    suggestions = await get_substitutions_async(ingredient, parse_substitution_context(data), _request_deadline(scope))
+    payload, status_code = build_substitution_response(ingredient, suggestions)
+    await _send_json(send, payload, status_code)
+
+ASYNC_ROUTES = {
+    '/generate': generate_recipe_async,
+    '/substitute': substitute_ingredient_async,
+}
+
+
+# --- ASGI Application ---
+
+async def _instrumented(handler, scope, receive, send):
+    """Gives native routes the same request ID and request-duration metrics as the Flask hooks."""
+    started = time.perf_counter()
+    status = [500]
+    headers = dict(scope.get('headers') or [])
+    request_id = new_request_id(headers.get(b'x-request-id', b'').decode('latin-1'))
+
+    async def send_with_status(message):
+        if message['type'] == 'http.response.start':
+            status[0] = message['status']
+            message = dict(message, headers=list(message.get('headers', [])) + [(b'x-request-id', request_id.encode())])
+        await send(message)
+
+    try:
+        await handler(scope, receive, send_with_status)
+    finally:
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - started,
+                                      method=scope['method'], route=scope['path'], status=status[0])
+
+async def _lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Native routes never run Flask's before_request hooks, so bind the warm cache etc. here
+            await asyncio.to_thread(warm_up, flask_app)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_gemini_client()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(scope, receive, send)
+    if scope['type'] == 'http' and scope['method'] == 'POST':
+        handler = ASYNC_ROUTES.get(scope['path'])
+        # ?async=1 submits a generation job, which only the Flask route implements
+        if handler and 'async' not in parse_qs(scope.get('query_string', b'').decode('latin-1')):
+            return await _instrumented(handler, scope, receive, send)
+    await wsgi_application(scope, receive, send)
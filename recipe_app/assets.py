@@ -0,0 +1,231 @@
+# assets.py
+"""
+Fingerprinted, pre-compressed static files.
+
+url_for('static', filename='js/script.js') yields /static/js/script.<hash>.js,
+where <hash> is taken from the file's contents. Those URLs never change
+meaning, so they are served with a one-year `immutable` Cache-Control and
+browsers only fetch an asset again after it has actually changed. Build
+the compressed copies once per deploy:
+
+    python -m assets build     # writes script.js.br / script.js.gz next to each file
+    python -m assets stats
+"""
+import argparse
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+
+from compression import SUFFIXES, brotli, choose_encoding, compress, is_compressible
+
+logger = logging.getLogger(__name__)
+
+STATIC_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+IMMUTABLE_MAX_AGE = 31536000 # One year: the longest max-age caches honour
+
+_FINGERPRINT = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{12})(?P<ext>\.[^./]+)$')
+
+
+class Asset:
+    __slots__ = ('name', 'path', 'digest', 'hashed_name', 'mimetype', 'encodings')
+
+    def __init__(self, name, path, digest, encodings):
+        self.name = name
+        self.path = path
+        self.digest = digest
+        stem, ext = os.path.splitext(name)
+        self.hashed_name = f"{stem}.{digest}{ext}"
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.encodings = encodings # Pre-compressed variants on disk that are newer than the file, best first
+
+
+class AssetManifest:
+    """
+    Content hashes of every file under `root`, read on first use. With
+    `auto_reload` (debug mode) the directory is rescanned on every lookup,
+    so edited files get new URLs without a restart.
+    """
+
+    def __init__(self, root, fingerprint=True, auto_reload=False, max_age=300):
+        self.root = root
+        self.fingerprint = fingerprint
+        self.auto_reload = auto_reload
+        self.max_age = max_age # For unfingerprinted (or stale-hash) URLs
+        self._assets = None
+        self._by_hashed_name = {}
+        self._version = ''
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        assets = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            for filename in sorted(filenames):
+                if filename.startswith('.') or filename.endswith(tuple(SUFFIXES.values())):
+                    continue
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()[:12]
+                mtime = os.stat(path).st_mtime
+                encodings = tuple(
+                    encoding for encoding, suffix in SUFFIXES.items()
+                    if os.path.exists(path + suffix) and os.stat(path + suffix).st_mtime >= mtime
+                )
+                assets[name] = Asset(name, path, digest, encodings)
+        version = hashlib.sha256(''.join(a.name + a.digest for a in assets.values()).encode('utf-8')).hexdigest()[:12]
+        return assets, {a.hashed_name: a for a in assets.values()}, version
+
+    def _load(self):
+        if self._assets is None or self.auto_reload:
+            with self._lock:
+                if self._assets is None or self.auto_reload:
+                    self._assets, self._by_hashed_name, self._version = self._scan()
+                    logger.debug("Asset manifest: %d files under %s.", len(self._assets), self.root)
+        return self._assets
+
+    @property
+    def version(self):
+        """Changes whenever any asset does; part of ETags for pages that link to assets."""
+        self._load()
+        return self._version
+
+    def get(self, name):
+        return self._load().get(name)
+
+    def url_name(self, name):
+        """The filename to put in URLs: fingerprinted when the asset is known."""
+        asset = self.get(name)
+        return asset.hashed_name if asset is not None and self.fingerprint else name
+
+    def resolve(self, requested):
+        """
+        (asset, fingerprinted) for a requested filename. A hash that no longer
+        matches (a page cached from before a deploy) still gets the current
+        file, just without the long-lived cache headers.
+        """
+        assets = self._load()
+        asset = self._by_hashed_name.get(requested)
+        if asset is not None:
+            return asset, True
+        match = _FINGERPRINT.match(requested)
+        if match and match['stem'] + match['ext'] in assets:
+            return assets[match['stem'] + match['ext']], False
+        return assets.get(requested), False
+
+    def stats(self):
+        assets = self._load()
+        return {
+            "files": len(assets),
+            "version": self._version,
+            "precompressed": sum(1 for a in assets.values() if a.encodings),
+        }
+
+
+# --- Flask Integration ---
+
+def fingerprint_static_url(endpoint, values):
+    """url_defaults hook: rewrites url_for('static', filename=...) to the fingerprinted name."""
+    if endpoint == 'static' and 'filename' in values:
+        from flask import current_app
+        values['filename'] = current_app.extensions['assets'].url_name(values['filename'])
+
+def send_asset(filename):
+    """The 'static' endpoint: serves the pre-compressed variant the client accepts, if one was built."""
+    from flask import abort, current_app, request, send_file
+
+    manifest = current_app.extensions['assets']
+    asset, fingerprinted = manifest.resolve(filename)
+    if asset is None:
+        abort(404)
+    encoding = choose_encoding(request.accept_encodings, asset.encodings) if asset.encodings else None
+    path = asset.path + SUFFIXES[encoding] if encoding else asset.path
+    response = send_file(path, mimetype=asset.mimetype, conditional=True,
+                         max_age=IMMUTABLE_MAX_AGE if fingerprinted else manifest.max_age)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if asset.encodings:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    if fingerprinted:
+        response.cache_control.immutable = True
+    return response
+
+
+def build_asset_manifest(root=STATIC_ROOT, auto_reload=False):
+    """
+    Builds the manifest for the 'static' endpoint from environment variables:
+      STATIC_FINGERPRINT  - '1' (default) puts content hashes in static URLs; '0' keeps plain names
+      STATIC_MAX_AGE      - Cache-Control max-age for plain (unfingerprinted) URLs (default 300)
+    """
+    return AssetManifest(
+        root,
+        fingerprint=os.getenv('STATIC_FINGERPRINT', '1').lower() in ['true', '1', 't', 'yes', 'on'],
+        auto_reload=auto_reload,
+        max_age=int(os.getenv('STATIC_MAX_AGE', '300')),
+    )
+
+
+# --- Build Step ---
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def precompress(root=STATIC_ROOT, min_bytes=256):
+    """
+    Writes .br (quality 11, when brotli is installed) and .gz (level 9) next
+    to every compressible file of at least `min_bytes`, skipping variants
+    that wouldn't be smaller. Returns [(name, original size, {encoding: size})].
+    """
+    encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+    report = []
+    for name, asset in AssetManifest(root)._load().items():
+        with open(asset.path, 'rb') as f:
+            data = f.read()
+        if len(data) < min_bytes or not is_compressible(asset.mimetype):
+            continue
+        sizes = {}
+        for encoding in encodings:
+            packed = compress(data, encoding, gzip_level=9, brotli_quality=11)
+            variant = asset.path + SUFFIXES[encoding]
+            if len(packed) < len(data):
+                _write_atomic(variant, packed)
+                sizes[encoding] = len(packed)
+            elif os.path.exists(variant):
+                os.remove(variant)
+        report.append((name, len(data), sizes))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Static asset build step (pre-compressed copies) and manifest info.")
+    parser.add_argument('--root', default=STATIC_ROOT, help="Static directory (default: the app's static/)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build_cmd = sub.add_parser('build', help="Write .br/.gz copies of compressible static files")
+    build_cmd.add_argument('--min-bytes', type=int, default=256, help="Smaller files are left uncompressed")
+    sub.add_parser('stats', help="Show fingerprinted names and available encodings")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    if args.command == 'build':
+        if brotli is None:
+            logger.warning("brotli module not installed; writing .gz copies only.")
+        for name, size, sizes in precompress(args.root, args.min_bytes):
+            variants = '  '.join(f"{encoding} {packed} ({packed / size:.0%})" for encoding, packed in sizes.items())
+            print(f"{name:<32} {size:>8}  {variants or 'not smaller; skipped'}")
+        return
+
+    manifest = AssetManifest(args.root)
+    for name, asset in manifest._load().items():
+        print(f"{name:<32} {asset.hashed_name:<40} {','.join(asset.encodings) or '-'}")
+    print(manifest.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# batch.py
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import make_cache_key
+from normalize import normalize_request
+from utils import (
+    GEMINI_MODEL, GENERATION_CONFIG, format_gemini_prompt, format_multi_recipe_prompt,
+    call_gemini_api, get_cached_response, get_response_cache, is_valid_recipe, recipe_or_mock,
+    multi_recipe_generation_config
+)
+
+# Shared executor so concurrent batch requests together never exceed
+# BATCH_CONCURRENCY outbound LLM calls from this process.
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('BATCH_CONCURRENCY', '4')),
+                    thread_name_prefix='batch-generate'
+                )
+    return _executor
+
+
+def _map_in_context(executor, fn, items):
+    """executor.map that runs each call in a copy of the caller's context (keeps the request ID on log records)."""
+    items = list(items)
+    return executor.map(lambda item, ctx: ctx.run(fn, item), items, [contextvars.copy_context() for _ in items])
+
+
+def _generate_one(normalized, deadline=None):
+    """Single-recipe path: same prompt (and cache key) as /generate."""
+    prompt = format_gemini_prompt(normalized.ingredients, normalized.filters, normalized.description)
+    return call_gemini_api(prompt, validator=is_valid_recipe, deadline=deadline)
+
+def _generate_packed(group, deadline=None):
+    """
+    Asks for several recipes in one call. Valid recipes are also cached under
+    each spec's single-recipe key so later /generate calls for them hit.
+    Returns a list aligned with `group` (None where the model gave nothing usable).
+    """
+    prompt = format_multi_recipe_prompt([(n.ingredients, n.filters, n.description) for n in group])
+    response = call_gemini_api(
+        prompt,
+        validator=lambda data: isinstance(data, dict) and isinstance(data.get('recipes'), list),
+        deadline=deadline,
+        generation_config=multi_recipe_generation_config(len(group))
+    )
+    recipes = response.get('recipes') if isinstance(response, dict) else None
+    if not isinstance(recipes, list):
+        return [None] * len(group)
+
+    cache = get_response_cache()
+    results = []
+    for index, normalized in enumerate(group):
+        recipe = recipes[index] if index < len(recipes) else None
+        if is_valid_recipe(recipe):
+            single_prompt = format_gemini_prompt(normalized.ingredients, normalized.filters, normalized.description)
+            cache.set(make_cache_key(single_prompt, GENERATION_CONFIG, GEMINI_MODEL), recipe)
+            results.append(recipe)
+        else:
+            results.append(None)
+    return results
+
+
+def generate_batch(specs, pack=False, pack_size=None, deadline=None):
+    """
+    Generates recipes for a list of (ingredients, filters, description) specs.
+    Identical specs (after normalization) are generated once. Unique specs
+    are fanned out on the shared bounded executor; with pack=True, specs not
+    already cached are grouped `pack_size` at a time into multi-recipe
+    prompts. Results come back in input order, with mock_recipe substituted
+    for any item that failed or did not finish before `deadline`.
+    """
+    pack_size = pack_size or int(os.getenv('BATCH_PACK_SIZE', '4'))
+    normalized_specs = [normalize_request(*spec) for spec in specs]
+
+    # Dedupe by request fingerprint, keeping first-seen order
+    unique = {}
+    for normalized in normalized_specs:
+        unique.setdefault(normalized.fingerprint, normalized)
+
+    results = {} # fingerprint -> recipe data or None
+    executor = _get_executor()
+    pending = list(unique.values())
+
+    if pack and len(pending) > 1:
+        # Serve what's already cached; only pack the rest
+        uncached = []
+        for normalized in pending:
+            prompt = format_gemini_prompt(normalized.ingredients, normalized.filters, normalized.description)
+            cached = get_cached_response(make_cache_key(prompt, GENERATION_CONFIG, GEMINI_MODEL))
+            if cached is not None:
+                results[normalized.fingerprint] = cached
+            else:
+                uncached.append(normalized)
+        groups = [uncached[i:i + pack_size] for i in range(0, len(uncached), pack_size)]
+        packed = _map_in_context(executor, lambda group: _generate_packed(group, deadline), groups)
+        for group, group_results in zip(groups, packed):
+            for normalized, recipe in zip(group, group_results):
+                results[normalized.fingerprint] = recipe
+        # Anything the packed answer missed gets one individual attempt
+        pending = [n for n in uncached if results.get(n.fingerprint) is None]
+
+    for normalized, recipe in zip(pending, _map_in_context(executor, lambda n: _generate_one(n, deadline), pending)):
+        results[normalized.fingerprint] = recipe
+
+    return [
+        recipe_or_mock(results.get(normalized.fingerprint), spec[0])
+        for spec, normalized in zip(specs, normalized_specs)
+    ]
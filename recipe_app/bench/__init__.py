@@ -0,0 +1,12 @@
+# bench/__init__.py
+"""
+Benchmark harness. Run from the recipe_app directory:
+
+    python -m bench.fake_gemini --port 8765 --latency 0.8 --error-rate 0.02
+    python -m bench.load --scenario generate --concurrency 16 --requests 500
+    python -m bench.micro
+
+bench.load starts the app in-process against a local fake Gemini server
+(bench.fake_gemini) and a SQLite stand-in for login_details (bench.sqlite_db),
+so no API quota or Postgres server is needed.
+"""
@@ -0,0 +1,195 @@
+# bench/fake_gemini.py
+"""
+Local stand-in for the Gemini generateContent / streamGenerateContent
+endpoints. Point the app at it with GEMINI_API_BASE=http://127.0.0.1:<port>/v1beta.
+
+    python -m bench.fake_gemini --port 8765 --latency 0.8 --jitter 0.2 --error-rate 0.05 --payload-size 4096
+    python -m bench.fake_gemini --tail-rate 0.05 --tail-latency 6 --model-latency gemini-1.5-flash-8b=0.3
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _recipe(payload_size):
+    """A valid recipe; steps are padded so the JSON is roughly `payload_size` bytes."""
+    recipe = {
+        "title": "Benchmark Skillet",
+        "description": "Generated by the fake Gemini server.",
+        "ingredients": ["1 cup rice", "2 eggs", "1 tbsp soy sauce"],
+        "steps": ["Cook the rice.", "Scramble the eggs.", "Combine and season."],
+        "prep_time": "10 minutes",
+        "cook_time": "15 minutes",
+    }
+    padding = payload_size - len(json.dumps(recipe))
+    step = 0
+    while padding > 0:
+        text = f"Extra step {step}: " + "stir gently " * min(80, max(1, padding // 12))
+        recipe["steps"].append(text)
+        padding -= len(text) + 4
+        step += 1
+    return recipe
+
+def fake_response_text(prompt, payload_size):
+    """JSON text the model would return for `prompt` (recipe, recipe list or substitutes)."""
+    if "'substitutes'" in prompt:
+        return json.dumps({"substitutes": ["applesauce", "mashed banana", "yogurt"]})
+    if "'recipes'" in prompt:
+        match = re.match(r"Generate (\d+) separate recipes", prompt)
+        count = int(match.group(1)) if match else 1
+        return json.dumps({"recipes": [_recipe(payload_size) for _ in range(count)]})
+    return json.dumps(_recipe(payload_size))
+
+def _model_from_path(path):
+    """'/v1beta/models/gemini-1.5-flash-latest:generateContent?key=...' -> 'gemini-1.5-flash-latest'."""
+    match = re.search(r"/models/([^/:?]+)", path)
+    return match.group(1) if match else None
+
+def parse_model_latencies(items):
+    """['model=0.3', ...] -> {'model': 0.3, ...}."""
+    latencies = {}
+    for item in items or []:
+        model, _, seconds = item.partition('=')
+        latencies[model.strip()] = float(seconds)
+    return latencies
+
+def _envelope(text, finish_reason="STOP"):
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": finish_reason}]}
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive, like the real API
+    server_version = 'FakeGemini/1.0'
+
+    def log_message(self, format, *args):
+        pass # Quiet; the load generator reports the numbers
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        config = self.server.config
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            request_json = json.loads(body)
+            prompt = request_json["contents"][0]["parts"][0]["text"]
+        except (ValueError, KeyError, IndexError):
+            return self._send_json(400, {"error": {"code": 400, "message": "Invalid request body"}})
+
+        mean = config['model_latency'].get(_model_from_path(self.path), config['latency'])
+        latency = max(0.0, random.gauss(mean, config['jitter'])) if config['jitter'] else mean
+        if config['tail_rate'] and random.random() < config['tail_rate']:
+            latency = max(latency, config['tail_latency']) # A straggler, as seen at the real API's p99
+        time.sleep(latency)
+        self.server.count_request()
+
+        if random.random() < config['error_rate']:
+            status = random.choice([429, 500, 503])
+            return self._send_json(status, {"error": {"code": status, "message": "Injected failure"}}, {'Retry-After': '1'} if status == 429 else None)
+
+        text = fake_response_text(prompt, config['payload_size'])
+        finish_reason = "STOP"
+        max_tokens = request_json.get("generationConfig", {}).get("maxOutputTokens")
+        if max_tokens and len(text) > max_tokens * 4: # ~4 characters per token
+            text, finish_reason = text[:max_tokens * 4], "MAX_TOKENS"
+        if ':streamGenerateContent' in self.path:
+            return self._stream(text)
+        self._send_json(200, _envelope(text, finish_reason))
+
+    def _stream(self, text):
+        """Sends the text as several SSE chunks, like alt=sse."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        chunk_size = max(1, len(text) // 8)
+        for start in range(0, len(text), chunk_size):
+            message = f"data: {json.dumps(_envelope(text[start:start + chunk_size]))}\r\n\r\n"
+            self.wfile.write(message.encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.server.config['stream_interval'])
+        self.close_connection = True
+
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    """
+    Threaded fake server. `latency` (seconds, optionally Gaussian `jitter`;
+    `model_latency` maps model IDs to their own mean), `tail_rate` (fraction
+    of responses delayed to `tail_latency`), `error_rate` (fraction of
+    429/500/503 responses) and `payload_size` (approximate recipe JSON
+    bytes) can be changed while it runs via .config.
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 payload_size=1024, stream_interval=0.0, tail_rate=0.0, tail_latency=5.0, model_latency=None):
+        super().__init__((host, port), FakeGeminiHandler)
+        self.config = {
+            'latency': latency, 'jitter': jitter, 'error_rate': error_rate,
+            'payload_size': payload_size, 'stream_interval': stream_interval,
+            'tail_rate': tail_rate, 'tail_latency': tail_latency, 'model_latency': dict(model_latency or {}),
+        }
+        self.requests_served = 0
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    def count_request(self):
+        with self._count_lock:
+            self.requests_served += 1
+
+    @property
+    def api_base(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1beta"
+
+    def start(self):
+        """Serves in a background daemon thread and returns self."""
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-gemini', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Gemini generateContent server for benchmarks.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.5, help="Mean response latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Std deviation of the latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 429/5xx")
+    parser.add_argument('--payload-size', type=int, default=1024, help="Approximate recipe JSON size in bytes")
+    parser.add_argument('--stream-interval', type=float, default=0.05, help="Delay between SSE chunks in seconds")
+    parser.add_argument('--tail-rate', type=float, default=0.0, help="Fraction of requests delayed to --tail-latency")
+    parser.add_argument('--tail-latency', type=float, default=5.0, help="Latency of the slow tail in seconds")
+    parser.add_argument('--model-latency', action='append', metavar='MODEL=SECONDS',
+                        help="Mean latency for one model (repeatable)")
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(args.host, args.port, args.latency, args.jitter, args.error_rate,
+                              args.payload_size, args.stream_interval, args.tail_rate, args.tail_latency,
+                              parse_model_latencies(args.model_latency))
+    print(f"Fake Gemini listening; set GEMINI_API_BASE={server.api_base}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+# bench/load.py
+"""
+Load scenarios for /generate, /substitute, /login, /register and /share.
+Reports p50/p95/p99 latency and requests per second at a given concurrency.
+
+    python -m bench.load --scenario generate --concurrency 16 --requests 500 --latency 0.8
+    python -m bench.load --scenario all --concurrency 8 --requests 200
+    python -m bench.load --scenario generate --no-cache --tail-rate 0.02 --tail-latency 3   # hedging vs. stragglers
+    python -m bench.load --scenario login --url http://127.0.0.1:5000   # against a running server
+
+Without --url the app is served in-process (threaded Werkzeug server) with
+Gemini pointed at bench.fake_gemini and login_details in SQLite
+(bench.sqlite_db), so results are repeatable and cost nothing.
+"""
+import argparse
+import base64
+import contextlib
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.fake_gemini import FakeGeminiServer, parse_model_latencies
+
+SCENARIOS = ['generate', 'substitute', 'register', 'login', 'share']
+BENCH_PASSWORD = 'Bench-pass-123!'
+
+INGREDIENT_POOL = [
+    'chicken', 'rice', 'tofu', 'egg', 'spinach', 'tomato', 'onion', 'garlic', 'potato', 'carrot',
+    'beef', 'pasta', 'mushroom', 'pepper', 'lentil', 'chickpea', 'cheese', 'salmon', 'broccoli', 'corn',
+]
+SUBSTITUTE_QUERIES = ['butter', 'egg', 'buttermilk', 'sour cream', 'dragonfruit', 'yuzu kosho', 'brown sugar']
+
+SHARE_RECIPE = {
+    "title": "Shared Benchmark Soup",
+    "ingredients": ["1 onion", "2 carrots", "1 litre stock"],
+    "steps": ["Chop everything.", "Simmer for 20 minutes.", "Blend and serve."],
+    "prep_time": "10 minutes",
+    "cook_time": "20 minutes",
+}
+
+
+# --- Statistics ---
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def summarize(name, latencies, statuses, errors, elapsed, concurrency):
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "statuses": dict(sorted(statuses.items())),
+        "rps": total / elapsed if elapsed else 0.0,
+        "mean_ms": 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+        "p50_ms": 1000 * percentile(latencies, 50),
+        "p95_ms": 1000 * percentile(latencies, 95),
+        "p99_ms": 1000 * percentile(latencies, 99),
+        "max_ms": 1000 * latencies[-1] if latencies else 0.0,
+    }
+
+def format_summary(result):
+    statuses = " ".join(f"{code}:{count}" for code, count in result["statuses"].items())
+    return (
+        f"{result['scenario']:<11} c={result['concurrency']:<3} n={result['requests']:<6} "
+        f"rps={result['rps']:8.1f}  p50={result['p50_ms']:8.1f}ms  p95={result['p95_ms']:8.1f}ms  "
+        f"p99={result['p99_ms']:8.1f}ms  max={result['max_ms']:8.1f}ms  errors={result['errors']}  [{statuses}]"
+    )
+
+
+# --- Request Builders ---
+# Each returns (method, path, requests kwargs) for the i-th request.
+
+def generate_request(i, unique):
+    count = 2 + i % 3
+    start = (i % unique) % len(INGREDIENT_POOL)
+    ingredients = [INGREDIENT_POOL[(start + k * 7) % len(INGREDIENT_POOL)] for k in range(count)]
+    description = f"bench variant {i % unique}" if unique > len(INGREDIENT_POOL) else ""
+    return 'POST', '/generate', {"json": {"ingredients": ingredients, "filters": {}, "description": description}}
+
+def substitute_request(i, unique):
+    return 'POST', '/substitute', {"json": {"ingredient": SUBSTITUTE_QUERIES[i % len(SUBSTITUTE_QUERIES)]}}
+
+def register_request(i, unique, run_id):
+    email = f"bench-{run_id}-{i}@example.com"
+    form = {"email": email, "password": BENCH_PASSWORD, "confirm_password": BENCH_PASSWORD}
+    return 'POST', '/register', {"data": form}
+
+def login_request(i, unique, run_id):
+    form = {"email": f"bench-{run_id}-login-{i % unique}@example.com", "password": BENCH_PASSWORD}
+    return 'POST', '/login', {"data": form}
+
+def share_request(i, unique):
+    return 'GET', '/share', {"params": {"data": _share_payload()}}
+
+_share_cache = {}
+def _share_payload():
+    if 'data' not in _share_cache:
+        raw = json.dumps(SHARE_RECIPE).encode('utf-8')
+        _share_cache['data'] = base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+    return _share_cache['data']
+
+
+# --- Runner ---
+
+def run_scenario(base_url, name, build, total, concurrency, warmup=0):
+    """Fires `total` requests from `concurrency` threads; returns a summary dict."""
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return local.session
+
+    def one(i):
+        method, path, kwargs = build(i)
+        http = session()
+        http.cookies.clear() # Each request is an independent visitor
+        start = time.perf_counter()
+        response = http.request(method, base_url + path, allow_redirects=False, timeout=120, **kwargs)
+        response.content # Include body transfer in the timing
+        return time.perf_counter() - start, response.status_code
+
+    latencies, statuses, errors = [], Counter(), 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'bench-{name}') as pool:
+        for _ in pool.map(one, range(total, total + warmup)):
+            pass
+        started = time.perf_counter()
+        futures = [pool.submit(one, i) for i in range(total)]
+        for future in futures:
+            try:
+                latency, status = future.result()
+            except requests.exceptions.RequestException:
+                errors += 1
+                continue
+            latencies.append(latency)
+            statuses[status] += 1
+        elapsed = time.perf_counter() - started
+    return summarize(name, latencies, statuses, errors, elapsed, concurrency)
+
+
+def start_local_app(args):
+    """Serves app.py in-process against a fake Gemini server and a SQLite user table."""
+    fake = FakeGeminiServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            payload_size=args.payload_size, tail_rate=args.tail_rate,
+                            tail_latency=args.tail_latency,
+                            model_latency=parse_model_latencies(args.model_latency)).start()
+    os.environ.update({
+        'GEMINI_API_KEY': 'bench-key',
+        'GEMINI_API_BASE': fake.api_base,
+        'DB_POOL_MIN': '0', # The real Postgres pool is replaced below
+        # The SQLite stand-in has no recipes table (tsvector/GIN); measure Gemini-path latency only
+        'RECIPE_HISTORY_ENABLED': '0',
+        'RECIPE_CORPUS_LOOKUP': '0',
+        'RETRIEVAL_ENABLED': '0',
+        'RATE_LIMIT_ENABLED': '0', # Every bench request comes from one IP
+    })
+    os.environ.setdefault('SECRET_KEY', 'bench-secret')
+    if args.no_cache:
+        os.environ['GEMINI_CACHE_ENABLED'] = '0'
+    # Keep LLM-learned substitutions out of the real knowledge base file
+    os.environ.setdefault('SUBSTITUTIONS_LEARNED_PATH', os.path.join(tempfile.mkdtemp(prefix='bench-'), 'learned.sqlite3'))
+    os.environ.setdefault('SESSION_SQLITE_PATH', os.path.join(tempfile.mkdtemp(prefix='bench-'), 'sessions.sqlite3'))
+
+    import app as app_module
+    from bench import sqlite_db
+    from werkzeug.serving import make_server
+
+    if not args.verbose:
+        logging.getLogger('werkzeug').setLevel(logging.ERROR) # No per-request access log
+
+    db_path = sqlite_db.install(app_module, args.db_path, maxconn=args.db_pool_size)
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", fake, server, db_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the recipe app.")
+    parser.add_argument('--scenario', default='all', choices=SCENARIOS + ['all'])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help="Requests per scenario")
+    parser.add_argument('--warmup', type=int, default=10, help="Untimed requests before each scenario")
+    parser.add_argument('--unique', type=int, default=None,
+                        help="Distinct payloads per scenario (lower = more cache hits); default: --requests")
+    parser.add_argument('--url', help="Benchmark an already running server instead of an in-process one")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON lines")
+    parser.add_argument('--verbose', action='store_true', help="Keep the app's own console output")
+    # In-process mode only
+    parser.add_argument('--latency', type=float, default=0.5, help="Fake Gemini mean latency (seconds)")
+    parser.add_argument('--jitter', type=float, default=0.1, help="Fake Gemini latency std deviation (seconds)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fake Gemini 429/5xx fraction")
+    parser.add_argument('--payload-size', type=int, default=1024, help="Fake Gemini recipe size (bytes)")
+    parser.add_argument('--tail-rate', type=float, default=0.0, help="Fake Gemini fraction of straggler responses")
+    parser.add_argument('--tail-latency', type=float, default=5.0, help="Fake Gemini straggler latency (seconds)")
+    parser.add_argument('--model-latency', action='append', metavar='MODEL=SECONDS',
+                        help="Fake Gemini mean latency for one model (repeatable)")
+    parser.add_argument('--no-cache', action='store_true', help="Disable the LLM response cache")
+    parser.add_argument('--db-path', help="SQLite file for login_details (default: a temp file)")
+    parser.add_argument('--db-pool-size', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    unique = args.unique or args.requests
+    run_id = f"{os.getpid()}-{int(time.time())}"
+    scenarios = SCENARIOS if args.scenario == 'all' else [args.scenario]
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    out = sys.stdout
+    with quiet:
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            base_url, _, _, _ = start_local_app(args)
+
+        builders = {
+            'generate': lambda i: generate_request(i, unique),
+            'substitute': lambda i: substitute_request(i, unique),
+            'register': lambda i: register_request(i, unique, run_id),
+            'login': lambda i: login_request(i, min(unique, 50), run_id),
+            'share': lambda i: share_request(i, unique),
+        }
+        for name in scenarios:
+            if name == 'login':
+                # Accounts the login scenario signs in to
+                for i in range(min(unique, 50)):
+                    form = {"email": f"bench-{run_id}-login-{i}@example.com",
+                            "password": BENCH_PASSWORD, "confirm_password": BENCH_PASSWORD}
+                    requests.post(base_url + '/register', data=form, allow_redirects=False, timeout=60)
+            result = run_scenario(base_url, name, builders[name], args.requests, args.concurrency, args.warmup)
+            print(json.dumps(result) if args.json else format_summary(result), file=out, flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# bench/micro.py
+"""
+Micro-benchmarks for hot helpers on the request path.
+
+    python -m bench.micro
+    python -m bench.micro --filter share --repeat 7
+    python -m bench.micro --filter json      # stdlib json vs. jsoncodec (orjson when installed)
+
+Each case reports the best-of-N time per call, so regressions show up as
+numbers rather than as a vague feeling that /generate got slower.
+"""
+import argparse
+import base64
+import json
+import random
+import tempfile
+import timeit
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import jsoncodec
+from utils import format_gemini_prompt, validate_email, decode_share_data, is_valid_recipe
+
+SAMPLE_RECIPE = {
+    "title": "Micro Benchmark Curry",
+    "description": "A medium-sized recipe, similar to what Gemini returns.",
+    "ingredients": [f"{n} g ingredient number {n}" for n in range(12)],
+    "steps": [f"Step {n}: stir, simmer and taste before moving on to the next step." for n in range(10)],
+    "prep_time": "15 minutes",
+    "cook_time": "35 minutes",
+}
+SHARE_DATA = base64.urlsafe_b64encode(json.dumps(SAMPLE_RECIPE).encode('utf-8')).decode('ascii').rstrip('=')
+
+# A generateContent response: the recipe is JSON text inside the JSON envelope
+GEMINI_RESPONSE = json.dumps({"candidates": [{"content": {"parts": [{"text": json.dumps(SAMPLE_RECIPE)}]}}]}).encode('utf-8')
+
+def decode_gemini(loads):
+    envelope = loads(GEMINI_RESPONSE)
+    return loads(envelope["candidates"][0]["content"]["parts"][0]["text"])
+
+_flask_app = Flask('bench')
+DEFAULT_PROVIDER = DefaultJSONProvider(_flask_app)
+FAST_PROVIDER = jsoncodec.FastJSONProvider(_flask_app)
+
+PROMPT_ARGS = (
+    ['chicken thighs', 'basmati rice', 'spinach', 'garlic', 'ginger', 'coconut milk'],
+    {'diet': 'gluten-free', 'cuisine': 'Indian', 'time': 'under 45 minutes'},
+    'Something warming for a weeknight, not too spicy.',
+)
+
+_retrieval = {}
+def retrieval_query():
+    """Top-5 query against a synthetic 50k-recipe index (built on first use, outside the timing)."""
+    if 'index' not in _retrieval:
+        from retrieval import RetrievalIndex
+        rng = random.Random(0)
+        vocab = [f"ingredient {n}" for n in range(2000)]
+        index = RetrievalIndex(tempfile.mkdtemp(prefix='bench-retrieval-'), reload_interval=3600)
+        index.append([(rng.sample(vocab, 8), {}, {"title": str(n)}) for n in range(50000)])
+        _retrieval.update(index=index, query=rng.sample(vocab, 6))
+    return _retrieval['index'].query(_retrieval['query'], filters={}, k=5)
+
+CASES = {
+    'format_gemini_prompt': lambda: format_gemini_prompt(*PROMPT_ARGS),
+    'validate_email.valid': lambda: validate_email('someone.cooking@example.co.uk'),
+    'validate_email.invalid': lambda: validate_email('not-an-email@'),
+    'decode_share_data': lambda: decode_share_data(SHARE_DATA),
+    'retrieval.query': retrieval_query,
+    'json.gemini_decode.json': lambda: decode_gemini(json.loads),
+    f'json.gemini_decode.{jsoncodec.backend()}': lambda: decode_gemini(jsoncodec.loads),
+    'json.jsonify.json': lambda: DEFAULT_PROVIDER.response(SAMPLE_RECIPE),
+    f'json.jsonify.{jsoncodec.backend()}': lambda: FAST_PROVIDER.response(SAMPLE_RECIPE),
+    'is_valid_recipe': lambda: is_valid_recipe(SAMPLE_RECIPE),
+}
+
+
+def run_case(fn, repeat):
+    """Returns (best seconds per call, loops per measurement)."""
+    timer = timeit.Timer(fn)
+    loops, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=loops))
+    return best / loops, loops
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for recipe app helpers.")
+    parser.add_argument('--filter', default='', help="Only run cases whose name contains this text")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    for name, fn in CASES.items():
+        if args.filter and args.filter not in name:
+            continue
+        per_call, loops = run_case(fn, args.repeat)
+        print(f"{name:<28} {per_call * 1e6:10.2f} us/call  ({loops} loops x {args.repeat})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# bench/password_cost.py
+"""
+Picks PASSWORD_HASH_METHOD for a target hashing latency on this machine.
+
+    python -m bench.password_cost
+    python -m bench.password_cost --target-ms 150 --algorithm pbkdf2
+
+Run it on production-class hardware. scrypt doubles N until one more step
+would exceed the target; pbkdf2 scales iterations from a calibration run.
+The median of --repeat hashes is used at every step. Users whose stored
+hash used other parameters are rehashed on their next login.
+"""
+import argparse
+import statistics
+import time
+
+from werkzeug.security import generate_password_hash
+
+SAMPLE_PASSWORD = 'correct-horse-battery-staple-1'
+
+def median_ms(method, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        generate_password_hash(SAMPLE_PASSWORD, method=method)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def pick_scrypt(target_ms, repeat, r=8, p=1, max_log_n=20):
+    """Largest power-of-two N (at least 2^14) whose median hash time stays within target_ms."""
+    best = None
+    for log_n in range(14, max_log_n + 1):
+        method = f"scrypt:{2 ** log_n}:{r}:{p}"
+        elapsed = median_ms(method, repeat)
+        print(f"  {method:<28} {elapsed:8.1f} ms  ({128 * r * 2 ** log_n // 2 ** 20} MiB)")
+        if elapsed > target_ms:
+            break
+        best = (method, elapsed)
+    return best
+
+def pick_pbkdf2(target_ms, repeat, hash_name='sha256', calibration=100000):
+    """Iterations (rounded down to 10k) expected to take target_ms, checked with one more measurement."""
+    elapsed = median_ms(f"pbkdf2:{hash_name}:{calibration}", repeat)
+    iterations = max(10000, int(calibration * target_ms / elapsed) // 10000 * 10000)
+    method = f"pbkdf2:{hash_name}:{iterations}"
+    elapsed = median_ms(method, repeat)
+    print(f"  {method:<28} {elapsed:8.1f} ms")
+    return method, elapsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pick password hash parameters for a target latency.")
+    parser.add_argument('--target-ms', type=float, default=250.0, help="Hash time budget per login")
+    parser.add_argument('--algorithm', default='scrypt', choices=['scrypt', 'pbkdf2'])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f"Timing {args.algorithm} (target {args.target_ms:.0f} ms, median of {args.repeat}):")
+    if args.algorithm == 'scrypt':
+        best = pick_scrypt(args.target_ms, args.repeat)
+    else:
+        best = pick_pbkdf2(args.target_ms, args.repeat)
+    if best is None:
+        print("Even the cheapest parameters exceed the target; raise --target-ms or use faster hardware.")
+        return 1
+    method, elapsed = best
+    print(f"\nPASSWORD_HASH_METHOD={method}  # ~{elapsed:.0f} ms per hash")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,91 @@
+# bench/sqlite_db.py
+"""
+SQLite stand-in for the Postgres `login_details` table, so /register and
+/login can be load-tested without a database server. Connections accept
+the psycopg2 %s paramstyle and the app's Postgres DDL.
+"""
+import os
+import sqlite3
+import tempfile
+
+from db import ConnectionPool
+
+# Postgres-only DDL fragments and their SQLite equivalents
+_DDL_REWRITES = [
+    ('SERIAL PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+    ('TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP', 'TEXT DEFAULT CURRENT_TIMESTAMP'),
+]
+
+def _translate(sql):
+    for postgres, sqlite in _DDL_REWRITES:
+        sql = sql.replace(postgres, sqlite)
+    return sql.replace('%s', '?')
+
+
+class SQLiteCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(_translate(sql), params)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SQLiteConnection:
+    """Just enough of the psycopg2 connection API for app.py and db.ConnectionPool."""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self.closed = 0
+
+    def cursor(self):
+        return SQLiteCursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self.closed = 1
+        self._conn.close()
+
+
+def connect_factory(path):
+    """Zero-argument connect callable for db.ConnectionPool."""
+    return lambda: SQLiteConnection(path)
+
+def install(app_module, path=None, maxconn=10):
+    """
+    Swaps the app's DB pool for a pool of SQLite connections and creates the
+    schema via app.init_db(). Returns the database path (a temp file by default).
+    """
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix='bench-login-', suffix='.sqlite3')
+        os.close(fd)
+    pool = ConnectionPool(connect_factory(path), minconn=1, maxconn=maxconn, timeout=30)
+    app_module.get_services(app_module.app).set_db_pool(pool)
+    if not app_module.init_db(pool):
+        raise RuntimeError(f"Could not create the login_details schema in {path}")
+    return path
@@ -0,0 +1,319 @@
+# cache.py
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import jsoncodec
+
+logger = logging.getLogger(__name__)
+
+# --- Cache Keys ---
+
+def make_cache_key(prompt, generation_config=None, model=None):
+    """
+    Builds a content-addressed key from the prompt and generation settings.
+    The payload is serialized canonically (sorted keys, no whitespace) so
+    equivalent configs always hash to the same key.
+    """
+    payload = {
+        "model": model or "",
+        "prompt": prompt or "",
+        "config": generation_config or {},
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+# --- In-Process Tier ---
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache with a per-entry TTL and a size cap."""
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl
+        self._data = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached value, or None if missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key) # Mark as most recently used
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Stores a value, evicting the least recently used entry when full."""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+# --- Shared Tiers ---
+
+class SQLiteCacheTier:
+    """
+    Shared cache tier stored in a SQLite file. Every worker process on the
+    host opening the same file sees the same entries.
+    """
+
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local() # One connection per thread
+        self._ensure_schema()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL;") # Readers don't block the writer
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self):
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS llm_response_cache (
+                cache_key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            );
+        """)
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM llm_response_cache WHERE cache_key = ?;", (key,)
+        ).fetchone()
+        if not row:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            self.delete(key)
+            return None
+        return jsoncodec.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        self._conn().execute(
+            "INSERT OR REPLACE INTO llm_response_cache (cache_key, value, expires_at) VALUES (?, ?, ?);",
+            (key, jsoncodec.dumps(value), expires_at)
+        )
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM llm_response_cache WHERE cache_key = ?;", (key,))
+
+    def purge_expired(self):
+        """Removes expired rows. Safe to call from a periodic job."""
+        self._conn().execute(
+            "DELETE FROM llm_response_cache WHERE expires_at IS NOT NULL AND expires_at <= ?;", (time.time(),)
+        )
+
+
+class PostgresCacheTier:
+    """
+    Shared cache tier stored in a Postgres table. Connections are borrowed
+    through the app's pool helpers (get_conn / put_conn) so the cache never
+    opens connections of its own.
+    """
+
+    def __init__(self, get_conn, put_conn, ttl=3600):
+        self._get_conn = get_conn
+        self._put_conn = put_conn
+        self.ttl = ttl
+        self._ensure_schema()
+
+    def _execute(self, sql, params=(), fetch=False):
+        conn = self._get_conn()
+        if not conn:
+            return None
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                row = cur.fetchone() if fetch else None
+            conn.commit()
+            return row
+        except Exception as e:
+            logger.error("Error accessing Postgres response cache: %s", e)
+            conn.rollback()
+            return None
+        finally:
+            self._put_conn(conn)
+
+    def _ensure_schema(self):
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS llm_response_cache (
+                cache_key CHAR(64) PRIMARY KEY,
+                value JSONB NOT NULL,
+                expires_at TIMESTAMP WITH TIME ZONE
+            );
+        """)
+
+    def get(self, key):
+        row = self._execute(
+            "SELECT value FROM llm_response_cache "
+            "WHERE cache_key = %s AND (expires_at IS NULL OR expires_at > NOW());",
+            (key,), fetch=True
+        )
+        if not row:
+            return None
+        value = row[0]
+        return jsoncodec.loads(value) if isinstance(value, str) else value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self._execute(
+            "INSERT INTO llm_response_cache (cache_key, value, expires_at) "
+            "VALUES (%s, %s, CASE WHEN %s > 0 THEN NOW() + make_interval(secs => %s) END) "
+            "ON CONFLICT (cache_key) DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at;",
+            (key, jsoncodec.dumps(value), ttl or 0, ttl or 0)
+        )
+
+    def delete(self, key):
+        self._execute("DELETE FROM llm_response_cache WHERE cache_key = %s;", (key,))
+
+    def purge_expired(self):
+        self._execute("DELETE FROM llm_response_cache WHERE expires_at IS NOT NULL AND expires_at <= NOW();")
+
+
+# --- Two-Tier Cache ---
+
+class ResponseCache:
+    """
+    Looks up the in-process tier first, then the optional shared tier.
+    Shared hits are promoted into memory. Errors in the shared tier are
+    logged and treated as misses so the cache can never break a request.
+    """
+
+    def __init__(self, memory=None, shared=None):
+        self.memory = memory if memory is not None else LRUCache()
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "shared_hits": 0, "misses": 0, "sets": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                logger.error("Error reading shared response cache: %s", e)
+                value = None
+            if value is not None:
+                self.memory.set(key, value)
+                self._count("shared_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key, value):
+        if value is None:
+            return # None means "no answer" and is never cached
+        self.memory.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value)
+            except Exception as e:
+                logger.error("Error writing shared response cache: %s", e)
+        self._count("sets")
+
+    def delete(self, key):
+        self.memory.delete(key)
+        if self.shared is not None:
+            try:
+                self.shared.delete(key)
+            except Exception as e:
+                logger.error("Error deleting from shared response cache: %s", e)
+
+    def stats(self):
+        """Returns hit/miss counters plus the current in-memory entry count."""
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats["memory_hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["shared_hits"]) / lookups if lookups else 0.0
+        stats["memory_entries"] = len(self.memory)
+        return stats
+
+
+class NullCache:
+    """Stand-in used when caching is disabled; every lookup is a miss."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def stats(self):
+        return {"memory_hits": 0, "shared_hits": 0, "misses": 0, "sets": 0,
+                "hit_ratio": 0.0, "memory_entries": 0}
+
+
+def build_response_cache(get_conn=None, put_conn=None, backend=None):
+    """
+    Builds the response cache from environment variables:
+      GEMINI_CACHE_ENABLED      - '0' disables caching entirely (default on)
+      GEMINI_CACHE_TTL          - entry lifetime in seconds (default 3600)
+      GEMINI_CACHE_MAX_ENTRIES  - in-process LRU size cap (default 1024)
+      GEMINI_CACHE_BACKEND      - 'memory' (default), 'sqlite' or 'postgres'; `backend` overrides it
+      GEMINI_CACHE_SQLITE_PATH  - file used by the sqlite backend
+    The postgres backend needs the pool helpers, so it is only available
+    when get_conn/put_conn are supplied (see app.py).
+    """
+    if os.getenv('GEMINI_CACHE_ENABLED', '1').lower() in ['0', 'false', 'no', 'off']:
+        return NullCache()
+
+    ttl = int(os.getenv('GEMINI_CACHE_TTL', '3600'))
+    max_entries = int(os.getenv('GEMINI_CACHE_MAX_ENTRIES', '1024'))
+    backend = (backend or os.getenv('GEMINI_CACHE_BACKEND', 'memory')).lower()
+
+    shared = None
+    try:
+        if backend == 'sqlite':
+            default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'llm_cache.sqlite3')
+            shared = SQLiteCacheTier(os.getenv('GEMINI_CACHE_SQLITE_PATH', default_path), ttl=ttl)
+        elif backend == 'postgres' and get_conn and put_conn:
+            shared = PostgresCacheTier(get_conn, put_conn, ttl=ttl)
+    except Exception as e:
+        logger.warning("Could not initialize shared response cache (%s): %s. Using memory only.", backend, e)
+        shared = None
+
+    return ResponseCache(memory=LRUCache(max_entries=max_entries, ttl=ttl), shared=shared)
@@ -0,0 +1,92 @@
+# categories.py
+"""
+Shopping list aisles for free-text ingredient lines ("2 cups chopped red
+onions" -> "Produce"). The category table is turned into a phrase index
+once per process, with every phrase normalized like ingredients are, so a
+lookup is a handful of dict probes instead of a scan over keyword lists.
+"""
+import functools
+import json
+import logging
+import os
+import re
+
+from normalize import normalize_ingredient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATEGORIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'ingredient_categories.json')
+DEFAULT_CATEGORY = 'Other'
+
+_WORD = re.compile(r"[a-z][a-z'-]*")
+_PARENTHETICAL = re.compile(r"\([^)]*\)")
+
+
+class CategoryIndex:
+    """Normalized phrase -> category, plus the aisle order lists are shown in."""
+
+    def __init__(self, table):
+        self.order = [category for category in table if category != DEFAULT_CATEGORY] + [DEFAULT_CATEGORY]
+        self.phrases = {}
+        for category, phrases in table.items():
+            for phrase in phrases:
+                key = normalize_ingredient(phrase)
+                if key and self.phrases.setdefault(key, category) != category:
+                    logger.debug("Ingredient %r is listed under both %s and %s; keeping the first.",
+                                 key, self.phrases[key], category)
+        self.max_words = max((len(key.split(' ')) for key in self.phrases), default=1)
+
+    def lookup(self, name):
+        """
+        The category of the longest known phrase in `name` (quantities, notes
+        in parentheses and anything after a comma are ignored), preferring the
+        rightmost one on ties since English puts the head noun last:
+        "chicken stock" is Pantry, not Meat; "salt and pepper" is a seasoning.
+        """
+        if not isinstance(name, str):
+            return DEFAULT_CATEGORY
+        text = _PARENTHETICAL.sub(' ', name.lower()).split(',', 1)[0]
+        words = _WORD.findall(text)
+        for size in range(min(self.max_words, len(words)), 0, -1):
+            for start in range(len(words) - size, -1, -1):
+                category = self.phrases.get(normalize_ingredient(' '.join(words[start:start + size])))
+                if category is not None:
+                    return category
+        return DEFAULT_CATEGORY
+
+
+_index = None # Loaded lazily on first use
+
+def load_category_index(path=None):
+    """
+    Loads the category -> phrases table; INGREDIENT_CATEGORIES_PATH overrides
+    the bundled data/ingredient_categories.json. A missing or broken file
+    leaves every item in DEFAULT_CATEGORY.
+    """
+    global _index
+    path = path or os.getenv('INGREDIENT_CATEGORIES_PATH', DEFAULT_CATEGORIES_PATH)
+    table = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            table = json.load(f)
+    except FileNotFoundError:
+        logger.warning("Ingredient category table not found at %s. Every item will be '%s'.", path, DEFAULT_CATEGORY)
+    except json.JSONDecodeError as e:
+        logger.error("Error loading ingredient category table %s: %s", path, e)
+    _index = CategoryIndex(table)
+    categorize.cache_clear()
+    return _index
+
+def get_category_index():
+    if _index is None:
+        load_category_index()
+    return _index
+
+def category_order():
+    """Category names in display order, DEFAULT_CATEGORY last."""
+    return get_category_index().order
+
+@functools.lru_cache(maxsize=8192)
+def categorize(name):
+    """The shopping list category for one ingredient line, e.g. "3 eggs" -> "Dairy & Eggs"."""
+    return get_category_index().lookup(name)
@@ -0,0 +1,158 @@
+# circuit_breaker.py
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Tracks error rate and latency of a dependency over a rolling window.
+
+    - closed:    calls flow; the breaker opens once at least `min_calls`
+                 outcomes in the window show an error rate or slow-call rate
+                 at or above the threshold.
+    - open:      calls are rejected immediately (callers serve a fallback)
+                 until `open_seconds` have passed.
+    - half_open: up to `half_open_max_calls` probe calls are let through; a
+                 success closes the breaker, a failure re-opens it.
+    """
+
+    def __init__(self, window_seconds=60.0, min_calls=10, error_threshold=0.5,
+                 slow_call_seconds=15.0, slow_call_threshold=0.5, open_seconds=30.0, half_open_max_calls=1):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_threshold = slow_call_threshold
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._outcomes = deque() # (timestamp, ok, latency)
+        self._counters = {"rejected": 0, "opened": 0, "successes": 0, "failures": 0}
+
+    @classmethod
+    def from_env(cls, prefix='GEMINI_BREAKER'):
+        """Reads <prefix>_WINDOW, _MIN_CALLS, _ERROR_THRESHOLD, _SLOW_CALL_SECONDS, _SLOW_CALL_THRESHOLD, _OPEN_SECONDS."""
+        return cls(
+            window_seconds=float(os.getenv(f'{prefix}_WINDOW', '60')),
+            min_calls=int(os.getenv(f'{prefix}_MIN_CALLS', '10')),
+            error_threshold=float(os.getenv(f'{prefix}_ERROR_THRESHOLD', '0.5')),
+            slow_call_seconds=float(os.getenv(f'{prefix}_SLOW_CALL_SECONDS', '15')),
+            slow_call_threshold=float(os.getenv(f'{prefix}_SLOW_CALL_THRESHOLD', '0.5')),
+            open_seconds=float(os.getenv(f'{prefix}_OPEN_SECONDS', '30')),
+        )
+
+    def _trim(self, now):
+        cutoff = now - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            self._outcomes.popleft()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def is_open(self):
+        """
+        Cheap pre-check for callers that may not end up making the call
+        themselves (e.g. cache or single-flight waiters). Counts a rejection
+        when open; does not consume a half-open probe slot.
+        """
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at < self.open_seconds:
+                self._counters["rejected"] += 1
+                return True
+            return False
+
+    def allow_request(self):
+        """Returns True if a call may proceed. Rejected calls should use the fallback."""
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self._counters["rejected"] += 1
+                    return False
+                self._state = HALF_OPEN
+                self._probes_in_flight = 0
+            if self._state == HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_max_calls:
+                    self._counters["rejected"] += 1
+                    return False
+                self._probes_in_flight += 1
+            return True
+
+    def _open(self, now):
+        self._state = OPEN
+        self._opened_at = now
+        self._probes_in_flight = 0
+        self._counters["opened"] += 1
+
+    def record(self, ok, latency):
+        """Records the outcome of a call that allow_request() let through."""
+        now = time.monotonic()
+        with self._lock:
+            self._counters["successes" if ok else "failures"] += 1
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if ok and latency < self.slow_call_seconds:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open(now)
+                return
+
+            self._outcomes.append((now, ok, latency))
+            self._trim(now)
+            total = len(self._outcomes)
+            if self._state == CLOSED and total >= self.min_calls:
+                errors = sum(1 for _, success, _ in self._outcomes if not success)
+                slow = sum(1 for _, _, elapsed in self._outcomes if elapsed >= self.slow_call_seconds)
+                if errors / total >= self.error_threshold or slow / total >= self.slow_call_threshold:
+                    logger.warning("Circuit breaker opened (%d/%d errors, %d/%d slow).", errors, total, slow, total)
+                    self._open(now)
+
+    def release(self):
+        """
+        Ends a call that allow_request() let through without an outcome (e.g.
+        the client went away mid-stream): frees its half-open probe slot and
+        counts neither a success nor a failure.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def stats(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            stats = dict(self._counters)
+            total = len(self._outcomes)
+            stats["window_calls"] = total
+            stats["window_error_rate"] = (
+                sum(1 for _, ok, _ in self._outcomes if not ok) / total if total else 0.0
+            )
+        stats["state"] = self.state
+        return stats
+
+
+# --- Deadlines ---
+
+def deadline_after(seconds):
+    """Absolute deadline (time.monotonic based) `seconds` from now, or None."""
+    return time.monotonic() + seconds if seconds is not None else None
+
+def time_remaining(deadline):
+    """Seconds left before `deadline` (may be negative), or None if there is no deadline."""
+    return deadline - time.monotonic() if deadline is not None else None
@@ -0,0 +1,107 @@
+# compression.py
+"""
+gzip/brotli compression for HTTP responses. Dynamic responses (HTML,
+JSON, metrics) are compressed by an after_request hook; static files are
+compressed once at build time (`python -m assets build`) and served as-is.
+"""
+import gzip
+import logging
+import os
+
+try:
+    import brotli # Optional: ~15-20% smaller than gzip for HTML/JS/CSS
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Types worth compressing; images, archives etc. are already compressed
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+# Built-in suffixes for pre-compressed static files
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def available_encodings():
+    """Encodings this process can produce, best first."""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def is_compressible(mimetype):
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+def choose_encoding(accept_encodings, offered):
+    """
+    Picks the encoding from `offered` (best first) that the client accepts
+    with the highest quality; ties go to the earlier one. None if the client
+    accepts none of them (identity).
+    """
+    best, best_quality = None, 0
+    for encoding in offered:
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def compress(data, encoding, gzip_level=6, brotli_quality=5):
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    # mtime=0 keeps the output (and so any ETag derived from it) stable
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+
+class ResponseCompressor:
+    """
+    after_request hook: compresses buffered, compressible responses of at
+    least `min_bytes` in the best encoding the client accepts. Streamed
+    responses (SSE, long-polls) and files sent by send_file are left alone.
+    Strong ETags become weak, since the bytes on the wire now depend on
+    Accept-Encoding; If-None-Match checks use weak comparison to match.
+    """
+
+    def __init__(self, min_bytes=1024, gzip_level=6, brotli_quality=5):
+        self.min_bytes = min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = available_encodings()
+
+    def __call__(self, response):
+        from flask import request
+
+        if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+                or 'Content-Encoding' in response.headers or not is_compressible(response.mimetype)):
+            return response
+        response.vary.add('Accept-Encoding')
+        if request.method == 'HEAD':
+            return response
+        encoding = choose_encoding(request.accept_encodings, self.encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_bytes:
+            return response
+
+        response.set_data(compress(data, encoding, self.gzip_level, self.brotli_quality))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def build_response_compressor():
+    """
+    Builds the after_request hook from environment variables, or None when disabled:
+      COMPRESSION_ENABLED         - '1' (default) or '0' (e.g. when a proxy compresses)
+      COMPRESSION_MIN_BYTES       - smaller bodies are sent as-is (default 1024)
+      COMPRESSION_GZIP_LEVEL      - 1-9 (default 6)
+      COMPRESSION_BROTLI_QUALITY  - 0-11 for dynamic responses (default 5; static files use 11)
+    """
+    if os.getenv('COMPRESSION_ENABLED', '1').lower() not in ['true', '1', 't', 'yes', 'on']:
+        return None
+    if brotli is None:
+        logger.info("brotli module not installed; responses are compressed with gzip only.")
+    return ResponseCompressor(
+        min_bytes=int(os.getenv('COMPRESSION_MIN_BYTES', '1024')),
+        gzip_level=int(os.getenv('COMPRESSION_GZIP_LEVEL', '6')),
+        brotli_quality=int(os.getenv('COMPRESSION_BROTLI_QUALITY', '5')),
+    )
@@ -0,0 +1,255 @@
+# db.py
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import DB_POOL_TIMEOUTS, DB_POOL_WAIT
+
+logger = logging.getLogger(__name__)
+
+class PoolError(Exception):
+    """Raised when a connection cannot be checked out of the pool."""
+
+class PoolTimeout(PoolError):
+    """Raised when no connection became free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe, self-healing DB connection pool.
+
+    - Checkout blocks for at most `timeout` seconds when all `maxconn`
+      connections are in use, instead of returning None.
+    - Connections idle longer than `validate_after` seconds are validated
+      (SELECT 1) on checkout; broken or closed ones are replaced.
+    - Connections older than `max_lifetime` seconds are retired on return.
+    - `connection()` is a context manager that rolls back on error and
+      always returns the connection.
+
+    `connect` is any zero-argument callable returning a DB-API connection
+    (psycopg2.connect for Postgres, or a stand-in such as sqlite3).
+    """
+
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=5.0, max_lifetime=1800.0, validate_after=30.0,
+                 name='default'):
+        self._connect = connect
+        self.name = name # 'pool' label on the checkout metrics
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.validate_after = validate_after
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, created_at, returned_at)
+        self._created = {}    # id(conn) -> created_at for every open connection
+        self._in_use = 0
+        self._opening = 0     # connections being opened outside the lock
+        self._closed = False
+        self._counters = {
+            "checkouts": 0, "timeouts": 0, "waits": 0, "wait_time_total": 0.0, "wait_time_max": 0.0,
+            "connects": 0, "connect_errors": 0, "discarded": 0, "expired": 0,
+        }
+
+        # Prefill; failures are tolerated since checkouts reconnect on demand
+        for _ in range(minconn):
+            try:
+                conn = self._open()
+            except Exception as e:
+                logger.warning("Could not pre-open DB connection: %s", e)
+                break
+            self._idle.append((conn, self._created[id(conn)], time.monotonic()))
+
+    # --- Connection lifecycle ---
+
+    def _open(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._counters["connect_errors"] += 1
+            raise
+        with self._cond:
+            self._created[id(conn)] = time.monotonic()
+            self._counters["connects"] += 1
+        return conn
+
+    def _close(self, conn):
+        with self._cond:
+            self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_closed(conn):
+        return bool(getattr(conn, 'closed', False))
+
+    def _is_healthy(self, conn):
+        """Round-trips a trivial query. Used on connections that sat idle."""
+        if self._is_closed(conn):
+            return False
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT 1;")
+                cur.fetchone()
+            finally:
+                cur.close()
+            conn.rollback() # Don't leave a transaction open on an idle connection
+            return True
+        except Exception:
+            return False
+
+    # --- Checkout / Return ---
+
+    def getconn(self, timeout=None):
+        """
+        Checks out a healthy connection, waiting up to `timeout` seconds
+        (default: the pool timeout). Raises PoolTimeout or PoolError.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise PoolError("Connection pool is closed.")
+                while not self._idle and self._in_use + self._opening >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters["timeouts"] += 1
+                        DB_POOL_TIMEOUTS.inc(pool=self.name)
+                        raise PoolTimeout(f"No DB connection available within {timeout}s "
+                                          f"({self._in_use}/{self.maxconn} in use).")
+                    waited = True
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, created_at, returned_at = self._idle.pop() # LIFO keeps hot connections hot
+                    self._in_use += 1
+                else:
+                    conn = None
+                    self._opening += 1
+
+            if conn is None:
+                try:
+                    conn = self._open()
+                except Exception as e:
+                    with self._cond:
+                        self._opening -= 1
+                        self._cond.notify()
+                    raise PoolError(f"Could not open DB connection: {e}") from e
+                with self._cond:
+                    self._opening -= 1
+                    self._in_use += 1
+            elif self._is_closed(conn) or (
+                    time.monotonic() - returned_at > self.validate_after and not self._is_healthy(conn)):
+                # Stale or broken: drop it and loop to reuse/open another
+                self._close(conn)
+                with self._cond:
+                    self._in_use -= 1
+                    self._counters["discarded"] += 1
+                    self._cond.notify()
+                continue
+
+            wait_time = time.monotonic() - start
+            with self._cond:
+                self._counters["checkouts"] += 1
+                if waited:
+                    self._counters["waits"] += 1
+                self._counters["wait_time_total"] += wait_time
+                self._counters["wait_time_max"] = max(self._counters["wait_time_max"], wait_time)
+            DB_POOL_WAIT.observe(wait_time, pool=self.name)
+            return conn
+
+    def putconn(self, conn, discard=False):
+        """Returns a connection. Broken, expired or discarded connections are closed."""
+        if conn is None:
+            return
+        created_at = self._created.get(id(conn), 0.0)
+        expired = time.monotonic() - created_at > self.max_lifetime
+        if not discard and not self._is_closed(conn):
+            try:
+                conn.rollback() # Never hand out a connection mid-transaction
+            except Exception:
+                discard = True
+        if discard or expired or self._is_closed(conn) or self._closed:
+            self._close(conn)
+            with self._cond:
+                self._in_use -= 1
+                self._counters["expired" if expired and not discard else "discarded"] += 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Context manager replacing the manual get/put/rollback pattern:
+
+            with db_pool.connection() as conn:
+                with conn.cursor() as cur:
+                    ...
+                conn.commit()
+
+        Rolls back on any exception and always returns the connection.
+        """
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn) # putconn rolls back anything uncommitted
+
+    # --- Maintenance & Metrics ---
+
+    def health_check(self):
+        """Validates idle connections, replacing broken ones. Returns True if the DB is reachable."""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._in_use += len(idle)
+        healthy = False
+        for conn, _, _ in idle:
+            if self._is_healthy(conn):
+                healthy = True
+                self.putconn(conn)
+            else:
+                self.putconn(conn, discard=True)
+        if not healthy:
+            try:
+                with self.connection(timeout=1.0) as conn:
+                    healthy = self._is_healthy(conn)
+            except PoolError:
+                healthy = False
+        return healthy
+
+    def stats(self):
+        """Gauges (in_use, idle, total) plus checkout wait-time counters."""
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update({
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "total": len(self._created),
+                "maxconn": self.maxconn,
+            })
+        checkouts = stats["checkouts"]
+        stats["wait_time_avg"] = stats["wait_time_total"] / checkouts if checkouts else 0.0
+        return stats
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close(conn)
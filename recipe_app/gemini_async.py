@@ -0,0 +1,268 @@
+# gemini_async.py
+import asyncio
+import logging
+import os
+import time
+
+try:
+    import httpx # Optional: only needed for the async/ASGI serving mode
+except ImportError:
+    httpx = None
+
+import jsoncodec
+from cache import make_cache_key
+from circuit_breaker import time_remaining
+from substitutions import get_substitution_store
+from gemini_client import DEFAULT_API_BASE, RETRYABLE_STATUS_CODES, _fits, backoff_delay, parse_retry_after
+from metrics import GEMINI_CALL_DURATION, GEMINI_HTTP_DURATION, GEMINI_HTTP_RESPONSES, GEMINI_RETRIES
+from utils import (
+    GEMINI_MODEL, GENERATION_CONFIG, SUBSTITUTION_GENERATION_CONFIG, acquire_gemini_slot, gemini_breaker, gemini_limiter,
+    get_cached_response, get_model_router, get_response_cache, parse_gemini_response, is_valid_substitution, format_substitution_prompt, process_substitution_response
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Async Gemini Client ---
+
+class AsyncGeminiClient:
+    """
+    Non-blocking counterpart of gemini_client.GeminiClient built on
+    httpx.AsyncClient. Thousands of in-flight calls can wait on one event
+    loop instead of each pinning a worker thread. Same pool sizing,
+    timeouts, deadline handling and retry/backoff rules as the sync client.
+    """
+
+    def __init__(self, api_key=None, base_url=DEFAULT_API_BASE, pool_maxsize=100,
+                 connect_timeout=5.0, read_timeout=60.0, max_retries=2, backoff_base=0.5, backoff_max=8.0):
+        if httpx is None:
+            raise RuntimeError("httpx is required for the async Gemini client (pip install httpx).")
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize),
+            headers={'Content-Type': 'application/json'},
+        )
+
+    @classmethod
+    def from_env(cls):
+        """Reads the same GEMINI_* settings as GeminiClient.from_env (pool size via GEMINI_ASYNC_POOL_SIZE)."""
+        return cls(
+            api_key=os.getenv('GEMINI_API_KEY'),
+            base_url=os.getenv('GEMINI_API_BASE', DEFAULT_API_BASE),
+            pool_maxsize=int(os.getenv('GEMINI_ASYNC_POOL_SIZE', '100')),
+            connect_timeout=float(os.getenv('GEMINI_CONNECT_TIMEOUT', '5')),
+            read_timeout=float(os.getenv('GEMINI_READ_TIMEOUT', '60')),
+            max_retries=int(os.getenv('GEMINI_MAX_RETRIES', '2')),
+        )
+
+    def _timeouts(self, deadline):
+        """httpx timeouts shrunk to fit the time left before `deadline`."""
+        remaining = time_remaining(deadline)
+        if remaining is None:
+            return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+        if remaining <= 0:
+            raise httpx.TimeoutException("Request deadline exceeded before calling Gemini.")
+        return httpx.Timeout(min(self.read_timeout, remaining), connect=min(self.connect_timeout, remaining))
+
+    async def post(self, url, payload, deadline=None):
+        """
+        POSTs JSON with retries; raises httpx errors when retries are exhausted.
+        With a `deadline`, timeouts shrink to fit it and no retry is attempted
+        that could not finish before it.
+        """
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = await self.client.post(url, params={'key': self.api_key}, json=payload,
+                                                  timeout=self._timeouts(deadline))
+            except (httpx.ConnectError, httpx.TimeoutException, httpx.RemoteProtocolError) as e:
+                GEMINI_HTTP_RESPONSES.inc(client='async', status=e.__class__.__name__)
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+                if attempt >= self.max_retries or not _fits(deadline, delay):
+                    raise
+                GEMINI_RETRIES.inc(client='async', reason=e.__class__.__name__)
+                logger.warning("Async Gemini request failed (%s), retrying in %.2fs...", e.__class__.__name__, delay)
+            else:
+                GEMINI_HTTP_DURATION.observe(time.perf_counter() - start, client='async')
+                GEMINI_HTTP_RESPONSES.inc(client='async', status=response.status_code)
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max, retry_after)
+                if (response.status_code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries
+                        or not _fits(deadline, delay)):
+                    response.raise_for_status()
+                    return response
+                GEMINI_RETRIES.inc(client='async', reason=response.status_code)
+                logger.warning("Gemini returned HTTP %s, retrying in %.2fs...", response.status_code, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def generate_content(self, model, prompt, generation_config=None, deadline=None):
+        payload = {"contents": [{"parts": [{"text": prompt}]}]}
+        if generation_config:
+            payload["generationConfig"] = generation_config
+        response = await self.post(f"{self.base_url}/models/{model}:generateContent", payload, deadline=deadline)
+        return jsoncodec.loads(response.content)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_async_client = None
+_async_client_key = None # (pid, loop) the client was created for
+
+def get_async_gemini_client():
+    """Returns the async client for the running event loop in this process."""
+    global _async_client, _async_client_key
+    key = (os.getpid(), id(asyncio.get_running_loop()))
+    if _async_client is None or _async_client_key != key:
+        _async_client = AsyncGeminiClient.from_env()
+        _async_client_key = key
+    return _async_client
+
+async def close_async_gemini_client():
+    global _async_client, _async_client_key
+    if _async_client is not None:
+        await _async_client.aclose()
+    _async_client = None
+    _async_client_key = None
+
+
+# --- Async Single-Flight ---
+
+# fingerprint -> asyncio.Future shared by concurrent identical calls on this loop
+_in_flight = {}
+
+async def _request_gemini_async(prompt, generation_config=GENERATION_CONFIG, deadline=None, model=GEMINI_MODEL):
+    """Async version of utils._request_gemini: one call (with retries) to `model`. Returns parsed JSON or None."""
+    client = get_async_gemini_client()
+    if not client.api_key:
+        logger.error("GEMINI_API_KEY not found in environment variables.")
+        return None
+    try:
+        response_json = await client.generate_content(model, prompt, generation_config, deadline=deadline)
+        return parse_gemini_response(response_json)
+    except httpx.TimeoutException:
+        logger.error("API request timed out.")
+        return None
+    except httpx.HTTPError as e:
+        logger.error("Error calling Gemini API: %s", e)
+        return None
+    except Exception as e:
+        logger.exception("An unexpected error occurred during async API call: %s", e)
+        return None
+
+
+async def acquire_gemini_slot_async(deadline=None):
+    """utils.acquire_gemini_slot without blocking the event loop: only a contended wait goes to a thread."""
+    if gemini_limiter.try_acquire():
+        return True
+    return await asyncio.to_thread(acquire_gemini_slot, deadline)
+
+async def _fetch_async(cache_key, prompt, validator, deadline, tier, generation_config, on_fetched):
+    """The coalesced call itself: concurrency slot, breaker, then Gemini (as fetch() in utils.call_gemini_api)."""
+    if not await acquire_gemini_slot_async(deadline):
+        return None
+    if not gemini_breaker.allow_request():
+        gemini_limiter.release(ok=None)
+        logger.warning("Gemini circuit breaker is open, skipping API call.")
+        return None
+    start = time.monotonic()
+    parsed_data = None
+    try:
+        # Same tier model lists, hedging and failover as the sync path; each attempt is bounded by the deadline
+        parsed_data = await get_model_router().call_async(
+            tier, lambda model, attempt_deadline: _request_gemini_async(prompt, generation_config, attempt_deadline, model),
+            validator=validator, deadline=deadline)
+    finally:
+        # Always resolve the slot and the call allow_request() let through, or a half-open probe slot leaks
+        latency = time.monotonic() - start
+        gemini_limiter.release(parsed_data is not None, latency)
+        gemini_breaker.record(parsed_data is not None, latency)
+        GEMINI_CALL_DURATION.observe(latency, result='ok' if parsed_data is not None else 'no_data')
+    if parsed_data is not None and (validator is None or validator(parsed_data)):
+        get_response_cache().set(cache_key, parsed_data)
+        if on_fetched is not None:
+            on_fetched(parsed_data)
+    return parsed_data
+
+
+# --- Public Async API ---
+
+async def call_gemini_api_async(prompt, validator=None, deadline=None, tier='generate', generation_config=GENERATION_CONFIG,
+                                on_fetched=None):
+    """
+    Async version of utils.call_gemini_api. Shares the same response cache
+    and model tiers, and coalesces identical concurrent prompts onto one
+    upstream call. `deadline` (see circuit_breaker.deadline_after) bounds
+    the whole call, including waits on a coalesced call, retries and hedges.
+    `on_fetched(result)` runs only in the call that fetched a new result.
+    """
+    cache_key = make_cache_key(prompt, generation_config, GEMINI_MODEL)
+    cached = get_cached_response(cache_key)
+    if cached is not None:
+        return cached
+
+    if gemini_breaker.is_open():
+        logger.warning("Gemini circuit breaker is open, skipping API call.")
+        return None
+
+    wait_timeout = float(os.getenv('GEMINI_SINGLEFLIGHT_WAIT', '30'))
+    remaining = time_remaining(deadline)
+    if remaining is not None:
+        wait_timeout = max(0.0, min(wait_timeout, remaining))
+    future = _in_flight.get(cache_key)
+    if future is not None:
+        try:
+            # shield() so a timed-out waiter doesn't cancel the shared call
+            return await asyncio.wait_for(asyncio.shield(future), wait_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Gave up waiting %.1fs for an identical in-flight Gemini call.", wait_timeout)
+            return None
+
+    if remaining is not None and remaining <= 0:
+        return None
+
+    # Registered before the first await so identical calls arriving meanwhile wait on this one
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[cache_key] = future
+    try:
+        parsed_data = await _fetch_async(cache_key, prompt, validator, deadline, tier, generation_config, on_fetched)
+        future.set_result(parsed_data)
+        return parsed_data
+    except asyncio.CancelledError:
+        # The leader's own client went away; waiters get no data (their fallback) rather than a cancellation
+        future.set_result(None)
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception() # Mark retrieved so an unawaited future doesn't log a warning
+        raise
+    finally:
+        _in_flight.pop(cache_key, None)
+
+async def get_substitutions_async(ingredient, context=None, deadline=None):
+    """Async version of utils.get_substitutions (store first, LLM on a miss)."""
+    if not ingredient or not isinstance(ingredient, str):
+        return ["Invalid ingredient provided."]
+
+    store = get_substitution_store()
+    known = store.lookup(ingredient, context)
+    if known:
+        logger.debug("Using stored substitution for %s", ingredient)
+        return known
+
+    logger.info("Querying LLM for substitutes for: %s", ingredient)
+    sub_response_data = await call_gemini_api_async(format_substitution_prompt(ingredient, context), validator=is_valid_substitution,
+                                                    deadline=deadline, tier='substitute',
+                                                    generation_config=SUBSTITUTION_GENERATION_CONFIG)
+    suggestions = process_substitution_response(ingredient, sub_response_data)
+    if is_valid_substitution(sub_response_data) and suggestions != ["No specific suggestions found."]:
+        await asyncio.to_thread(store.add, ingredient, suggestions, context) # A SQLite write; keep it off the event loop
+    return suggestions
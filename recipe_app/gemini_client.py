@@ -0,0 +1,208 @@
+# gemini_client.py
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import jsoncodec
+from circuit_breaker import time_remaining
+from metrics import GEMINI_HTTP_DURATION, GEMINI_HTTP_RESPONSES, GEMINI_RETRIES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def parse_retry_after(value):
+    """Parses a Retry-After header (delta-seconds or HTTP-date) into seconds."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _fits(deadline, delay):
+    """True if sleeping `delay` seconds still leaves time for another attempt."""
+    remaining = time_remaining(deadline)
+    return remaining is None or remaining > delay + 0.1
+
+def _cancelled(cancel):
+    """True once the optional `cancel` event has been set."""
+    return cancel is not None and cancel.is_set()
+
+def backoff_delay(attempt, base, cap, retry_after=None):
+    """Full-jitter exponential backoff, never shorter than Retry-After (up to cap)."""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+
+class GeminiClient:
+    """
+    Reusable Gemini REST client. Holds one requests.Session with a sized
+    connection pool so TCP/TLS connections are kept alive between calls,
+    uses separate connect/read timeouts, and retries 429/5xx responses and
+    connection errors with jittered exponential backoff (honouring
+    Retry-After when the server sends one).
+    """
+
+    def __init__(self, api_key=None, base_url=DEFAULT_API_BASE, pool_connections=4, pool_maxsize=20,
+                 connect_timeout=5.0, read_timeout=60.0, max_retries=2, backoff_base=0.5, backoff_max=8.0):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        # Retries are handled here (not by urllib3) so Retry-After and jitter apply uniformly
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds a client from environment variables:
+          GEMINI_API_KEY, GEMINI_API_BASE (point at a local fake server for testing),
+          GEMINI_CONNECT_TIMEOUT, GEMINI_READ_TIMEOUT, GEMINI_MAX_RETRIES, GEMINI_POOL_SIZE
+        """
+        return cls(
+            api_key=os.getenv('GEMINI_API_KEY'),
+            base_url=os.getenv('GEMINI_API_BASE', DEFAULT_API_BASE),
+            pool_maxsize=int(os.getenv('GEMINI_POOL_SIZE', '20')),
+            connect_timeout=float(os.getenv('GEMINI_CONNECT_TIMEOUT', '5')),
+            read_timeout=float(os.getenv('GEMINI_READ_TIMEOUT', '60')),
+            max_retries=int(os.getenv('GEMINI_MAX_RETRIES', '2')),
+        )
+
+    def model_url(self, model, method='generateContent'):
+        return f"{self.base_url}/models/{model}:{method}"
+
+    def _backoff_delay(self, attempt, retry_after=None):
+        return backoff_delay(attempt, self.backoff_base, self.backoff_max, retry_after)
+
+    def _timeouts(self, deadline):
+        """(connect, read) timeouts, shrunk to fit the time left before `deadline`."""
+        remaining = time_remaining(deadline)
+        if remaining is None:
+            return (self.connect_timeout, self.read_timeout)
+        if remaining <= 0:
+            raise requests.exceptions.Timeout("Request deadline exceeded before calling Gemini.")
+        return (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+
+    def post(self, url, payload, params=None, stream=False, deadline=None, cancel=None):
+        """
+        POSTs JSON with retries. Returns the final requests.Response; raises
+        requests exceptions for non-retryable errors or exhausted retries.
+        With stream=True only the connection/status phase is retried.
+        If `deadline` (time.monotonic based) is given, timeouts shrink to fit
+        it and no retry is attempted that could not finish before it.
+        Setting the `cancel` event (a threading.Event) stops further retries,
+        e.g. once a hedged call has been answered by another attempt.
+        """
+        query = {'key': self.api_key}
+        if params:
+            query.update(params)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.post(
+                    url, params=query, data=jsoncodec.dumps_bytes(payload), stream=stream,
+                    timeout=self._timeouts(deadline)
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                GEMINI_HTTP_RESPONSES.inc(client='sync', status=e.__class__.__name__)
+                delay = self._backoff_delay(attempt)
+                if attempt >= self.max_retries or not _fits(deadline, delay) or _cancelled(cancel):
+                    raise
+                GEMINI_RETRIES.inc(client='sync', reason=e.__class__.__name__)
+                logger.warning("Gemini request failed (%s), retrying in %.2fs...", e.__class__.__name__, delay)
+            else:
+                GEMINI_HTTP_DURATION.observe(time.perf_counter() - start, client='sync')
+                GEMINI_HTTP_RESPONSES.inc(client='sync', status=response.status_code)
+                delay = self._backoff_delay(attempt, parse_retry_after(response.headers.get('Retry-After')))
+                if (response.status_code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries
+                        or not _fits(deadline, delay) or _cancelled(cancel)):
+                    response.raise_for_status()
+                    return response
+                GEMINI_RETRIES.inc(client='sync', reason=response.status_code)
+                logger.warning("Gemini returned HTTP %s, retrying in %.2fs...", response.status_code, delay)
+                response.close() # Release the connection back to the pool
+            if cancel is not None:
+                if cancel.wait(delay):
+                    raise requests.exceptions.Timeout("Gemini request cancelled before its retry.")
+            else:
+                time.sleep(delay)
+            attempt += 1
+
+    def generate_content(self, model, prompt, generation_config=None, deadline=None, cancel=None):
+        """Calls models/{model}:generateContent and returns the decoded response JSON."""
+        payload = {"contents": [{"parts": [{"text": prompt}]}]}
+        if generation_config:
+            payload["generationConfig"] = generation_config
+        return jsoncodec.loads(self.post(self.model_url(model), payload, deadline=deadline, cancel=cancel).content)
+
+    def stream_generate_content(self, model, prompt, generation_config=None, deadline=None):
+        """
+        Calls models/{model}:streamGenerateContent over SSE and yields each
+        decoded response chunk (same shape as a generateContent response).
+        """
+        payload = {"contents": [{"parts": [{"text": prompt}]}]}
+        if generation_config:
+            payload["generationConfig"] = generation_config
+        response = self.post(self.model_url(model, 'streamGenerateContent'), payload,
+                             params={'alt': 'sse'}, stream=True, deadline=deadline)
+        response.encoding = 'utf-8' # SSE is always UTF-8; don't let requests guess Latin-1
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if line and line.startswith('data:'):
+                    yield jsoncodec.loads(line[5:].strip())
+        finally:
+            response.close()
+
+    def close(self):
+        self.session.close()
+
+
+# --- Process-wide Client ---
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def get_gemini_client():
+    """
+    Returns the shared client for this process, creating it on first use.
+    Recreated after a fork so workers never share pooled sockets.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = GeminiClient.from_env()
+                _client_pid = os.getpid()
+    return _client
+
+def set_gemini_client(client):
+    """Overrides the shared client (e.g. one pointed at a local fake server)."""
+    global _client, _client_pid
+    with _client_lock:
+        _client = client
+        _client_pid = os.getpid()
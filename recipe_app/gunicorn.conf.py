@@ -0,0 +1,45 @@
+# gunicorn.conf.py
+"""
+Production entry point: several processes, each with a pool of threads.
+
+    gunicorn -c gunicorn.conf.py
+
+Requests spend most of their time waiting on Gemini or the database, so
+each worker runs GUNICORN_THREADS threads (gthread), and the process count
+tracks the CPU count for the CPU-bound parts (templates, JSON, hashing is
+in its own process pool). The app is imported once in the master
+(preload_app) and forked; create_app() does no I/O, so every worker opens
+its own DB pool, SQLite handles and Gemini client on first use.
+"""
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+wsgi_app = 'app:app'
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', str(multiprocessing.cpu_count())))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+preload_app = True
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60')) # Above GENERATE_SLO_SECONDS
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then (jittered so they don't all restart together)
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '5000'))
+max_requests_jitter = max_requests // 10
+accesslog = None # Requests are already logged/measured by the app
+
+
+def post_worker_init(worker):
+    """Loads local data in the new worker before it accepts connections."""
+    from app import warm_up
+    warm_up(worker.wsgi)
+
+
+def child_exit(server, worker):
+    """Folds a recycled/exited worker's metrics file into the shared total (METRICS_MULTIPROC_DIR)."""
+    from metrics import REGISTRY
+    REGISTRY.mark_process_dead(worker.pid)
@@ -0,0 +1,453 @@
+# jobs.py
+import hashlib
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+import jsoncodec
+from metrics import GENERATION_JOBS
+
+logger = logging.getLogger(__name__)
+
+class QueueFull(Exception):
+    """Raised by submit() when too many jobs are already waiting."""
+
+PENDING = ('queued', 'running')
+FINISHED = ('done', 'failed')
+
+
+def dedup_key(fingerprint, user_id=None):
+    """
+    The key submits are deduplicated on: the request fingerprint, scoped to
+    the user. A job saves its recipe to its submitter's history, so another
+    user's identical request needs its own job (the Gemini call itself is
+    still shared through the response cache and single-flight).
+    """
+    if user_id is None:
+        return fingerprint
+    return hashlib.sha256(f"{fingerprint}:{user_id}".encode('utf-8')).hexdigest()
+
+
+# --- Backends ---
+# Every backend stores the same job record. Times are epoch seconds.
+# A job is claimed by setting status='running' and a lease; a running job
+# whose lease ran out (its process died) is claimed again, up to the
+# queue's max_attempts.
+
+def _job_dict(row):
+    job_id, status, result, error = row
+    return {"job_id": job_id, "status": status, "result": jsoncodec.loads(result) if result else None, "error": error}
+
+
+class MemoryJobBackend:
+    """Jobs in this process only: GET /jobs/<id> must reach the worker that accepted the job."""
+
+    def __init__(self):
+        self._jobs = {}      # job_id -> record dict
+        self._by_fingerprint = {}
+        self._queued = []    # job IDs in submission order
+        self._lock = threading.Lock()
+
+    def find_or_create(self, job_id, fingerprint, request_json, user_id, now, max_pending):
+        with self._lock:
+            existing = self._jobs.get(self._by_fingerprint.get(fingerprint))
+            if existing and (existing['status'] in PENDING or
+                             (existing['reusable'] and existing['expires_at'] > now)):
+                return existing['job_id'], False
+            if len(self._queued) >= max_pending:
+                raise QueueFull()
+            self._jobs[job_id] = {
+                'job_id': job_id, 'fingerprint': fingerprint, 'request': request_json, 'user_id': user_id,
+                'status': 'queued', 'result': None, 'error': None, 'reusable': False,
+                'attempts': 0, 'lease_until': 0.0, 'expires_at': float('inf'),
+            }
+            self._by_fingerprint[fingerprint] = job_id
+            self._queued.append(job_id)
+            return job_id, True
+
+    def claim(self, now, lease):
+        with self._lock:
+            if not self._queued:
+                return None
+            job = self._jobs[self._queued.pop(0)]
+            job.update(status='running', lease_until=now + lease, attempts=job['attempts'] + 1)
+            return job['job_id'], job['request'], job['user_id'], job['attempts']
+
+    def finish(self, job_id, status, result_json, error, reusable, expires_at):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(status=status, result=result_json, error=error, reusable=reusable, expires_at=expires_at)
+
+    def get(self, job_id, now):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['expires_at'] <= now:
+                return None
+            return _job_dict((job['job_id'], job['status'], job['result'], job['error']))
+
+    def sweep(self, now, limit):
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job['expires_at'] <= now][:limit]
+            for job_id in expired:
+                job = self._jobs.pop(job_id)
+                if self._by_fingerprint.get(job['fingerprint']) == job_id:
+                    del self._by_fingerprint[job['fingerprint']]
+            return len(expired)
+
+
+class SQLiteJobBackend:
+    """Jobs in a SQLite file, so every worker process on the host shares one queue."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS generation_jobs (
+                job_id TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                request TEXT NOT NULL,
+                user_id INTEGER,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                reusable INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                lease_until REAL NOT NULL DEFAULT 0,
+                expires_at REAL
+            );
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS generation_jobs_fingerprint_idx ON generation_jobs (fingerprint);")
+        conn.execute("CREATE INDEX IF NOT EXISTS generation_jobs_status_idx ON generation_jobs (status, created_at);")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, fn):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE;") # Serialize check-then-write across processes
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT;")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK;")
+            raise
+
+    def find_or_create(self, job_id, fingerprint, request_json, user_id, now, max_pending):
+        def create(conn):
+            row = conn.execute(
+                "SELECT job_id FROM generation_jobs WHERE fingerprint = ? AND "
+                "(status IN ('queued', 'running') OR (status = 'done' AND reusable = 1 AND expires_at > ?)) "
+                "ORDER BY created_at DESC LIMIT 1;", (fingerprint, now)
+            ).fetchone()
+            if row:
+                return row[0], False
+            queued = conn.execute("SELECT COUNT(*) FROM generation_jobs WHERE status = 'queued';").fetchone()[0]
+            if queued >= max_pending:
+                raise QueueFull()
+            conn.execute(
+                "INSERT INTO generation_jobs (job_id, fingerprint, request, user_id, status, created_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?);", (job_id, fingerprint, request_json, user_id, now)
+            )
+            return job_id, True
+        return self._transaction(create)
+
+    def claim(self, now, lease):
+        def claim(conn):
+            row = conn.execute(
+                "SELECT job_id, request, user_id, attempts FROM generation_jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY created_at LIMIT 1;", (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE generation_jobs SET status = 'running', lease_until = ?, attempts = attempts + 1 "
+                "WHERE job_id = ?;", (now + lease, row[0])
+            )
+            return row[0], row[1], row[2], row[3] + 1
+        return self._transaction(claim)
+
+    def finish(self, job_id, status, result_json, error, reusable, expires_at):
+        self._conn().execute(
+            "UPDATE generation_jobs SET status = ?, result = ?, error = ?, reusable = ?, expires_at = ? "
+            "WHERE job_id = ?;", (status, result_json, error, int(reusable), expires_at, job_id)
+        )
+
+    def get(self, job_id, now):
+        row = self._conn().execute(
+            "SELECT job_id, status, result, error FROM generation_jobs "
+            "WHERE job_id = ? AND (expires_at IS NULL OR expires_at > ?);", (job_id, now)
+        ).fetchone()
+        return _job_dict(row) if row else None
+
+    def sweep(self, now, limit):
+        return self._conn().execute(
+            "DELETE FROM generation_jobs WHERE job_id IN "
+            "(SELECT job_id FROM generation_jobs WHERE expires_at <= ? LIMIT ?);", (now, limit)
+        ).rowcount
+
+
+class PostgresJobBackend:
+    """Jobs in Postgres, so app processes on every host share one queue."""
+
+    def __init__(self, get_conn, put_conn):
+        self._get_conn = get_conn
+        self._put_conn = put_conn
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS generation_jobs (
+                job_id VARCHAR(32) PRIMARY KEY,
+                fingerprint CHAR(64) NOT NULL,
+                request TEXT NOT NULL,
+                user_id INTEGER,
+                status VARCHAR(8) NOT NULL,
+                result TEXT,
+                error TEXT,
+                reusable BOOLEAN NOT NULL DEFAULT FALSE,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at DOUBLE PRECISION NOT NULL,
+                lease_until DOUBLE PRECISION NOT NULL DEFAULT 0,
+                expires_at DOUBLE PRECISION
+            );
+        """)
+        # At most one pending job per fingerprint, even when two hosts submit at once
+        self._execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS generation_jobs_pending_idx ON generation_jobs (fingerprint) "
+            "WHERE status IN ('queued', 'running');"
+        )
+        self._execute("CREATE INDEX IF NOT EXISTS generation_jobs_status_idx ON generation_jobs (status, created_at);")
+
+    def _execute(self, sql, params=(), fetch=False):
+        conn = self._get_conn()
+        if not conn:
+            raise RuntimeError("No DB connection available for the job queue.")
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                result = cur.fetchone() if fetch else cur.rowcount
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._put_conn(conn)
+
+    def _find(self, fingerprint, now):
+        row = self._execute(
+            "SELECT job_id FROM generation_jobs WHERE fingerprint = %s AND "
+            "(status IN ('queued', 'running') OR (status = 'done' AND reusable AND expires_at > %s)) "
+            "ORDER BY created_at DESC LIMIT 1;", (fingerprint, now), fetch=True
+        )
+        return row[0] if row else None
+
+    def find_or_create(self, job_id, fingerprint, request_json, user_id, now, max_pending):
+        existing = self._find(fingerprint, now)
+        if existing:
+            return existing, False
+        queued = self._execute("SELECT COUNT(*) FROM generation_jobs WHERE status = 'queued';", fetch=True)[0]
+        if queued >= max_pending:
+            raise QueueFull()
+        inserted = self._execute(
+            "INSERT INTO generation_jobs (job_id, fingerprint, request, user_id, status, created_at) "
+            "VALUES (%s, %s, %s, %s, 'queued', %s) "
+            "ON CONFLICT (fingerprint) WHERE status IN ('queued', 'running') DO NOTHING;",
+            (job_id, fingerprint, request_json, user_id, now)
+        )
+        if inserted == 1:
+            return job_id, True
+        return self._find(fingerprint, now) or job_id, False # Someone else queued it first
+
+    def claim(self, now, lease):
+        return self._execute(
+            "UPDATE generation_jobs SET status = 'running', lease_until = %s, attempts = attempts + 1 "
+            "WHERE job_id = (SELECT job_id FROM generation_jobs "
+            "WHERE status = 'queued' OR (status = 'running' AND lease_until < %s) "
+            "ORDER BY created_at LIMIT 1 FOR UPDATE SKIP LOCKED) "
+            "RETURNING job_id, request, user_id, attempts;", (now + lease, now), fetch=True
+        )
+
+    def finish(self, job_id, status, result_json, error, reusable, expires_at):
+        self._execute(
+            "UPDATE generation_jobs SET status = %s, result = %s, error = %s, reusable = %s, expires_at = %s "
+            "WHERE job_id = %s;", (status, result_json, error, bool(reusable), expires_at, job_id)
+        )
+
+    def get(self, job_id, now):
+        row = self._execute(
+            "SELECT job_id, status, result, error FROM generation_jobs "
+            "WHERE job_id = %s AND (expires_at IS NULL OR expires_at > %s);", (job_id, now), fetch=True
+        )
+        return _job_dict(row) if row else None
+
+    def sweep(self, now, limit):
+        return self._execute(
+            "DELETE FROM generation_jobs WHERE job_id IN "
+            "(SELECT job_id FROM generation_jobs WHERE expires_at <= %s LIMIT %s);", (now, limit)
+        )
+
+
+# --- Queue ---
+
+class JobQueue:
+    """
+    Background recipe generation for POST /generate?async=1. submit()
+    stores the request and returns a job ID at once; `workers` daemon
+    threads per process claim jobs and run `handler(request, user_id)`,
+    which returns (result, reusable). Results are kept for `result_ttl`
+    seconds. While a job for the same request fingerprint and user (see
+    dedup_key) is pending, or reusable and unexpired, submit() returns that
+    job instead of a new one.
+    Threads start on first use, so each forked worker gets its own.
+    """
+
+    def __init__(self, backend, handler, workers=4, max_pending=200, result_ttl=600, lease=120,
+                 max_attempts=2, poll_interval=0.5, sweep_interval=300):
+        self.backend = backend
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        self._work = threading.Condition() # Local submits wake an idle worker immediately
+        self._done = threading.Condition() # Local completions wake long-polling requests
+        self._threads = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, fingerprint, request_data, user_id=None):
+        """Returns (job_id, created). Raises QueueFull when max_pending jobs are waiting."""
+        self._ensure_started()
+        try:
+            job_id, created = self.backend.find_or_create(
+                secrets.token_urlsafe(16), dedup_key(fingerprint, user_id), jsoncodec.dumps(request_data), user_id,
+                time.time(), self.max_pending)
+        except QueueFull:
+            GENERATION_JOBS.inc(event='rejected')
+            raise
+        GENERATION_JOBS.inc(event='created' if created else 'deduplicated')
+        if created:
+            with self._work:
+                self._work.notify()
+        return job_id, created
+
+    def get(self, job_id, wait=0.0):
+        """The job's status/result dict, or None if unknown or expired. Waits up to `wait` seconds for it to finish."""
+        self._ensure_started()
+        deadline = time.monotonic() + wait
+        while True:
+            job = self.backend.get(job_id, time.time())
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] in FINISHED or remaining <= 0:
+                return job
+            with self._done:
+                self._done.wait(min(remaining, self.poll_interval))
+
+    # --- Workers ---
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._threads = [
+                    threading.Thread(target=self._run, name=f'generation-job-{n}', daemon=True)
+                    for n in range(self.workers)
+                ]
+                for thread in self._threads:
+                    thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._maybe_sweep()
+                job = self.backend.claim(time.time(), self.lease)
+            except Exception as e:
+                logger.error("Error claiming a generation job: %s", e)
+                job = None
+            if job is None:
+                with self._work:
+                    self._work.wait(self.poll_interval)
+                continue
+            self._execute(*job)
+
+    def _execute(self, job_id, request_json, user_id, attempts):
+        now = time.time()
+        if attempts > self.max_attempts:
+            # Its earlier runs never finished (process killed mid-job); don't retry forever
+            status, result, error, reusable = 'failed', None, "Job abandoned after repeated interruptions.", False
+        else:
+            try:
+                result, reusable = self.handler(jsoncodec.loads(request_json), user_id)
+                status, error = 'done', None
+            except Exception as e:
+                logger.exception("Generation job %s failed: %s", job_id, e)
+                status, result, error, reusable = 'failed', None, "Recipe generation failed.", False
+        try:
+            self.backend.finish(job_id, status, jsoncodec.dumps(result) if result is not None else None,
+                                error, reusable, time.time() + self.result_ttl)
+        except Exception as e:
+            logger.error("Error storing the result of generation job %s: %s", job_id, e)
+            return
+        GENERATION_JOBS.inc(event='completed' if status == 'done' else 'failed')
+        logger.info("Generation job %s %s in %.2fs.", job_id, status, time.time() - now)
+        with self._done:
+            self._done.notify_all()
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        removed = self.backend.sweep(now, 1000)
+        if removed:
+            logger.info("Removed %d expired generation jobs.", removed)
+
+
+def build_job_queue(handler, get_conn=None, put_conn=None):
+    """
+    Returns the generation job queue configured from environment variables:
+      JOB_BACKEND          - 'sqlite' (default, shared by the host's workers), 'postgres' or 'memory'
+      JOB_SQLITE_PATH      - file used by the sqlite backend
+      JOB_WORKERS          - generation threads per process (default 4)
+      JOB_MAX_PENDING      - queued jobs before new ones get 503 (default 200)
+      JOB_RESULT_TTL       - seconds results stay fetchable and reusable (default 600)
+      JOB_LEASE            - seconds before a running job whose process died is retried (default 120)
+    """
+    backend_name = os.getenv('JOB_BACKEND', 'sqlite').lower()
+    backend = None
+    if backend_name == 'postgres' and get_conn and put_conn:
+        try:
+            backend = PostgresJobBackend(get_conn, put_conn)
+        except Exception as e:
+            logger.warning("Could not initialize Postgres job queue: %s. Using SQLite.", e)
+    if backend is None and backend_name == 'memory':
+        backend = MemoryJobBackend()
+    if backend is None:
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generation_jobs.sqlite3')
+        backend = SQLiteJobBackend(os.getenv('JOB_SQLITE_PATH', default_path))
+    return JobQueue(
+        backend, handler,
+        workers=int(os.getenv('JOB_WORKERS', '4')),
+        max_pending=int(os.getenv('JOB_MAX_PENDING', '200')),
+        result_ttl=float(os.getenv('JOB_RESULT_TTL', '600')),
+        lease=float(os.getenv('JOB_LEASE', '120')),
+        poll_interval=0.5 if backend_name != 'memory' else 5.0,
+    )
@@ -0,0 +1,83 @@
+# jsoncodec.py
+"""
+JSON encoding/decoding for hot paths (Gemini payloads, API responses,
+caches). Uses orjson when it is installed and the stdlib json module
+otherwise; both produce the same JSON, and decode errors are
+json.JSONDecodeError either way (orjson's error subclasses it).
+"""
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson # Optional: several times faster than json for large payloads
+except ImportError:
+    orjson = None
+
+JSONDecodeError = json.JSONDecodeError
+
+def backend():
+    """'orjson' or 'json', for logs and benchmarks."""
+    return 'orjson' if orjson is not None else 'json'
+
+def loads(data):
+    """Parses JSON from str or bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(obj):
+    """Compact JSON text (non-ASCII kept as UTF-8)."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+def dumps_bytes(obj):
+    """Compact JSON encoded as UTF-8 bytes, ready for a response body or a BLOB column."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider (jsonify, request.get_json) backed by orjson when
+    available. Keys stay sorted like Flask's default; dates, dataclasses and
+    the other types Flask knows go through its `default` hook, and anything
+    orjson rejects (e.g. integers over 64 bits) falls back to the stdlib.
+    """
+
+    def _options(self, pretty=False):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def _encode(self, obj, pretty=False):
+        return orjson.dumps(obj, default=self.default, option=self._options(pretty))
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        try:
+            return self._encode(obj).decode('utf-8')
+        except TypeError:
+            return super().dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        try:
+            body = self._encode(obj, pretty) + b'\n' # Trailing newline, as Flask's own provider writes
+        except TypeError:
+            return super().response(obj)
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,163 @@
+# logging_config.py
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+
+# Request ID of the request being handled in this thread/task ('-' outside requests)
+request_id_var = contextvars.ContextVar('request_id', default='-')
+
+# Attributes every LogRecord has; anything else came from `extra=` and is emitted as a field
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+
+def new_request_id(incoming=None):
+    """Uses a sane client-supplied X-Request-ID, else a fresh random one. Returns the ID set."""
+    if incoming and len(incoming) <= 64 and incoming.replace('-', '').replace('_', '').isalnum():
+        request_id = incoming
+    else:
+        request_id = uuid.uuid4().hex
+    request_id_var.set(request_id)
+    return request_id
+
+def get_request_id():
+    return request_id_var.get()
+
+
+class LazyJSON:
+    """
+    Defers json.dumps until a record is actually emitted, so large payloads
+    are never serialized when their level is disabled:
+
+        logger.debug("Received JSON: %s", LazyJSON(response_json))
+    """
+    __slots__ = ('obj', 'indent', 'limit')
+
+    def __init__(self, obj, indent=None, limit=2000):
+        self.obj = obj
+        self.indent = indent
+        self.limit = limit
+
+    def __str__(self):
+        try:
+            text = json.dumps(self.obj, indent=self.indent, default=str)
+        except (TypeError, ValueError):
+            text = repr(self.obj)
+        if self.limit and len(text) > self.limit:
+            text = text[:self.limit] + f"... [{len(text) - self.limit} more chars]"
+        return text
+
+
+# --- Filters & Formatters ---
+
+class RequestIdFilter(logging.Filter):
+    """Stamps each record with the current request ID (runs in the calling thread)."""
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+class DebugSamplingFilter(logging.Filter):
+    """Lets through only `rate` of DEBUG records; INFO and above always pass."""
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1.0 or random.random() < self.rate
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, request_id, pid, extra fields, exc."""
+    def format(self, record):
+        entry = {
+            "ts": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, 'request_id', '-'),
+            "pid": record.process,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Renders the message (cheap %-formatting) and traceback in the caller's
+    thread so arguments can't change before the listener writes them, but
+    leaves layout (JSON/text) to the listener thread.
+    """
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# --- Setup ---
+
+_listener = None
+
+def configure_logging(level=None, fmt=None, debug_sample_rate=None, stream=None):
+    """
+    Routes all logging through a queue to a background writer thread, so
+    request threads never block on the stdout lock. Settings (env):
+      LOG_LEVEL (INFO), LOG_FORMAT (json | text), LOG_DEBUG_SAMPLE_RATE (1.0)
+    Safe to call more than once; later calls are ignored.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+    fmt = (fmt or os.getenv('LOG_FORMAT', 'json')).lower()
+    rate = float(debug_sample_rate if debug_sample_rate is not None else os.getenv('LOG_DEBUG_SAMPLE_RATE', '1.0'))
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if fmt == 'text':
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'))
+    else:
+        output.setFormatter(JSONFormatter())
+
+    log_queue = queue.SimpleQueue() # Unbounded: logging must never block a request
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(RequestIdFilter())
+    handler.addFilter(DebugSamplingFilter(rate))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level) # Level gating happens before any record or message is built
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_stop_listener) # Drain queued records on shutdown
+
+    if hasattr(os, 'register_at_fork'):
+        # The writer thread doesn't survive fork (gunicorn --preload); give each child its own
+        os.register_at_fork(after_in_child=lambda: _restart_listener(handler, output))
+
+def _restart_listener(handler, output):
+    global _listener
+    handler.queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
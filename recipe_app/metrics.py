@@ -0,0 +1,444 @@
+# metrics.py
+import glob
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets (seconds) covering fast cache hits through slow LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEAD_SNAPSHOT = 'metrics_dead.json' # Counters and histograms of exited processes, folded together
+
+
+class Registry:
+    """
+    In-process metric store. Updates are a dict operation under one lock.
+
+    For multi-process servers (gunicorn), set METRICS_MULTIPROC_DIR to a
+    directory shared by the workers and emptied on deploy: each process
+    periodically writes a snapshot file there (and always right before a
+    scrape), and render() sums the snapshots so any worker's /metrics
+    returns totals for the whole server. Counters and histograms of exited
+    workers are kept so totals never go backwards; their gauges are dropped.
+    mark_process_dead() folds an exited worker's file into one aggregate,
+    so recycled workers don't leave a file each behind.
+    """
+
+    def __init__(self, multiproc_dir=None, flush_interval=5.0):
+        self.multiproc_dir = multiproc_dir
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._flusher = None
+        if hasattr(os, 'register_at_fork'):
+            # Counts from a preloading parent must not be re-reported by every worker
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    @classmethod
+    def from_env(cls):
+        """Reads METRICS_MULTIPROC_DIR and METRICS_FLUSH_INTERVAL."""
+        return cls(
+            multiproc_dir=os.getenv('METRICS_MULTIPROC_DIR') or None,
+            flush_interval=float(os.getenv('METRICS_FLUSH_INTERVAL', '5')),
+        )
+
+    def register(self, metric):
+        """Adds a metric; returns the registry so metrics can keep a reference to it."""
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered.")
+            self._metrics[metric.name] = metric
+        return self
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._flusher = None
+        for metric in self._metrics.values():
+            metric._reset()
+
+    # --- Snapshots ---
+
+    def collect(self):
+        """{name: {label_key: value}} for this process (values are JSON-friendly)."""
+        return {name: metric._snapshot() for name, metric in list(self._metrics.items())}
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.multiproc_dir, f"metrics_{pid}.json")
+
+    def _write_snapshot(self, path, pid, metrics):
+        """Atomically writes {name: {label_key: value}} as a snapshot file. Returns True on success."""
+        data = {name: [[list(key), value] for key, value in series.items()] for name, series in metrics.items()}
+        fd, tmp_path = tempfile.mkstemp(dir=self.multiproc_dir, prefix='.metrics-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({"pid": pid, "metrics": data}, f)
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            logger.error("Error writing metrics snapshot: %s", e)
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return False
+
+    def flush(self):
+        """Writes this process's snapshot atomically (multi-process mode only)."""
+        if not self.multiproc_dir:
+            return
+        self._write_snapshot(self._snapshot_path(os.getpid()), os.getpid(), self.collect())
+
+    def mark_process_dead(self, pid):
+        """
+        Adds an exited process's counters and histograms to DEAD_SNAPSHOT and
+        deletes its own file (its gauges are dropped). Call it from one
+        process only: the gunicorn master's child_exit hook.
+        """
+        if not self.multiproc_dir:
+            return
+        path = self._snapshot_path(pid)
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return # Exited before its first flush
+        except (OSError, ValueError) as e:
+            logger.error("Error reading metrics snapshot of exited pid %s: %s", pid, e)
+            return
+        dead_path = os.path.join(self.multiproc_dir, DEAD_SNAPSHOT)
+        totals = {}
+        try:
+            with open(dead_path) as f:
+                sources = [json.load(f), snapshot]
+        except FileNotFoundError:
+            sources = [snapshot]
+        except (OSError, ValueError) as e:
+            logger.error("Error reading %s; leaving pid %s's snapshot in place: %s", dead_path, pid, e)
+            return
+        for source in sources:
+            for name, series in source.get("metrics", {}).items():
+                metric = self._metrics.get(name)
+                if metric is None or metric.kind == 'gauge':
+                    continue
+                merged = totals.setdefault(name, {})
+                for key, value in series:
+                    key = tuple(key)
+                    merged[key] = metric._merge(merged.get(key), value)
+        if self._write_snapshot(dead_path, None, totals):
+            try:
+                os.unlink(path)
+            except OSError as e:
+                logger.error("Error removing metrics snapshot %s: %s", path, e)
+
+    def start_flusher(self):
+        """Starts the background snapshot writer for this process (idempotent)."""
+        if not self.multiproc_dir or self._flusher is not None:
+            return
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+
+        def loop():
+            while True:
+                time.sleep(self.flush_interval)
+                self.flush()
+
+        self._flusher = threading.Thread(target=loop, name='metrics-flush', daemon=True)
+        self._flusher.start()
+
+    def _merged(self):
+        """Sums every process's snapshot (or returns the local one)."""
+        if not self.multiproc_dir:
+            return self.collect()
+        self.start_flusher()
+        self.flush()
+        merged = {name: {} for name in self._metrics}
+        for path in glob.glob(os.path.join(self.multiproc_dir, 'metrics_*.json')):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue # Being replaced or truncated; next scrape will pick it up
+            alive = _pid_alive(snapshot.get("pid"))
+            for name, series in snapshot.get("metrics", {}).items():
+                metric = self._metrics.get(name)
+                if metric is None or (metric.kind == 'gauge' and not alive):
+                    continue
+                for key, value in series:
+                    key = tuple(key)
+                    merged[name][key] = metric._merge(merged[name].get(key), value)
+        return merged
+
+    # --- Exposition ---
+
+    def render(self):
+        """Prometheus text exposition format (0.0.4)."""
+        merged = self._merged()
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(merged.get(name, {}).items()):
+                lines.extend(metric._expose(key, value))
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid):
+    if not isinstance(pid, int):
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# --- Metric Types ---
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._registry = (registry or REGISTRY).register(self)
+
+    @property
+    def _lock(self):
+        return self._registry._lock # Looked up each time: the registry swaps it after fork
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _reset(self):
+        self._values = {}
+
+    def _snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. Counter('x_total', '...', ['status']).inc(status=200)."""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _merge(self, current, value):
+        return (current or 0) + value
+
+    def _expose(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Gauge(_Metric):
+    """
+    Point-in-time value. Either set() explicitly or pass `fn`, a callable
+    returning {label_tuple: value} (or a bare number when there are no
+    labels), evaluated at collection time. Multi-process totals are summed.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, fn=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _snapshot(self):
+        if self.fn is None:
+            return super()._snapshot()
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.error("Error collecting gauge %s: %s", self.name, e)
+            return {}
+        if isinstance(value, dict):
+            return {tuple(str(v) for v in key): val for key, val in value.items()}
+        return {(): value}
+
+    def _merge(self, current, value):
+        return (current or 0) + value
+
+    def _expose(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    """Bucketed distribution of observations (latencies in seconds by default)."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the with-block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _snapshot(self):
+        with self._lock:
+            return {key: [list(counts), total] for key, (counts, total) in self._values.items()}
+
+    def _merge(self, current, value):
+        if current is None:
+            return [list(value[0]), value[1]]
+        return [[a + b for a, b in zip(current[0], value[0])], current[1] + value[1]]
+
+    def _expose(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            le = 'le="%s"' % _format_value(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(float(total))}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def timed(histogram, result=None, **labels):
+    """
+    Decorator observing the wrapped function's duration in `histogram`.
+    `result`, if given, maps the return value to a value for the 'result'
+    label (e.g. lambda data: 'ok' if data is not None else 'fallback').
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                value = fn(*args, **kwargs)
+                outcome = result(value) if result else None
+                return value
+            finally:
+                extra = {'result': outcome} if result else {}
+                histogram.observe(time.perf_counter() - start, **labels, **extra)
+        return wrapper
+    return decorator
+
+
+REGISTRY = Registry.from_env()
+
+def render_metrics():
+    return REGISTRY.render()
+
+
+# --- Application Metrics ---
+# Defined here so every module (and every worker) registers the same series.
+
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests.', ['method', 'route', 'status'])
+
+GEMINI_CALL_DURATION = Histogram(
+    'gemini_call_duration_seconds',
+    'Time of routed Gemini calls (retries, hedges and failover included; cache and coalesced hits are not).',
+    ['result'])
+GEMINI_HTTP_RESPONSES = Counter(
+    'gemini_http_responses_total', 'Gemini HTTP attempts by status code (or error class).', ['client', 'status'])
+GEMINI_HTTP_DURATION = Histogram(
+    'gemini_http_request_duration_seconds', 'Latency of individual Gemini HTTP attempts.', ['client'])
+GEMINI_RETRIES = Counter(
+    'gemini_retries_total', 'Gemini HTTP attempts that were retried.', ['client', 'reason'])
+GEMINI_MODEL_CALLS = Counter(
+    'gemini_model_calls_total', 'Routed Gemini attempts by tier, model and outcome (ok, error, cancelled).',
+    ['tier', 'model', 'outcome'])
+GEMINI_HEDGES = Counter(
+    'gemini_hedges_total', 'Hedged Gemini calls by tier and outcome (fired, won, lost).', ['tier', 'outcome'])
+
+LLM_PARSE_FAILURES = Counter(
+    'llm_parse_failures_total', 'Gemini responses whose JSON payload could not be extracted.', ['reason'])
+RECIPE_FALLBACKS = Counter(
+    'recipe_mock_fallbacks_total', 'Recipes answered with mock_recipe instead of LLM output.', ['reason'])
+
+DB_POOL_WAIT = Histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting to check a connection out of the DB pool.', ['pool'],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+DB_POOL_TIMEOUTS = Counter(
+    'db_pool_checkout_timeouts_total', 'DB pool checkouts that gave up waiting.', ['pool'])
+
+PASSWORD_HASH_DURATION = Histogram(
+    'password_hash_duration_seconds', 'Time spent hashing or verifying passwords.', ['operation'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+RECIPE_CORPUS_LOOKUPS = Counter(
+    'recipe_corpus_lookups_total', '/generate requests checked against stored recipes before calling Gemini.', ['result'])
+RECIPE_WRITES = Counter(
+    'recipe_history_writes_total', 'Recipes handed to the background history writer, by outcome.', ['result'])
+RETRIEVAL_LOOKUPS = Counter(
+    'retrieval_lookups_total', '/generate requests checked against the nearest-recipe index.', ['result'])
+
+SESSION_LOADS = Counter(
+    'session_loads_total', 'Server-side session lookups by where they were answered.', ['source'])
+
+ADMISSION_REJECTIONS = Counter(
+    'admission_rejections_total', 'Requests or Gemini calls turned away by rate or concurrency limits.', ['reason'])
+RATE_LIMITED_REQUESTS = Counter(
+    'rate_limited_requests_total', 'Requests over their rate limit, by endpoint and how they were answered.',
+    ['endpoint', 'action'])
+
+WARM_CACHE_LOOKUPS = Counter(
+    'warm_cache_lookups_total', 'Lookups in the precomputed warm cache file.', ['result'])
+
+SHOPPING_LIST_SYNCS = Counter(
+    'shopping_list_syncs_total', 'Shopping list PATCHes by result (applied, unchanged, conflict).', ['result'])
+SHOPPING_LIST_READS = Counter(
+    'shopping_list_reads_total', 'Shopping list GETs by response (full, delta, not_modified).', ['response'])
+
+GENERATION_JOBS = Counter(
+    'generation_jobs_total', 'Async /generate jobs by event (created, deduplicated, rejected, completed, failed).',
+    ['event'])
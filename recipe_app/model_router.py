@@ -0,0 +1,327 @@
+# model_router.py
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from circuit_breaker import time_remaining
+from metrics import GEMINI_HEDGES, GEMINI_MODEL_CALLS
+
+logger = logging.getLogger(__name__)
+
+# name: Gemini model ID; timeout: seconds one attempt on it may take (retries included)
+ModelEndpoint = namedtuple('ModelEndpoint', ['name', 'timeout'])
+
+
+def parse_models(spec, default_timeout=20.0):
+    """'gemini-1.5-pro-latest:20, gemini-1.5-flash-latest' -> [ModelEndpoint, ...] in preference order."""
+    endpoints = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, timeout = item.partition(':')
+        endpoints.append(ModelEndpoint(name.strip(), float(timeout) if timeout else default_timeout))
+    return endpoints
+
+
+# --- Latency Stats ---
+
+class ModelStats:
+    """Recent successful latencies, a p95 over them, and win/loss counts for one model in one tier."""
+
+    def __init__(self, window=200):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.wins = 0
+
+    def record(self, latency, ok, cancelled=False):
+        """Counts one attempt; cancelled attempts say nothing about the model's latency."""
+        with self._lock:
+            self.calls += 1
+            if cancelled:
+                return
+            if ok:
+                self._latencies.append(latency)
+            else:
+                self.errors += 1
+
+    def record_win(self):
+        with self._lock:
+            self.wins += 1
+
+    def percentile(self, q, min_samples=20):
+        """The q-quantile of recent latencies, or None with fewer than min_samples."""
+        with self._lock:
+            if len(self._latencies) < min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self):
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        with self._lock:
+            return {
+                "calls": self.calls, "errors": self.errors, "wins": self.wins,
+                "win_rate": round(self.wins / self.calls, 3) if self.calls else None,
+                "p50": round(p50, 3) if p50 is not None else None,
+                "p95": round(p95, 3) if p95 is not None else None,
+            }
+
+
+# --- Router ---
+
+class ModelTier:
+    """
+    An ordered list of models for one kind of request. The first model is
+    called; if it hasn't answered after the hedge delay, a backup attempt
+    on the next model is fired and whichever valid answer arrives first
+    wins. A tier with a single model never hedges: a second identical call
+    would only double the load on a model that is already slow. If every
+    attempt in flight fails, the next untried model is called while time
+    remains.
+
+    The hedge delay is the primary's recent p95 times a factor that adapts
+    to how hedges turn out: a backup that wins shortens it, a hedge the
+    primary won anyway lengthens it, so backups fire about as often as
+    they pay off.
+    """
+
+    def __init__(self, name, models, hedge=True, initial_delay=3.0, min_delay=0.25,
+                 min_factor=0.5, max_factor=2.0):
+        if not models:
+            raise ValueError(f"Model tier '{name}' needs at least one model.")
+        self.name = name
+        self.models = models
+        self.hedge = hedge and len(models) > 1
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self._factor = 1.0
+        self._lock = threading.Lock()
+        self.stats = {model.name: ModelStats() for model in models}
+
+    def hedge_delay(self):
+        primary = self.models[0]
+        p95 = self.stats[primary.name].percentile(0.95)
+        delay = self.initial_delay if p95 is None else p95 * self._factor
+        return min(max(delay, self.min_delay), primary.timeout)
+
+    def _adapt(self, backup_won):
+        with self._lock:
+            if backup_won:
+                self._factor = max(self.min_factor, self._factor * 0.95)
+            else:
+                self._factor = min(self.max_factor, self._factor * 1.05)
+
+    def snapshot(self):
+        return {
+            "hedge_delay": round(self.hedge_delay(), 3),
+            "hedge_factor": round(self._factor, 3),
+            "models": {name: stats.snapshot() for name, stats in self.stats.items()},
+        }
+
+
+class ModelRouter:
+    """
+    Runs Gemini calls for a tier with hedging and failover. `request(model,
+    deadline, cancel)` performs one attempt and returns the parsed answer
+    or None; attempts run on a shared thread pool so the caller can stop
+    waiting on a slow one. The loser of a hedge is cancelled: its `cancel`
+    event is set (so it makes no further retries) and its answer is dropped.
+    call_async() is the same for the event loop (asgi.py), with attempts
+    as tasks.
+    """
+
+    def __init__(self, tiers, max_workers=64):
+        self.tiers = tiers
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._executor_lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='gemini-attempt')
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def tier(self, name):
+        return self.tiers.get(name) or self.tiers['generate']
+
+    def call(self, tier_name, request, validator=None, deadline=None):
+        """The first valid answer from the tier's models, or None."""
+        tier = self.tier(tier_name)
+        untried = list(tier.models)
+        pending = {}      # future -> (model, cancel event, role)
+        started = time.monotonic()
+        hedged = False
+
+        def launch(model, role):
+            remaining = time_remaining(deadline)
+            budget = model.timeout if remaining is None else min(model.timeout, remaining)
+            if budget <= 0:
+                return False
+            cancel = threading.Event()
+            attempt_deadline = time.monotonic() + budget
+            # Run in a copy of the caller's context so the attempt's log records keep the request ID
+            future = self._pool().submit(contextvars.copy_context().run, self._attempt, tier, model, request,
+                                         attempt_deadline, cancel)
+            pending[future] = (model, cancel, role)
+            return True
+
+        launch(untried.pop(0), 'primary')
+        while pending:
+            can_hedge = tier.hedge and not hedged and bool(untried)
+            timeout = time_remaining(deadline)
+            if can_hedge:
+                until_hedge = max(0.0, tier.hedge_delay() - (time.monotonic() - started))
+                timeout = until_hedge if timeout is None else min(timeout, until_hedge)
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                remaining = time_remaining(deadline)
+                if can_hedge and (remaining is None or remaining > 0):
+                    hedged = True
+                    if launch(untried.pop(0), 'hedge'):
+                        GEMINI_HEDGES.inc(tier=tier.name, outcome='fired')
+                    continue
+                break # Deadline reached
+
+            for future in done:
+                model, _, role = pending.pop(future)
+                result = future.result()
+                if result is not None and (validator is None or validator(result)):
+                    self._finish(tier, model, role, hedged)
+                    for _, cancel, _ in pending.values():
+                        cancel.set() # The loser stops retrying; its answer is ignored
+                    return result
+            if not pending and untried:
+                launch(untried.pop(0), 'failover') # Everything in flight failed; try the next model
+
+        for _, cancel, _ in pending.values():
+            cancel.set()
+        return None
+
+    async def call_async(self, tier_name, request, validator=None, deadline=None):
+        """
+        call() for coroutines: `request(model, deadline)` is awaited in a
+        task per attempt, and the loser of a hedge is cancelled as a task.
+        """
+        tier = self.tier(tier_name)
+        untried = list(tier.models)
+        pending = {}      # task -> (model, role)
+        started = time.monotonic()
+        hedged = False
+
+        def launch(model, role):
+            remaining = time_remaining(deadline)
+            budget = model.timeout if remaining is None else min(model.timeout, remaining)
+            if budget <= 0:
+                return False
+            task = asyncio.ensure_future(self._attempt_async(tier, model, request, time.monotonic() + budget))
+            pending[task] = (model, role)
+            return True
+
+        launch(untried.pop(0), 'primary')
+        try:
+            while pending:
+                can_hedge = tier.hedge and not hedged and bool(untried)
+                timeout = time_remaining(deadline)
+                if can_hedge:
+                    until_hedge = max(0.0, tier.hedge_delay() - (time.monotonic() - started))
+                    timeout = until_hedge if timeout is None else min(timeout, until_hedge)
+                done, _ = await asyncio.wait(list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    remaining = time_remaining(deadline)
+                    if can_hedge and (remaining is None or remaining > 0):
+                        hedged = True
+                        if launch(untried.pop(0), 'hedge'):
+                            GEMINI_HEDGES.inc(tier=tier.name, outcome='fired')
+                        continue
+                    break # Deadline reached
+
+                for task in done:
+                    model, role = pending.pop(task)
+                    result = task.result()
+                    if result is not None and (validator is None or validator(result)):
+                        self._finish(tier, model, role, hedged)
+                        return result
+                if not pending and untried:
+                    launch(untried.pop(0), 'failover') # Everything in flight failed; try the next model
+        finally:
+            for task in pending:
+                task.cancel()
+        return None
+
+    def _finish(self, tier, model, role, hedged):
+        tier.stats[model.name].record_win()
+        if hedged:
+            backup_won = role == 'hedge'
+            tier._adapt(backup_won)
+            GEMINI_HEDGES.inc(tier=tier.name, outcome='won' if backup_won else 'lost')
+
+    def _attempt(self, tier, model, request, deadline, cancel):
+        start = time.monotonic()
+        result = None
+        try:
+            result = request(model.name, deadline, cancel)
+        finally:
+            cancelled = cancel.is_set()
+            tier.stats[model.name].record(time.monotonic() - start, result is not None, cancelled)
+            outcome = 'cancelled' if cancelled else 'ok' if result is not None else 'error'
+            GEMINI_MODEL_CALLS.inc(tier=tier.name, model=model.name, outcome=outcome)
+        return result
+
+    async def _attempt_async(self, tier, model, request, deadline):
+        start = time.monotonic()
+        result = None
+        cancelled = False
+        try:
+            result = await asyncio.wait_for(request(model.name, deadline), time_remaining(deadline))
+        except asyncio.TimeoutError:
+            logger.error("Gemini call to %s exceeded its deadline.", model.name)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            tier.stats[model.name].record(time.monotonic() - start, result is not None, cancelled)
+            outcome = 'cancelled' if cancelled else 'ok' if result is not None else 'error'
+            GEMINI_MODEL_CALLS.inc(tier=tier.name, model=model.name, outcome=outcome)
+        return result
+
+    def stats(self):
+        return {name: tier.snapshot() for name, tier in self.tiers.items()}
+
+    @classmethod
+    def from_env(cls, default_model):
+        """
+        Reads the tiers from environment variables ('model[:timeout_seconds]', comma-separated, best first):
+          GEMINI_MODELS_GENERATE    - recipes (default: default_model)
+          GEMINI_MODELS_SUBSTITUTE  - substitutions, usually a cheaper/faster model (default: default_model)
+          GEMINI_HEDGE_ENABLED      - fire a backup call on the next model after the hedge delay
+                                      (default on; tiers with one model never hedge)
+          GEMINI_HEDGE_INITIAL_DELAY - seconds to wait before hedging until a p95 is known (default 3)
+          GEMINI_HEDGE_MIN_DELAY    - never hedge sooner than this (default 0.25)
+        """
+        hedge = os.getenv('GEMINI_HEDGE_ENABLED', '1').lower() in ['true', '1', 't', 'yes', 'on']
+        tier_options = dict(
+            hedge=hedge,
+            initial_delay=float(os.getenv('GEMINI_HEDGE_INITIAL_DELAY', '3')),
+            min_delay=float(os.getenv('GEMINI_HEDGE_MIN_DELAY', '0.25')),
+        )
+        tiers = {}
+        for name in ('generate', 'substitute'):
+            spec = os.getenv(f'GEMINI_MODELS_{name.upper()}') or default_model
+            tiers[name] = ModelTier(name, parse_models(spec), **tier_options)
+        return cls(tiers, max_workers=int(os.getenv('GEMINI_ATTEMPT_POOL_SIZE', '64')))
@@ -0,0 +1,175 @@
+# normalize.py
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# --- Synonym Table ---
+
+DEFAULT_SYNONYMS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'ingredient_synonyms.json')
+
+_synonyms = None # Loaded lazily on first use
+
+def load_synonyms(path=None):
+    """
+    Loads the alias -> canonical name table (e.g. "scallion" -> "green onion").
+    The path can be overridden with INGREDIENT_SYNONYMS_PATH. Keys are
+    normalized the same way as ingredients so the table can be written loosely.
+    """
+    global _synonyms
+    path = path or os.getenv('INGREDIENT_SYNONYMS_PATH', DEFAULT_SYNONYMS_PATH)
+    table = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            raw = json.load(f)
+        for alias, canonical in raw.items():
+            table[_singularize_phrase(_clean(alias))] = _clean(canonical)
+    except FileNotFoundError:
+        logger.warning("Ingredient synonym table not found at %s. Continuing without aliases.", path)
+    except (json.JSONDecodeError, AttributeError) as e:
+        logger.error("Error loading ingredient synonym table %s: %s", path, e)
+    _synonyms = table
+    return table
+
+def get_synonyms():
+    if _synonyms is None:
+        load_synonyms()
+    return _synonyms
+
+
+# --- Ingredient Normalization ---
+
+# Words that end in 's' but are already singular (or uncountable)
+_SINGULAR_EXCEPTIONS = {
+    "asparagus", "couscous", "hummus", "molasses", "swiss", "brussels", "grits",
+    "oats", "greens", "bass", "grass", "citrus", "octopus", "watercress", "jus", "series", "species",
+}
+# Irregular plurals
+_IRREGULAR_PLURALS = {
+    "leaves": "leaf",
+    "loaves": "loaf",
+    "halves": "half",
+    "knives": "knife",
+    "potatoes": "potato",
+    "tomatoes": "tomato",
+    "mangoes": "mango",
+    "heroes": "hero",
+    "geese": "goose",
+    "mice": "mouse",
+    "teeth": "tooth",
+    "anchovies": "anchovy",
+    "peas": "pea",
+    "lentils": "lentil",
+    "noodles": "noodle",
+    # -ies plurals of words ending in -ie or -i, not -y
+    "cookies": "cookie",
+    "pies": "pie",
+    "chilies": "chili",
+    "chillies": "chilli",
+    "calories": "calorie",
+    "brownies": "brownie",
+    "smoothies": "smoothie",
+    "veggies": "veggie",
+}
+
+def _clean(text):
+    """Lowercases, trims and collapses internal whitespace."""
+    return re.sub(r"\s+", " ", str(text).strip().lower())
+
+def singularize(word):
+    """Best-effort English singularization for a single ingredient word."""
+    if word in _IRREGULAR_PLURALS:
+        return _IRREGULAR_PLURALS[word]
+    if word in _SINGULAR_EXCEPTIONS or len(word) <= 3:
+        return word
+    if word.endswith("ies"):
+        # berries -> berry; a short stem is more likely a plain -s plural (ties -> tie)
+        return word[:-3] + "y" if len(word) - 3 >= 4 else word[:-1]
+    if word.endswith(("ches", "shes", "sses", "xes", "zes")):
+        return word[:-2]                # peaches -> peach, radishes -> radish
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]                # carrots -> carrot
+    return word
+
+def _singularize_phrase(phrase):
+    """Singularizes the head noun (last word) of a multi-word ingredient."""
+    if not phrase:
+        return phrase
+    words = phrase.split(" ")
+    words[-1] = singularize(words[-1])
+    return " ".join(words)
+
+def normalize_ingredient(name):
+    """
+    Returns the canonical form of one ingredient name, or '' if it is empty.
+    "  Scallions " -> "green onion", "Tomatoes" -> "tomato".
+    """
+    if not isinstance(name, str):
+        return ""
+    cleaned = _clean(name).strip(" .,;")
+    if not cleaned:
+        return ""
+    singular = _singularize_phrase(cleaned)
+    synonyms = get_synonyms()
+    return synonyms.get(singular) or synonyms.get(cleaned) or singular
+
+def normalize_ingredients(ingredients):
+    """Normalizes, dedupes and sorts a list of ingredient names."""
+    if not ingredients:
+        return []
+    normalized = {normalize_ingredient(i) for i in ingredients}
+    normalized.discard("")
+    return sorted(normalized)
+
+
+# --- Filters & Request Fingerprint ---
+
+def normalize_filters(filters):
+    """Lowercases keys/values, drops empty values and returns a key-sorted dict."""
+    if not isinstance(filters, dict):
+        return {}
+    cleaned = {}
+    for key, value in filters.items():
+        if not isinstance(key, str) or value is None or isinstance(value, (dict, list)):
+            continue
+        key = _clean(key)
+        value = _clean(value)
+        if key and value:
+            cleaned[key] = value
+    return dict(sorted(cleaned.items()))
+
+def normalize_description(description):
+    """Trims and collapses whitespace. Case is kept since it can carry meaning."""
+    if not isinstance(description, str):
+        return ""
+    return re.sub(r"\s+", " ", description).strip()
+
+NormalizedRequest = namedtuple('NormalizedRequest', ['ingredients', 'filters', 'description', 'fingerprint'])
+
+def request_fingerprint(ingredients, filters, description):
+    """Stable SHA-256 over already-normalized request fields."""
+    canonical = json.dumps(
+        {"ingredients": ingredients, "filters": filters, "description": description},
+        sort_keys=True, separators=(',', ':'), ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def normalize_request(ingredients, filters, description):
+    """
+    Normalization stage in front of prompt construction. Equivalent
+    /generate requests ("Chicken, rice" vs "rice, chicken ") produce the
+    same fields and fingerprint, so every downstream cache can dedupe them.
+    """
+    norm_ingredients = normalize_ingredients(ingredients)
+    norm_filters = normalize_filters(filters)
+    norm_description = normalize_description(description)
+    return NormalizedRequest(
+        ingredients=norm_ingredients,
+        filters=norm_filters,
+        description=norm_description,
+        fingerprint=request_fingerprint(norm_ingredients, norm_filters, norm_description),
+    )
@@ -0,0 +1,124 @@
+# passwords.py
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+from metrics import PASSWORD_HASH_DURATION
+
+logger = logging.getLogger(__name__)
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool is saturated or a hash did not finish in time."""
+
+
+# --- Parameters ---
+# PASSWORD_HASH_METHOD uses Werkzeug's method syntax, e.g. 'scrypt:32768:8:1'
+# or 'pbkdf2:sha256:600000'. Stored hashes carry the parameters they were
+# made with, so raising the cost only affects new hashes until each user's
+# next login rehashes theirs (see needs_rehash).
+
+def canonical_method(method):
+    """Expands a method to the full prefix Werkzeug stores ('scrypt' -> 'scrypt:32768:8:1')."""
+    name, *args = method.strip().split(':')
+    if name == 'scrypt':
+        n, r, p = (list(map(int, args)) + [2 ** 15, 8, 1][len(args):])[:3]
+        return f"scrypt:{n}:{r}:{p}"
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    raise ValueError(f"Unsupported password hash method '{method}'.")
+
+def configured_method():
+    return canonical_method(os.getenv('PASSWORD_HASH_METHOD', 'scrypt'))
+
+def needs_rehash(stored_hash, method=None):
+    """True if `stored_hash` was made with different parameters than the configured ones."""
+    return stored_hash.split('$', 1)[0] != (method or configured_method())
+
+
+# --- Worker Pool ---
+# scrypt/pbkdf2 are pure CPU; running them in separate processes keeps a
+# login burst from starving the request threads of this worker. The pool is
+# created lazily per process, so forked web workers never share one.
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_slots = None
+
+def _get_pool():
+    """
+    (pool, slots) for this process, or (None, None) to hash inline. The two
+    are returned together because a broken pool is replaced along with its
+    semaphore, and each caller must release the slot it acquired.
+    """
+    global _pool, _pool_pid, _slots
+    pool, slots = _pool, _slots
+    if pool is not None and _pool_pid == os.getpid():
+        return pool, slots
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            workers = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+            if workers <= 0:
+                return None, None # Hash inline on the request thread
+            # forkserver/spawn: forking a multi-threaded web worker is unsafe
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            _slots = threading.BoundedSemaphore(workers * int(os.getenv('PASSWORD_HASH_QUEUE_FACTOR', '4')))
+            _pool_pid = os.getpid()
+            logger.info("Password hashing pool started (%d processes).", workers)
+        return _pool, _slots
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None # Rebuilt on the next call
+    pool.shutdown(wait=False)
+
+def _run(operation, fn, *args):
+    """Runs fn(*args) in the pool (or inline when PASSWORD_HASH_WORKERS=0), timing it."""
+    with PASSWORD_HASH_DURATION.time(operation=operation):
+        pool, slots = _get_pool()
+        if pool is None:
+            return fn(*args)
+        if not slots.acquire(timeout=float(os.getenv('PASSWORD_HASH_QUEUE_WAIT', '1'))):
+            raise HasherBusy("Too many password hashes in progress.")
+        try:
+            return pool.submit(fn, *args).result(timeout=float(os.getenv('PASSWORD_HASH_TIMEOUT', '10')))
+        except FutureTimeout:
+            raise HasherBusy("Password hash timed out.")
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            logger.error("Password hashing pool died; hashing inline and restarting it on the next call.")
+            return fn(*args)
+        finally:
+            slots.release() # The semaphore acquired above, even if the pool was replaced since
+
+
+# --- API ---
+
+def hash_password(password, method=None):
+    """Hashes with the configured (or given) method. Raises HasherBusy when overloaded."""
+    return _run('hash', generate_password_hash, password, method or configured_method())
+
+def verify_password(stored_hash, password):
+    """Checks a password against its stored hash. Raises HasherBusy when overloaded."""
+    return _run('verify', check_password_hash, stored_hash, password)
+
+def rehash_if_needed(stored_hash, password):
+    """
+    After a successful verify: a new hash with the current parameters, or
+    None if the stored one is up to date.
+    """
+    method = configured_method()
+    if not needs_rehash(stored_hash, method):
+        return None
+    return _run('rehash', generate_password_hash, password, method)
@@ -0,0 +1,273 @@
+# rate_limit.py
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# allowed: bool; retry_after: seconds until the request would be allowed (0 when allowed)
+Decision = namedtuple('Decision', ['allowed', 'retry_after'])
+
+
+# --- Token Buckets ---
+# Implemented as GCRA: a bucket refilling `rate` tokens/second up to `burst`
+# is fully described by one "theoretical arrival time" (TAT) per key, so a
+# shared backend needs a single number per client and one round trip.
+
+def _gcra(tat, now, rate, burst, cost):
+    """Returns (allowed, new_tat, retry_after) for a bucket whose stored TAT is `tat` (or None)."""
+    interval = 1.0 / rate
+    new_tat = max(tat if tat is not None else now, now) + cost * interval
+    excess = new_tat - now - burst * interval
+    if excess > 0:
+        return False, tat, excess
+    return True, new_tat, 0.0
+
+
+class MemoryRateBackend:
+    """Buckets in this process only (limits are per worker)."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._tats = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost):
+        now = time.time()
+        with self._lock:
+            allowed, tat, retry_after = _gcra(self._tats.get(key), now, rate, burst, cost)
+            if allowed:
+                self._tats[key] = tat
+            if len(self._tats) > self.max_keys:
+                # Buckets whose TAT has passed are full again; forgetting them changes nothing
+                self._tats = {k: v for k, v in self._tats.items() if v > now}
+        return Decision(allowed, retry_after)
+
+
+class SQLiteRateBackend:
+    """Buckets in a SQLite file, so every worker process on the host enforces the same limit."""
+
+    def __init__(self, path, sweep_interval=60.0):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        self._local = threading.local()
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                bucket_key TEXT PRIMARY KEY,
+                tat REAL NOT NULL
+            );
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;") # Losing the last few updates in a crash is harmless
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, cost):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE;") # Serialize read-modify-write across processes
+        try:
+            row = conn.execute("SELECT tat FROM rate_limit_buckets WHERE bucket_key = ?;", (key,)).fetchone()
+            allowed, tat, retry_after = _gcra(row[0] if row else None, now, rate, burst, cost)
+            if allowed:
+                conn.execute("INSERT OR REPLACE INTO rate_limit_buckets (bucket_key, tat) VALUES (?, ?);", (key, tat))
+            if now >= self._next_sweep:
+                self._next_sweep = now + self.sweep_interval
+                conn.execute("DELETE FROM rate_limit_buckets WHERE tat <= ?;", (now,))
+            conn.execute("COMMIT;")
+        except Exception:
+            conn.execute("ROLLBACK;")
+            raise
+        return Decision(allowed, retry_after)
+
+
+class PostgresRateBackend:
+    """Buckets in Postgres (limits hold across hosts). One statement per allowed request."""
+
+    def __init__(self, get_conn, put_conn, sweep_interval=60.0):
+        self._get_conn = get_conn
+        self._put_conn = put_conn
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                bucket_key VARCHAR(255) PRIMARY KEY,
+                tat DOUBLE PRECISION NOT NULL
+            );
+        """)
+
+    def _execute(self, sql, params=(), fetch=False):
+        conn = self._get_conn()
+        if not conn:
+            raise RuntimeError("No DB connection available for rate limiting.")
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                result = cur.fetchone() if fetch else cur.rowcount
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._put_conn(conn)
+
+    def take(self, key, rate, burst, cost):
+        now = time.time()
+        interval = 1.0 / rate
+        # The upsert only happens when the bucket has room, so no row back means "denied"
+        row = self._execute(
+            "INSERT INTO rate_limit_buckets AS b (bucket_key, tat) VALUES (%(key)s, %(now)s + %(step)s) "
+            "ON CONFLICT (bucket_key) DO UPDATE SET tat = GREATEST(b.tat, %(now)s) + %(step)s "
+            "WHERE GREATEST(b.tat, %(now)s) + %(step)s - %(now)s <= %(limit)s "
+            "RETURNING tat;",
+            {"key": key, "now": now, "step": cost * interval, "limit": burst * interval}, fetch=True
+        )
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            self._execute("DELETE FROM rate_limit_buckets WHERE tat <= %s;", (now,))
+        if row is not None:
+            return Decision(True, 0.0)
+        current = self._execute("SELECT tat FROM rate_limit_buckets WHERE bucket_key = %s;", (key,), fetch=True)
+        _, _, retry_after = _gcra(current[0] if current else None, now, rate, burst, cost)
+        return Decision(False, max(retry_after, interval))
+
+
+class RateLimiter:
+    """
+    Per-client token buckets: `rate_per_minute` sustained, up to `burst`
+    at once. If the backend fails the request is allowed (fail open) so a
+    database hiccup never takes the LLM endpoints down with it.
+    """
+
+    def __init__(self, backend, rate_per_minute=30, burst=10):
+        self.backend = backend
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+
+    def take(self, key, cost=1):
+        try:
+            return self.backend.take(key, self.rate, self.burst, min(cost, self.burst))
+        except Exception as e:
+            logger.error("Rate limit check failed for %s (allowing): %s", key, e)
+            return Decision(True, 0.0)
+
+
+def build_rate_limiter(get_conn=None, put_conn=None):
+    """
+    Returns the request rate limiter configured from environment variables,
+    or None when RATE_LIMIT_ENABLED=0:
+      RATE_LIMIT_BACKEND      - 'sqlite' (default, shared by the host's workers), 'postgres' or 'memory'
+      RATE_LIMIT_SQLITE_PATH  - file used by the sqlite backend
+      RATE_LIMIT_PER_MINUTE   - sustained LLM requests per user/IP (default 30)
+      RATE_LIMIT_BURST        - requests allowed at once before throttling (default 10)
+    """
+    if os.getenv('RATE_LIMIT_ENABLED', '1').lower() not in ['true', '1', 't', 'yes', 'on']:
+        return None
+    backend_name = os.getenv('RATE_LIMIT_BACKEND', 'sqlite').lower()
+    backend = None
+    if backend_name == 'postgres' and get_conn and put_conn:
+        try:
+            backend = PostgresRateBackend(get_conn, put_conn)
+        except Exception as e:
+            logger.warning("Could not initialize Postgres rate limit backend: %s. Using SQLite.", e)
+    if backend is None and backend_name == 'memory':
+        backend = MemoryRateBackend()
+    if backend is None:
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rate_limits.sqlite3')
+        backend = SQLiteRateBackend(os.getenv('RATE_LIMIT_SQLITE_PATH', default_path))
+    return RateLimiter(
+        backend,
+        rate_per_minute=float(os.getenv('RATE_LIMIT_PER_MINUTE', '30')),
+        burst=float(os.getenv('RATE_LIMIT_BURST', '10')),
+    )
+
+
+# --- Outbound Concurrency ---
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Caps concurrent outbound Gemini calls in this process. The cap adapts
+    (AIMD): every successful, fast call raises it by 1/limit (about +1 per
+    `limit` calls); a failure, or a call slower than `latency_target`,
+    multiplies it by `backoff`. Callers that can't get a slot within their
+    wait time are turned away instead of piling up behind a struggling API.
+    """
+
+    def __init__(self, initial=16, min_limit=2, max_limit=64, latency_target=None, backoff=0.7):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self._limit = float(min(max(initial, min_limit), max_limit))
+        self._in_flight = 0
+        self._rejected = 0
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self, timeout=0.0):
+        """Takes a slot, waiting up to `timeout` seconds. Returns False if none freed up."""
+        deadline = time.monotonic() + max(0.0, timeout)
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._rejected += 1
+                    return False
+                self._cond.wait(remaining)
+            self._in_flight += 1
+            return True
+
+    def try_acquire(self):
+        """Takes a slot only if one is free right now; never waits, never counts a rejection."""
+        with self._cond:
+            if self._in_flight >= int(self._limit):
+                return False
+            self._in_flight += 1
+            return True
+
+    def release(self, ok=True, latency=None):
+        """Frees a slot and feeds the outcome into the limit (ok=None: call never happened)."""
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+            if ok is None:
+                return
+            slow = self.latency_target is not None and latency is not None and latency > self.latency_target
+            if not ok or slow:
+                self._limit = max(self.min_limit, self._limit * self.backoff)
+            else:
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+
+    def stats(self):
+        with self._cond:
+            return {"limit": int(self._limit), "in_flight": self._in_flight, "rejected": self._rejected}
+
+    @classmethod
+    def from_env(cls, prefix='GEMINI_CONCURRENCY'):
+        """Reads <prefix>_INITIAL, _MIN, _MAX and _LATENCY_TARGET (seconds; empty disables)."""
+        latency_target = os.getenv(f'{prefix}_LATENCY_TARGET', '10')
+        return cls(
+            initial=int(os.getenv(f'{prefix}_INITIAL', '16')),
+            min_limit=int(os.getenv(f'{prefix}_MIN', '2')),
+            max_limit=int(os.getenv(f'{prefix}_MAX', '64')),
+            latency_target=float(latency_target) if latency_target else None,
+        )
+
+
+def retry_after_header(seconds):
+    """Retry-After takes whole seconds; never advertise 0."""
+    return str(max(1, math.ceil(seconds)))
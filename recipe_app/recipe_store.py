@@ -0,0 +1,278 @@
+# recipe_store.py
+import base64
+import logging
+import math
+import os
+import queue
+import random
+import threading
+import time
+
+from psycopg2.extras import Json, execute_values
+
+from metrics import RECIPE_CORPUS_LOOKUPS, RECIPE_WRITES
+
+logger = logging.getLogger(__name__)
+
+# --- Schema ---
+# Run by init_db() after login_details. `ingredients` holds the normalized
+# ingredient list the recipe was generated for (see normalize.py), so
+# containment queries compare like with like.
+
+RECIPES_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS recipes (
+        recipe_id BIGSERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES login_details(user_id) ON DELETE CASCADE,
+        fingerprint CHAR(64) NOT NULL,
+        source VARCHAR(16) NOT NULL DEFAULT 'gemini',
+        title TEXT NOT NULL,
+        ingredients TEXT[] NOT NULL,
+        filters JSONB NOT NULL DEFAULT '{}',
+        recipe JSONB NOT NULL,
+        search_vector TSVECTOR NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    # Per-user history, newest first (keyset pagination on (created_at, recipe_id))
+    "CREATE INDEX IF NOT EXISTS recipes_user_history_idx ON recipes (user_id, created_at DESC, recipe_id DESC);",
+    # Full-text search over title (weight A) and steps (weight B)
+    "CREATE INDEX IF NOT EXISTS recipes_search_idx ON recipes USING GIN (search_vector);",
+    # "What can I make with X, Y, Z": ingredients <@ ARRAY[...] / && ARRAY[...]
+    "CREATE INDEX IF NOT EXISTS recipes_ingredients_idx ON recipes USING GIN (ingredients);",
+]
+
+def ensure_recipes_schema(cur):
+    """Creates the recipes table and its indexes (idempotent)."""
+    for statement in RECIPES_SCHEMA:
+        cur.execute(statement)
+
+
+# --- Pagination Cursors ---
+
+def encode_cursor(created_at, recipe_id):
+    """Opaque keyset cursor for the row a page ended on."""
+    raw = f"{created_at.isoformat()}|{recipe_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Returns (created_at ISO string, recipe_id). Raises ValueError on bad input."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        created_at, recipe_id = raw.rsplit('|', 1)
+        return created_at, int(recipe_id)
+    except (ValueError, UnicodeDecodeError, base64.binascii.Error) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+# --- Background Writer ---
+
+_INSERT_SQL = (
+    "INSERT INTO recipes (user_id, fingerprint, source, title, ingredients, filters, recipe, search_vector) "
+    "VALUES %s;"
+)
+_INSERT_TEMPLATE = (
+    "(%s, %s, %s, %s, %s::text[], %s, %s, "
+    "setweight(to_tsvector('english', %s), 'A') || setweight(to_tsvector('english', %s), 'B'))"
+)
+
+class RecipeWriter:
+    """
+    Persists generated recipes off the request path. submit() only enqueues;
+    a daemon thread drains the queue and inserts rows in batches. When the
+    queue is full (DB slow or down) new recipes are dropped, never blocking
+    a request. The thread is started lazily, so each forked worker gets its own.
+    """
+
+    def __init__(self, get_conn, put_conn, max_queue=1000, batch_size=50, flush_interval=0.5):
+        self._get_conn = get_conn
+        self._put_conn = put_conn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, user_id, normalized, recipe, source='gemini'):
+        """Queues one recipe for insertion. Returns False if it was dropped."""
+        row = (
+            user_id, normalized.fingerprint, source, recipe.get('title', ''),
+            list(normalized.ingredients), Json(normalized.filters), Json(recipe),
+            recipe.get('title', ''), ' '.join(str(step) for step in recipe.get('steps', [])),
+        )
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            RECIPE_WRITES.inc(result='dropped')
+            logger.warning("Recipe writer queue full; dropping recipe '%s'.", row[3])
+            return False
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self._queue.maxsize) # Don't replay the parent's backlog
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='recipe-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        conn = self._get_conn()
+        if not conn:
+            RECIPE_WRITES.inc(len(batch), result='error')
+            logger.error("No DB connection for the recipe writer; dropped %d recipes.", len(batch))
+            return
+        try:
+            with conn.cursor() as cur:
+                execute_values(cur, _INSERT_SQL, batch, template=_INSERT_TEMPLATE)
+            conn.commit()
+            RECIPE_WRITES.inc(len(batch), result='ok')
+        except Exception as e:
+            conn.rollback()
+            RECIPE_WRITES.inc(len(batch), result='error')
+            logger.error("Error writing %d recipes: %s", len(batch), e)
+        finally:
+            self._put_conn(conn)
+
+    def pending(self):
+        return self._queue.qsize()
+
+
+# --- Queries ---
+
+class RecipeCorpus:
+    """
+    Read side of the recipes table: per-user history, full-text search and
+    ingredient-containment lookups. After a DB error, corpus lookups on the
+    /generate path are skipped for `retry_after` seconds so a missing table
+    or slow database never adds latency to generation.
+    """
+
+    def __init__(self, get_conn, put_conn, min_coverage=0.75, retry_after=30.0):
+        self._get_conn = get_conn
+        self._put_conn = put_conn
+        self.min_coverage = min_coverage
+        self.retry_after = retry_after
+        self._skip_until = 0.0
+
+    def _query(self, sql, params):
+        conn = self._get_conn()
+        if not conn:
+            raise RuntimeError("No DB connection available for the recipe corpus.")
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return cur.fetchall()
+        finally:
+            self._put_conn(conn) # Read-only; the pool rolls back the open transaction
+
+    def history(self, user_id, limit=20, cursor=None):
+        """
+        One page of a user's recipes, newest first. Returns (items, next_cursor);
+        next_cursor is None on the last page. Raises ValueError for a bad cursor.
+        """
+        params = [user_id]
+        keyset = ""
+        if cursor:
+            created_at, recipe_id = decode_cursor(cursor)
+            keyset = "AND (created_at, recipe_id) < (%s::timestamptz, %s)"
+            params += [created_at, recipe_id]
+        rows = self._query(
+            "SELECT recipe_id, recipe, source, created_at FROM recipes "
+            f"WHERE user_id = %s {keyset} ORDER BY created_at DESC, recipe_id DESC LIMIT %s;",
+            params + [limit + 1]
+        )
+        items = [{"id": r[0], "recipe": r[1], "source": r[2], "created_at": r[3].isoformat()} for r in rows[:limit]]
+        next_cursor = encode_cursor(rows[limit - 1][3], rows[limit - 1][0]) if len(rows) > limit else None
+        return items, next_cursor
+
+    def search(self, text, limit=20):
+        """Generated recipes matching a web-style query ("garlic -butter"), best first."""
+        rows = self._query(
+            "SELECT recipe_id, recipe, ts_rank(search_vector, query) AS rank "
+            "FROM recipes, websearch_to_tsquery('english', %s) query "
+            "WHERE search_vector @@ query AND source = 'gemini' "
+            "ORDER BY rank DESC, recipe_id DESC LIMIT %s;",
+            (text, limit)
+        )
+        return [{"id": r[0], "recipe": r[1], "rank": float(r[2])} for r in rows]
+
+    def with_ingredients(self, ingredients, limit=20, filters=None, min_count=1):
+        """
+        Generated recipes needing only `ingredients` (already normalized),
+        those using the most of them first. `filters`, if given, must match exactly.
+        """
+        filter_sql, params = "", [ingredients, ingredients, min_count]
+        if filters is not None:
+            filter_sql = "AND filters = %s::jsonb"
+            params.append(Json(filters))
+        rows = self._query(
+            "SELECT recipe_id, recipe, ingredients FROM recipes "
+            "WHERE ingredients <@ %s::text[] AND ingredients && %s::text[] "
+            f"AND cardinality(ingredients) >= %s AND source = 'gemini' {filter_sql} "
+            "ORDER BY cardinality(ingredients) DESC, recipe_id DESC LIMIT %s;",
+            params + [limit]
+        )
+        return [{"id": r[0], "recipe": r[1], "ingredients": r[2]} for r in rows]
+
+    def lookup(self, normalized):
+        """
+        A stored recipe that can answer a /generate request, or None.
+        Only plain ingredient requests qualify (free-text descriptions are
+        too specific to reuse); filters must match and the stored recipe
+        must cover at least `min_coverage` of the requested ingredients.
+        """
+        if normalized.description or not normalized.ingredients:
+            return None
+        if time.monotonic() < self._skip_until:
+            RECIPE_CORPUS_LOOKUPS.inc(result='skipped')
+            return None
+        min_count = max(1, math.ceil(self.min_coverage * len(normalized.ingredients)))
+        try:
+            matches = self.with_ingredients(normalized.ingredients, limit=5,
+                                            filters=normalized.filters, min_count=min_count)
+        except Exception as e:
+            self._skip_until = time.monotonic() + self.retry_after
+            RECIPE_CORPUS_LOOKUPS.inc(result='error')
+            logger.warning("Recipe corpus lookup failed (skipping for %ss): %s", self.retry_after, e)
+            return None
+        if not matches:
+            RECIPE_CORPUS_LOOKUPS.inc(result='miss')
+            return None
+        RECIPE_CORPUS_LOOKUPS.inc(result='hit')
+        return random.choice(matches)["recipe"] # Some variety between equally good matches
+
+
+def build_recipe_store(get_conn, put_conn):
+    """
+    Returns (writer, corpus) configured from environment variables:
+      RECIPE_WRITER_QUEUE_SIZE    - recipes buffered before new ones are dropped (default 1000)
+      RECIPE_WRITER_BATCH_SIZE    - rows per INSERT (default 50)
+      RECIPE_CORPUS_MIN_COVERAGE  - share of requested ingredients a stored recipe must use (default 0.75)
+    """
+    writer = RecipeWriter(
+        get_conn, put_conn,
+        max_queue=int(os.getenv('RECIPE_WRITER_QUEUE_SIZE', '1000')),
+        batch_size=int(os.getenv('RECIPE_WRITER_BATCH_SIZE', '50')),
+    )
+    corpus = RecipeCorpus(get_conn, put_conn, min_coverage=float(os.getenv('RECIPE_CORPUS_MIN_COVERAGE', '0.75')))
+    return writer, corpus
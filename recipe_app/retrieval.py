@@ -0,0 +1,437 @@
+# retrieval.py
+"""
+Nearest-recipe retrieval over an on-disk ingredient index.
+
+Each stored recipe is a row of normalized ingredient terms, kept as a
+CSR-style binary incidence matrix in append-only files:
+
+    vocab.txt      one term per line (line number = column)
+    indices.i4     int32 column ids, all rows back to back
+    row_ends.i8    int64 end offset of each row in indices.i4
+    filters.u8     uint64 hash of each row's normalized filters
+    offsets.i8     int64 start of each row's recipe in payloads.jsonl
+    payloads.jsonl the recipes themselves
+    meta.json      row/term/byte counts; written last, atomically
+
+Readers memory-map the arrays, so every worker on the host shares one copy
+through the page cache, and remap when meta.json changes. New recipes are
+appended by a background thread under a file lock (incremental build);
+`python -m retrieval rebuild` regenerates the index from the recipes table.
+
+    python -m retrieval stats
+    python -m retrieval query egg rice "green onion"
+    python -m retrieval rebuild
+"""
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import fcntl # POSIX: serializes appends across worker processes
+except ImportError:
+    fcntl = None
+
+from metrics import RETRIEVAL_LOOKUPS
+from normalize import normalize_ingredients
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INDEX_DIR = os.path.join(BASE_DIR, 'retrieval_index')
+
+_ARRAYS = {'indices': 'indices.i4', 'row_ends': 'row_ends.i8', 'filters': 'filters.u8', 'offsets': 'offsets.i8'}
+_DTYPES = {'indices': '<i4', 'row_ends': '<i8', 'filters': '<u8', 'offsets': '<i8'}
+_EMPTY_META = {"rows": 0, "nnz": 0, "terms": 0, "vocab_bytes": 0, "payload_bytes": 0}
+
+
+def filters_hash(filters):
+    """Stable 64-bit hash of already-normalized filters (rows only match identical filters)."""
+    canonical = json.dumps(filters or {}, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return int.from_bytes(hashlib.sha256(canonical.encode('utf-8')).digest()[:8], 'little')
+
+
+class RetrievalIndex:
+    """
+    Vectorized top-k search over the stored ingredient sets.
+
+    metric='jaccard' scores |A∩B| / |A∪B| on binary incidence;
+    metric='cosine' scores TF-IDF weighted cosine similarity (rare
+    ingredients count for more). Both are computed for every row at once
+    with numpy over the memory-mapped CSR arrays.
+    """
+
+    def __init__(self, path, metric='jaccard', threshold=0.8, reload_interval=1.0, max_queue=1000):
+        if np is None:
+            raise RuntimeError("numpy is required for the retrieval index.")
+        self.path = path
+        self.metric = metric
+        self.threshold = threshold
+        self.reload_interval = reload_interval
+        os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._state = None      # Snapshot of the mapped arrays; swapped as a whole on reload
+        self._stamp = None      # (inode, mtime) of the meta.json the snapshot came from
+        self._checked_at = 0.0
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pid = None
+
+    # --- Reading ---
+
+    def _meta_path(self):
+        return os.path.join(self.path, 'meta.json')
+
+    def _read_meta(self):
+        try:
+            with open(self._meta_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return dict(_EMPTY_META)
+
+    def _map(self, name, count):
+        if count == 0:
+            return np.zeros(0, dtype=_DTYPES[name])
+        return np.memmap(os.path.join(self.path, _ARRAYS[name]), dtype=_DTYPES[name], mode='r', shape=(count,))
+
+    def _load(self):
+        """Maps the files described by the current meta.json into a new snapshot."""
+        meta = self._read_meta()
+        rows, nnz, terms = meta["rows"], meta["nnz"], meta["terms"]
+        vocab = {}
+        if terms:
+            with open(os.path.join(self.path, 'vocab.txt'), encoding='utf-8') as f:
+                for column, line in zip(range(terms), f):
+                    vocab[line.rstrip('\n')] = column
+        indices = self._map('indices', nnz)
+        row_ends = self._map('row_ends', rows)
+        state = {
+            "meta": meta,
+            "vocab": vocab,
+            "indices": indices,
+            "row_ends": row_ends,
+            "row_starts": np.concatenate(([0], row_ends[:-1])) if rows else np.zeros(0, dtype='<i8'),
+            "row_lengths": np.diff(row_ends, prepend=0) if rows else np.zeros(0, dtype='<i8'),
+            "filters": self._map('filters', rows),
+            "offsets": self._map('offsets', rows),
+        }
+        # IDF weights (cosine only): log((1 + N) / (1 + df)) + 1
+        if self.metric == 'cosine' and rows:
+            df = np.bincount(indices, minlength=terms)
+            state["idf"] = np.log((1.0 + rows) / (1.0 + df)) + 1.0
+            weights = state["idf"][indices] ** 2
+            state["row_norms"] = np.sqrt(np.add.reduceat(weights, state["row_starts"]))
+        return state
+
+    def _snapshot(self):
+        """Current snapshot, remapped if another process appended since the last check."""
+        now = time.monotonic()
+        if self._state is not None and now - self._checked_at < self.reload_interval:
+            return self._state
+        with self._lock:
+            if self._state is None or now - self._checked_at >= self.reload_interval:
+                try:
+                    stat = os.stat(self._meta_path())
+                    stamp = (stat.st_ino, stat.st_mtime_ns)
+                except FileNotFoundError:
+                    stamp = None
+                if self._state is None or stamp != self._stamp:
+                    self._state = self._load()
+                    self._stamp = stamp
+                self._checked_at = now
+        return self._state
+
+    def query(self, ingredients, filters=None, k=5):
+        """
+        Top-k rows for already-normalized ingredients as [(score, row)], best
+        first. With `filters` given, only rows built from identical filters score.
+        """
+        state = self._snapshot()
+        vocab, rows = state["vocab"], state["meta"]["rows"]
+        columns = np.array(sorted({vocab[t] for t in ingredients if t in vocab}), dtype='<i4')
+        if rows == 0 or len(columns) == 0:
+            return []
+
+        wanted = np.zeros(len(vocab), dtype=bool)
+        wanted[columns] = True
+        hits = wanted[state["indices"]] # One gather over all rows; faster than np.isin
+        if self.metric == 'cosine':
+            idf = state["idf"]
+            unknown_weight = math.log(1.0 + rows) + 1.0 # Terms never seen get the maximum IDF
+            query_norm = math.sqrt(float(np.sum(idf[columns] ** 2)) + (len(ingredients) - len(columns)) * unknown_weight ** 2)
+            dots = np.add.reduceat(np.where(hits, idf[state["indices"]] ** 2, 0.0), state["row_starts"])
+            scores = dots / (state["row_norms"] * query_norm)
+        else:
+            intersection = np.add.reduceat(hits, state["row_starts"], dtype=np.int64)
+            scores = intersection / (state["row_lengths"] + len(ingredients) - intersection)
+
+        if filters is not None:
+            scores = np.where(state["filters"] == np.uint64(filters_hash(filters)), scores, 0.0)
+        k = min(k, rows)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(float(scores[row]), int(row)) for row in top if scores[row] > 0]
+
+    def recipe(self, row):
+        """The stored recipe for a row returned by query()."""
+        state = self._snapshot()
+        start = int(state["offsets"][row])
+        end = int(state["offsets"][row + 1]) if row + 1 < state["meta"]["rows"] else state["meta"]["payload_bytes"]
+        with open(os.path.join(self.path, 'payloads.jsonl'), 'rb') as f:
+            f.seek(start)
+            return json.loads(f.read(end - start))
+
+    def lookup(self, normalized, k=5):
+        """
+        A stored recipe similar enough (score >= threshold) to answer a
+        /generate request, or None. Like the corpus lookup, only plain
+        ingredient requests qualify and filters must match.
+        """
+        if normalized.description or not normalized.ingredients:
+            return None
+        matches = [row for score, row in self.query(normalized.ingredients, normalized.filters, k)
+                   if score >= self.threshold]
+        if not matches:
+            RETRIEVAL_LOOKUPS.inc(result='miss')
+            return None
+        RETRIEVAL_LOOKUPS.inc(result='hit')
+        return self.recipe(random.choice(matches)) # Some variety between equally good matches
+
+    def stats(self):
+        state = self._snapshot()
+        return {"rows": state["meta"]["rows"], "terms": state["meta"]["terms"], "nnz": state["meta"]["nnz"],
+                "metric": self.metric, "threshold": self.threshold, "pending": self._queue.qsize()}
+
+    # --- Incremental Appends ---
+
+    def submit(self, normalized, recipe):
+        """Queues a recipe for the background appender. Returns False if it was dropped."""
+        if not normalized.ingredients:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((list(normalized.ingredients), normalized.filters, recipe))
+            return True
+        except queue.Full:
+            logger.warning("Retrieval index queue full; dropping recipe.")
+            return False
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self._queue.maxsize) # Don't replay the parent's backlog
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='retrieval-appender', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.append(batch)
+            except Exception as e:
+                logger.error("Error appending %d recipes to the retrieval index: %s", len(batch), e)
+
+    def append(self, items):
+        """
+        Appends [(normalized ingredients, normalized filters, recipe)] to the
+        files, then publishes them by rewriting meta.json. A crash part-way
+        leaves bytes past the old meta counts, which the next append truncates.
+        """
+        items = [item for item in items if item[0]]
+        if not items:
+            return 0
+        with _FileLock(os.path.join(self.path, '.lock')):
+            meta = self._read_meta()
+            self._truncate_to(meta)
+
+            vocab = {}
+            if meta["terms"]:
+                with open(os.path.join(self.path, 'vocab.txt'), encoding='utf-8') as f:
+                    for column, line in zip(range(meta["terms"]), f):
+                        vocab[line.rstrip('\n')] = column
+
+            new_terms, indices, row_ends, filter_hashes, offsets, payloads = [], [], [], [], [], []
+            nnz, payload_bytes = meta["nnz"], meta["payload_bytes"]
+            for ingredients, filters, recipe in items:
+                for term in sorted(set(ingredients)):
+                    column = vocab.get(term)
+                    if column is None:
+                        column = vocab[term] = meta["terms"] + len(new_terms)
+                        new_terms.append(term)
+                    indices.append(column)
+                    nnz += 1
+                row_ends.append(nnz)
+                filter_hashes.append(filters_hash(filters))
+                payload = json.dumps(recipe, ensure_ascii=False).encode('utf-8') + b'\n'
+                offsets.append(payload_bytes)
+                payloads.append(payload)
+                payload_bytes += len(payload)
+
+            vocab_blob = ''.join(term.replace('\n', ' ') + '\n' for term in new_terms).encode('utf-8')
+            self._append_bytes('vocab.txt', vocab_blob)
+            self._append_bytes(_ARRAYS['indices'], np.asarray(indices, dtype=_DTYPES['indices']).tobytes())
+            self._append_bytes(_ARRAYS['row_ends'], np.asarray(row_ends, dtype=_DTYPES['row_ends']).tobytes())
+            self._append_bytes(_ARRAYS['filters'], np.asarray(filter_hashes, dtype=_DTYPES['filters']).tobytes())
+            self._append_bytes(_ARRAYS['offsets'], np.asarray(offsets, dtype=_DTYPES['offsets']).tobytes())
+            self._append_bytes('payloads.jsonl', b''.join(payloads))
+
+            meta.update({
+                "rows": meta["rows"] + len(items), "nnz": nnz, "terms": meta["terms"] + len(new_terms),
+                "vocab_bytes": meta["vocab_bytes"] + len(vocab_blob), "payload_bytes": payload_bytes,
+            })
+            self._write_meta(meta)
+        return len(items)
+
+    def _append_bytes(self, name, data):
+        with open(os.path.join(self.path, name), 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _truncate_to(self, meta):
+        sizes = {
+            'vocab.txt': meta["vocab_bytes"], 'payloads.jsonl': meta["payload_bytes"],
+            _ARRAYS['indices']: meta["nnz"] * 4, _ARRAYS['row_ends']: meta["rows"] * 8,
+            _ARRAYS['filters']: meta["rows"] * 8, _ARRAYS['offsets']: meta["rows"] * 8,
+        }
+        for name, size in sizes.items():
+            file_path = os.path.join(self.path, name)
+            if os.path.exists(file_path) and os.path.getsize(file_path) != size:
+                logger.warning("Truncating %s to %d bytes (incomplete append).", name, size)
+                with open(file_path, 'r+b') as f:
+                    f.truncate(size)
+
+    def _write_meta(self, meta):
+        tmp_path = self._meta_path() + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path())
+
+
+class _FileLock:
+    """Exclusive lock on a file (cross-process where fcntl exists, else per-process)."""
+    _thread_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if fcntl is not None:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+        self._thread_lock.release()
+
+
+def build_retrieval_index():
+    """
+    Returns the index configured from environment variables, or None when
+    retrieval is off (RETRIEVAL_ENABLED=0) or numpy is not installed:
+      RETRIEVAL_INDEX_DIR  - directory holding the index files
+      RETRIEVAL_METRIC     - 'jaccard' (default) or 'cosine' (TF-IDF)
+      RETRIEVAL_THRESHOLD  - minimum similarity to serve a stored recipe (default 0.8)
+    """
+    if os.getenv('RETRIEVAL_ENABLED', '1').lower() not in ['true', '1', 't', 'yes', 'on']:
+        return None
+    if np is None:
+        logger.warning("numpy is not installed; nearest-recipe retrieval is disabled.")
+        return None
+    metric = os.getenv('RETRIEVAL_METRIC', 'jaccard').lower()
+    try:
+        return RetrievalIndex(
+            os.getenv('RETRIEVAL_INDEX_DIR', DEFAULT_INDEX_DIR),
+            metric='cosine' if metric == 'cosine' else 'jaccard',
+            threshold=float(os.getenv('RETRIEVAL_THRESHOLD', '0.8')),
+        )
+    except OSError as e:
+        logger.error("Could not open the retrieval index: %s", e)
+        return None
+
+
+# --- CLI ---
+
+def rebuild(path, batch_size=1000):
+    """Regenerates the index from the recipes table into a fresh directory, then swaps it in."""
+    from app import app, get_services # Imported here: only the CLI needs the app's DB settings
+    db_pool = get_services(app).db_pool
+
+    tmp_path = path.rstrip(os.sep) + '.building'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    fresh = RetrievalIndex(tmp_path)
+    total = 0
+    with db_pool.connection() as conn:
+        with conn.cursor(name='retrieval_rebuild') as cur: # Server-side cursor: streams rows
+            cur.itersize = batch_size
+            cur.execute("SELECT ingredients, filters, recipe FROM recipes WHERE source = 'gemini' ORDER BY recipe_id;")
+            batch = []
+            for ingredients, filters, recipe in cur:
+                batch.append((normalize_ingredients(ingredients), filters, recipe))
+                if len(batch) >= batch_size:
+                    total += fresh.append(batch)
+                    batch = []
+            total += fresh.append(batch)
+
+    old_path = path.rstrip(os.sep) + '.old'
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path) # Workers notice the new meta.json inode and remap
+    shutil.rmtree(old_path, ignore_errors=True)
+    return total
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    load_dotenv() # Same settings as the app (RETRIEVAL_INDEX_DIR, DB_*)
+
+    parser = argparse.ArgumentParser(description="Inspect or rebuild the nearest-recipe retrieval index.")
+    parser.add_argument('command', choices=['stats', 'query', 'rebuild'])
+    parser.add_argument('ingredients', nargs='*', help="Ingredients for 'query'")
+    parser.add_argument('--dir', default=os.getenv('RETRIEVAL_INDEX_DIR', DEFAULT_INDEX_DIR))
+    parser.add_argument('--metric', default=os.getenv('RETRIEVAL_METRIC', 'jaccard'), choices=['jaccard', 'cosine'])
+    parser.add_argument('-k', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.command == 'rebuild':
+        print(f"Indexed {rebuild(args.dir)} recipes into {args.dir}")
+        return
+    index = RetrievalIndex(args.dir, metric=args.metric)
+    if args.command == 'stats':
+        print(json.dumps(index.stats(), indent=2))
+    else:
+        for score, row in index.query(normalize_ingredients(args.ingredients), k=args.k):
+            print(f"{score:.3f}  {index.recipe(row).get('title', '?')}")
+
+
+if __name__ == '__main__':
+    main()
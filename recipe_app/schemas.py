@@ -0,0 +1,106 @@
+# schemas.py
+"""
+Response schemas for Gemini structured output, and validators compiled
+from them. The same schema is sent as `generationConfig.responseSchema`
+(so the model emits exactly these fields and nothing else) and checks
+the parsed answer, so the two can't drift apart.
+"""
+
+# --- Schemas (Gemini's OpenAPI subset) ---
+
+RECIPE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "title": {"type": "STRING"},
+        "description": {"type": "STRING", "nullable": True},
+        "ingredients": {"type": "ARRAY", "items": {"type": "STRING"}, "minItems": 1, "maxItems": 40},
+        "steps": {"type": "ARRAY", "items": {"type": "STRING"}, "minItems": 1, "maxItems": 30},
+        "prep_time": {"type": "STRING", "nullable": True},
+        "cook_time": {"type": "STRING", "nullable": True},
+    },
+    "required": ["title", "ingredients", "steps"],
+}
+
+SUBSTITUTION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "substitutes": {"type": "ARRAY", "items": {"type": "STRING"}, "maxItems": 3},
+    },
+    "required": ["substitutes"],
+}
+
+def multi_recipe_schema(count):
+    """{"recipes": [exactly `count` recipes]} for packed batch prompts."""
+    return {
+        "type": "OBJECT",
+        "properties": {
+            "recipes": {"type": "ARRAY", "items": RECIPE_SCHEMA, "minItems": count, "maxItems": count},
+        },
+        "required": ["recipes"],
+    }
+
+
+# --- Compiled Validators ---
+
+_TYPE_CHECKS = {
+    'OBJECT': lambda value: isinstance(value, dict),
+    'ARRAY': lambda value: isinstance(value, list),
+    'STRING': lambda value: isinstance(value, str),
+    'INTEGER': lambda value: isinstance(value, int) and not isinstance(value, bool),
+    'NUMBER': lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    'BOOLEAN': lambda value: isinstance(value, bool),
+}
+
+# Leaf types that are a plain isinstance check (booleans are ints, so INTEGER/NUMBER aren't)
+_PLAIN_TYPES = {'STRING': str, 'BOOLEAN': bool, 'OBJECT': dict, 'ARRAY': list}
+
+def _plain_type(schema):
+    """The Python type a schema reduces to when it has no constraints beyond its type, else None."""
+    if set(schema) - {'type', 'description'}:
+        return None
+    return _PLAIN_TYPES.get(schema['type'].upper())
+
+def compile_schema(schema):
+    """
+    Turns a schema into a predicate `check(value) -> bool`. The schema is
+    walked once here; checking a value is then a few isinstance calls per
+    field. Supports type, nullable, enum, properties, required, items,
+    minItems and maxItems. Extra object keys are allowed.
+    """
+    type_check = _TYPE_CHECKS[schema['type'].upper()]
+    nullable = schema.get('nullable', False)
+    enum = frozenset(schema['enum']) if 'enum' in schema else None
+    required = tuple(schema.get('required', ()))
+    properties = tuple((name, compile_schema(sub)) for name, sub in schema.get('properties', {}).items())
+    items = compile_schema(schema['items']) if 'items' in schema else None
+    item_type = _plain_type(schema['items']) if 'items' in schema else None
+    min_items = int(schema.get('minItems', 0))
+    max_items = int(schema['maxItems']) if 'maxItems' in schema else None
+
+    def check(value):
+        if value is None:
+            return nullable
+        if not type_check(value):
+            return False
+        if enum is not None and value not in enum:
+            return False
+        if properties or required:
+            for name in required:
+                if name not in value:
+                    return False
+            for name, check_property in properties:
+                if name in value and not check_property(value[name]):
+                    return False
+        if items is not None or min_items or max_items is not None:
+            if len(value) < min_items or (max_items is not None and len(value) > max_items):
+                return False
+            if item_type is not None:
+                # e.g. a list of strings: no per-item function calls
+                for item in value:
+                    if not isinstance(item, item_type):
+                        return False
+            elif items is not None and not all(items(item) for item in value):
+                return False
+        return True
+
+    return check
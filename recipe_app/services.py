@@ -0,0 +1,186 @@
+# services.py
+import logging
+import os
+import threading
+
+from flask.sessions import SessionInterface
+
+from db import ConnectionPool, PoolError
+
+logger = logging.getLogger(__name__)
+
+
+class Services:
+    """
+    Per-process resources for one app built by create_app(): the DB pool,
+    the share/recipe/session stores, the rate limiter and the retrieval
+    index. Each is built on first use, so creating the app does no I/O.
+    After a fork the child starts with none of them (the parent's objects
+    are kept referenced but never used), so `gunicorn --preload` workers
+    never share Postgres sockets or SQLite handles with the master.
+    """
+
+    def __init__(self, config, job_handler=None):
+        self.config = config
+        self.job_handler = job_handler # handler(request, user_id) for the generation job queue
+        self._resources = {}
+        self._inherited = []
+        self._lock = threading.RLock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Closing (or garbage collecting) the parent's connections here would
+        # end its sessions on the server, so they are only set aside
+        self._inherited.append(self._resources)
+        self._resources = {}
+        self._lock = threading.RLock()
+
+    def _get(self, name, build):
+        try:
+            return self._resources[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._resources:
+                self._resources[name] = build()
+            return self._resources[name]
+
+    def peek(self, name):
+        """The resource if this process has built it, else None (for gauges and health checks)."""
+        return self._resources.get(name)
+
+    # --- Database ---
+
+    def _connect_db(self):
+        """Opens one raw Postgres connection (used by the pool)."""
+        import psycopg2
+        return psycopg2.connect(
+            dbname=self.config['DB_NAME'],
+            user=self.config['DB_USER'],
+            password=self.config['DB_PASSWORD'],
+            host=self.config['DB_HOST'],
+            port=self.config['DB_PORT'],
+            connect_timeout=self.config['DB_CONNECT_TIMEOUT'],
+            # Keepalives help detect connections dropped on idle networks
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=5
+        )
+
+    def _build_db_pool(self):
+        # Thread-safe pool: bounded checkout wait, validation/reconnect of stale
+        # connections and a max connection lifetime (see db.py)
+        pool = ConnectionPool(
+            self._connect_db,
+            minconn=self.config['DB_POOL_MIN'],
+            maxconn=self.config['DB_POOL_MAX'],
+            timeout=self.config['DB_POOL_TIMEOUT'],
+            max_lifetime=self.config['DB_POOL_MAX_LIFETIME'],
+            name='main',
+        )
+        logger.info("Database connection pool created in pid %d (open connections: %d).",
+                    os.getpid(), pool.stats()['total'])
+        return pool
+
+    @property
+    def db_pool(self):
+        return self._get('db_pool', self._build_db_pool)
+
+    def set_db_pool(self, pool):
+        """Replaces this process's pool (e.g. with the SQLite stand-in in bench/sqlite_db.py)."""
+        with self._lock:
+            self._resources['db_pool'] = pool
+
+    def get_db_conn(self):
+        """Gets a connection from the pool, or None if none is available in time."""
+        try:
+            return self.db_pool.getconn()
+        except PoolError as e:
+            logger.error("Error getting DB connection from pool: %s", e)
+            return None
+
+    def put_db_conn(self, conn):
+        """Returns a connection to the pool."""
+        self.db_pool.putconn(conn)
+
+    # --- Stores ---
+
+    @property
+    def share_store(self):
+        from share_store import build_share_store
+        return self._get('share_store', lambda: build_share_store(self.get_db_conn, self.put_db_conn))
+
+    @property
+    def recipe_writer(self):
+        return self._recipe_store()[0]
+
+    @property
+    def recipe_corpus(self):
+        return self._recipe_store()[1]
+
+    def _recipe_store(self):
+        from recipe_store import build_recipe_store
+        return self._get('recipe_store', lambda: build_recipe_store(self.get_db_conn, self.put_db_conn))
+
+    @property
+    def retrieval_index(self):
+        """None when retrieval is disabled; numpy is only imported if it isn't."""
+        def build():
+            from retrieval import build_retrieval_index
+            return build_retrieval_index()
+        return self._get('retrieval_index', build)
+
+    @property
+    def rate_limiter(self):
+        """None when RATE_LIMIT_ENABLED=0."""
+        from rate_limit import build_rate_limiter
+        return self._get('rate_limiter', lambda: build_rate_limiter(self.get_db_conn, self.put_db_conn))
+
+    @property
+    def job_queue(self):
+        from jobs import build_job_queue
+        return self._get('job_queue', lambda: build_job_queue(self.job_handler, self.get_db_conn, self.put_db_conn))
+
+    @property
+    def shopping_lists(self):
+        from shopping_list import build_shopping_list_store
+        return self._get('shopping_lists', lambda: build_shopping_list_store(self.get_db_conn, self.put_db_conn))
+
+    @property
+    def session_interface(self):
+        from session_store import build_session_interface
+        return self._get('session_interface', lambda: build_session_interface(
+            self.get_db_conn, self.put_db_conn, backend_name=self.config['SESSION_BACKEND']))
+
+    @property
+    def page_cache(self):
+        """Rendered pages whose HTML depends only on login state (see home() in app.py)."""
+        from cache import LRUCache
+        return self._get('page_cache', lambda: LRUCache(max_entries=32, ttl=self.config['PAGE_CACHE_TTL']))
+
+    @property
+    def warm_cache(self):
+        """The memory-mapped warm cache file (see warm_cache.py), or None when WARM_CACHE_ENABLED=0."""
+        from warm_cache import build_warm_cache
+        return self._get('warm_cache', build_warm_cache)
+
+    @property
+    def response_cache(self):
+        from cache import build_response_cache
+        return self._get('response_cache', lambda: build_response_cache(
+            self.get_db_conn, self.put_db_conn, backend=self.config['GEMINI_CACHE_BACKEND']))
+
+
+class DeferredSessionInterface(SessionInterface):
+    """Hands sessions to the server-side interface in Services, which is built on the first request."""
+
+    def __init__(self, services):
+        self.services = services
+
+    def open_session(self, app, request):
+        return self.services.session_interface.open_session(app, request)
+
+    def save_session(self, app, session, response):
+        return self.services.session_interface.save_session(app, session, response)
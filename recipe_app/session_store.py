@@ -0,0 +1,357 @@
+# session_store.py
+import hashlib
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+
+from cache import LRUCache
+from metrics import SESSION_LOADS
+
+logger = logging.getLogger(__name__)
+
+_serializer = TaggedJSONSerializer() # Same encoding as Flask's cookie sessions (tuples, bytes, datetimes...)
+
+
+def _hash_sid(sid):
+    """Rows are keyed by a hash of the cookie value, so a leaked table can't be replayed as cookies."""
+    return hashlib.sha256(sid.encode('utf-8')).hexdigest()
+
+
+# --- Backends ---
+# get(sid_hash) -> (payload, expires_at) or None; set(); delete(); sweep(limit) -> rows removed
+
+class SQLiteSessionBackend:
+    """Sessions in a SQLite file shared by every worker on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS user_sessions (
+                sid_hash TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+        """)
+        self._conn().execute("CREATE INDEX IF NOT EXISTS user_sessions_expires_idx ON user_sessions (expires_at);")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid_hash):
+        return self._conn().execute(
+            "SELECT data, expires_at FROM user_sessions WHERE sid_hash = ? AND expires_at > ?;", (sid_hash, time.time())
+        ).fetchone()
+
+    def set(self, sid_hash, payload, expires_at):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO user_sessions (sid_hash, data, expires_at) VALUES (?, ?, ?);",
+            (sid_hash, payload, expires_at)
+        )
+
+    def delete(self, sid_hash):
+        self._conn().execute("DELETE FROM user_sessions WHERE sid_hash = ?;", (sid_hash,))
+
+    def sweep(self, limit):
+        return self._conn().execute(
+            "DELETE FROM user_sessions WHERE sid_hash IN "
+            "(SELECT sid_hash FROM user_sessions WHERE expires_at <= ? LIMIT ?);", (time.time(), limit)
+        ).rowcount
+
+
+class PostgresSessionBackend:
+    """Sessions in Postgres, borrowing connections through the app's pool helpers."""
+
+    def __init__(self, get_conn, put_conn):
+        self._get_conn = get_conn
+        self._put_conn = put_conn
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS user_sessions (
+                sid_hash CHAR(64) PRIMARY KEY,
+                data TEXT NOT NULL,
+                expires_at DOUBLE PRECISION NOT NULL
+            );
+        """)
+        self._execute("CREATE INDEX IF NOT EXISTS user_sessions_expires_idx ON user_sessions (expires_at);")
+
+    def _execute(self, sql, params=(), fetch=False):
+        conn = self._get_conn()
+        if not conn:
+            raise RuntimeError("No DB connection available for the session store.")
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                result = cur.fetchone() if fetch else cur.rowcount
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._put_conn(conn)
+
+    def get(self, sid_hash):
+        return self._execute(
+            "SELECT data, expires_at FROM user_sessions WHERE sid_hash = %s AND expires_at > %s;",
+            (sid_hash, time.time()), fetch=True
+        )
+
+    def set(self, sid_hash, payload, expires_at):
+        self._execute(
+            "INSERT INTO user_sessions (sid_hash, data, expires_at) VALUES (%s, %s, %s) "
+            "ON CONFLICT (sid_hash) DO UPDATE SET data = EXCLUDED.data, expires_at = EXCLUDED.expires_at;",
+            (sid_hash, payload, expires_at)
+        )
+
+    def delete(self, sid_hash):
+        self._execute("DELETE FROM user_sessions WHERE sid_hash = %s;", (sid_hash,))
+
+    def sweep(self, limit):
+        return self._execute(
+            "DELETE FROM user_sessions WHERE sid_hash IN "
+            "(SELECT sid_hash FROM user_sessions WHERE expires_at <= %s LIMIT %s);", (time.time(), limit)
+        )
+
+
+# --- Session Object ---
+
+class ServerSession(SessionMixin):
+    """
+    Session dict that is only fetched from the store on first access, so
+    requests that never read `session` cost no lookup and send no cookie.
+    """
+
+    def __init__(self, sid, loader):
+        self.sid = sid               # Cookie value, or None for a visitor without a session
+        self.expires_at = None
+        self.modified = False
+        self.accessed = False
+        self.rotate = False          # Set by clear(): save under a fresh ID (login/logout)
+        self._loader = loader
+        self._data = None
+
+    def _mapping(self):
+        self.accessed = True
+        if self._data is None:
+            record = self._loader(self.sid) if self.sid else None
+            if record is None:
+                self._data = {}
+                self.sid = None # Unknown, expired or revoked: start over with a new ID
+            else:
+                self._data, self.expires_at = record
+        return self._data
+
+    @property
+    def new(self):
+        return self.sid is None
+
+    def __getitem__(self, key):
+        return self._mapping()[key]
+
+    def __setitem__(self, key, value):
+        self._mapping()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self._mapping()[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self._mapping())
+
+    def __len__(self):
+        return len(self._mapping())
+
+    def clear(self):
+        self._mapping().clear()
+        self.modified = True
+        self.rotate = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """
+    Server-side sessions behind an opaque random ID cookie. Data lives in
+    a SQLite or Postgres backend with an in-process read-through cache.
+    session.clear() (login and logout both call it) deletes the stored
+    record and issues a new ID, so logging out really revokes the old cookie.
+    Other workers may serve a revoked session from their cache for up to
+    `cache_ttl` seconds.
+    """
+
+    def __init__(self, backend, ttl=86400, cache_size=4096, cache_ttl=30, sweep_interval=300, sweep_batch=1000):
+        self.backend = backend
+        self.ttl = ttl
+        self.cache = LRUCache(max_entries=cache_size, ttl=cache_ttl) if cache_ttl > 0 else None
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self._sweeper = None
+        self._sweeper_pid = None
+        self._sweeper_lock = threading.Lock()
+
+    # --- Loading ---
+
+    def open_session(self, app, request):
+        self._ensure_sweeper()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid is not None and not (20 <= len(sid) <= 64 and sid.replace('-', '').replace('_', '').isalnum()):
+            sid = None # Not one of ours (e.g. an old signed-cookie session)
+        return ServerSession(sid, self._load)
+
+    def _load(self, sid):
+        sid_hash = _hash_sid(sid)
+        record = self.cache.get(sid_hash) if self.cache is not None else None
+        if record is not None:
+            SESSION_LOADS.inc(source='cache')
+        else:
+            try:
+                record = self.backend.get(sid_hash)
+            except Exception as e:
+                logger.error("Error loading session: %s", e)
+                SESSION_LOADS.inc(source='error')
+                return None
+            if record is None:
+                SESSION_LOADS.inc(source='missing')
+                return None
+            record = (record[0], float(record[1]))
+            SESSION_LOADS.inc(source='backend')
+            if self.cache is not None:
+                self.cache.set(sid_hash, record)
+        payload, expires_at = record
+        if expires_at <= time.time():
+            return None
+        return _serializer.loads(payload), expires_at # Decoded per request: requests never share a dict
+
+    # --- Saving ---
+
+    def _lifetime(self, app, session):
+        return app.permanent_session_lifetime.total_seconds() if session.permanent else self.ttl
+
+    def save_session(self, app, session, response):
+        if not session.accessed:
+            return # Never loaded, so nothing to save (and no Vary: Cookie)
+        response.vary.add('Cookie')
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        old_sid = session.sid
+
+        if old_sid and (session.rotate or not session):
+            self._delete(old_sid)
+            session.sid = None
+        if not session:
+            if old_sid or session.modified:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = self._lifetime(app, session)
+        now = time.time()
+        # Slide the expiry, but only write an untouched session once half its lifetime is used
+        refresh = session.expires_at is None or session.expires_at - now < lifetime / 2
+        if not (session.sid is None or session.modified or refresh):
+            return
+
+        sid = session.sid or secrets.token_urlsafe(32)
+        payload = _serializer.dumps(dict(session))
+        expires_at = now + lifetime
+        sid_hash = _hash_sid(sid)
+        try:
+            self.backend.set(sid_hash, payload, expires_at)
+        except Exception as e:
+            logger.error("Error saving session: %s", e)
+            return
+        if self.cache is not None:
+            self.cache.set(sid_hash, (payload, expires_at))
+        response.set_cookie(
+            name, sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+    def _delete(self, sid):
+        sid_hash = _hash_sid(sid)
+        if self.cache is not None:
+            self.cache.delete(sid_hash)
+        try:
+            self.backend.delete(sid_hash)
+        except Exception as e:
+            logger.error("Error deleting session: %s", e)
+
+    # --- Expiry Sweeps ---
+
+    def _ensure_sweeper(self):
+        if self.sweep_interval <= 0 or (self._sweeper is not None and self._sweeper_pid == os.getpid()):
+            return
+        with self._sweeper_lock:
+            if self._sweeper is None or self._sweeper_pid != os.getpid():
+                self._sweeper_pid = os.getpid()
+                self._sweeper = threading.Thread(target=self._sweep_loop, name='session-sweeper', daemon=True)
+                self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            # Jittered so workers started together don't all sweep at once
+            time.sleep(self.sweep_interval * (0.5 + secrets.randbelow(1000) / 1000))
+            self.sweep()
+
+    def sweep(self):
+        """Deletes expired sessions in batches of `sweep_batch` rows. Returns the number removed."""
+        removed = 0
+        try:
+            while True:
+                count = self.backend.sweep(self.sweep_batch)
+                removed += max(count, 0)
+                if count < self.sweep_batch:
+                    break
+        except Exception as e:
+            logger.error("Error sweeping expired sessions: %s", e)
+        if removed:
+            logger.info("Removed %d expired sessions.", removed)
+        return removed
+
+
+def build_session_interface(get_conn=None, put_conn=None, backend_name=None):
+    """
+    Returns a ServerSessionInterface configured from environment variables,
+    or None for Flask's default signed-cookie sessions (SESSION_BACKEND=cookie):
+      SESSION_BACKEND         - 'sqlite' (default), 'postgres' or 'cookie'; `backend_name` overrides it
+      SESSION_SQLITE_PATH     - file used by the sqlite backend
+      SESSION_TTL             - idle lifetime (seconds) of non-permanent sessions (default 86400)
+      SESSION_CACHE_SIZE      - sessions cached per process (default 4096)
+      SESSION_CACHE_TTL       - seconds a cached session is trusted (default 30; 0 disables)
+      SESSION_SWEEP_INTERVAL  - seconds between expiry sweeps (default 300; 0 disables)
+    """
+    backend_name = (backend_name or os.getenv('SESSION_BACKEND', 'sqlite')).lower()
+    if backend_name == 'cookie':
+        return None
+    backend = None
+    if backend_name == 'postgres' and get_conn and put_conn:
+        try:
+            backend = PostgresSessionBackend(get_conn, put_conn)
+        except Exception as e:
+            logger.warning("Could not initialize Postgres session store: %s. Using SQLite.", e)
+    if backend is None:
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions.sqlite3')
+        backend = SQLiteSessionBackend(os.getenv('SESSION_SQLITE_PATH', default_path))
+    return ServerSessionInterface(
+        backend,
+        ttl=float(os.getenv('SESSION_TTL', '86400')),
+        cache_size=int(os.getenv('SESSION_CACHE_SIZE', '4096')),
+        cache_ttl=float(os.getenv('SESSION_CACHE_TTL', '30')),
+        sweep_interval=float(os.getenv('SESSION_SWEEP_INTERVAL', '300')),
+    )
@@ -0,0 +1,259 @@
+# share_store.py
+import base64
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+try:
+    import brotli # Optional: slightly smaller payloads than zlib when installed
+except ImportError:
+    brotli = None
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Only these fields are shared; anything else in the posted object is dropped
+SHARE_FIELDS = ('title', 'description', 'ingredients', 'steps', 'prep_time', 'cook_time')
+
+
+# --- Canonical Form, Hashing & Compression ---
+
+def canonicalize_recipe(recipe):
+    """
+    Returns the canonical JSON text for a recipe (known fields only, strings
+    trimmed, sorted keys, no whitespace) so identical recipes always hash
+    to the same ID. Raises ValueError if required fields are missing.
+    """
+    if not isinstance(recipe, dict):
+        raise ValueError("Recipe must be a JSON object.")
+    clean = {}
+    for field in SHARE_FIELDS:
+        value = recipe.get(field)
+        if isinstance(value, str) and value.strip():
+            clean[field] = value.strip()
+        elif isinstance(value, list):
+            items = [item.strip() for item in value if isinstance(item, str) and item.strip()]
+            if items:
+                clean[field] = items
+    if not isinstance(clean.get('title'), str) or not clean.get('ingredients') or not clean.get('steps'):
+        raise ValueError("Recipe needs a title, ingredients and steps.")
+    return json.dumps(clean, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+def content_hash(canonical):
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def short_id(digest_hex, length):
+    """URL-safe prefix of the base64 digest (10 chars = 60 bits by default)."""
+    encoded = base64.urlsafe_b64encode(bytes.fromhex(digest_hex)).decode('ascii').rstrip('=')
+    return encoded[:length]
+
+def compress(data, codec):
+    if codec == 'br':
+        return brotli.compress(data, quality=11)
+    return zlib.compress(data, 9)
+
+def decompress(blob, codec):
+    if codec == 'br':
+        if brotli is None:
+            raise ValueError("Share payload is brotli-compressed but the brotli module is not installed.")
+        return brotli.decompress(blob)
+    return zlib.decompress(blob)
+
+
+# --- Backends ---
+
+class SQLiteShareBackend:
+    """Shared recipes in a SQLite file (one connection per thread, WAL mode)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS shared_recipes (
+                share_id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                codec TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                created_at REAL NOT NULL
+            );
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            self._local.conn = conn
+        return conn
+
+    def get(self, share_id):
+        """Returns (content_hash, codec, payload) or None."""
+        row = self._conn().execute(
+            "SELECT content_hash, codec, payload FROM shared_recipes WHERE share_id = ?;", (share_id,)
+        ).fetchone()
+        return (row[0], row[1], bytes(row[2])) if row else None
+
+    def insert(self, share_id, digest, codec, payload):
+        """Inserts unless the ID exists. Returns True if a row was written."""
+        cur = self._conn().execute(
+            "INSERT OR IGNORE INTO shared_recipes (share_id, content_hash, codec, payload, created_at) "
+            "VALUES (?, ?, ?, ?, ?);",
+            (share_id, digest, codec, payload, time.time())
+        )
+        return cur.rowcount == 1
+
+
+class PostgresShareBackend:
+    """Shared recipes in Postgres, borrowing connections through the app's pool helpers."""
+
+    def __init__(self, get_conn, put_conn):
+        self._get_conn = get_conn
+        self._put_conn = put_conn
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS shared_recipes (
+                share_id VARCHAR(43) PRIMARY KEY,
+                content_hash CHAR(64) NOT NULL,
+                codec VARCHAR(8) NOT NULL,
+                payload BYTEA NOT NULL,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+    def _execute(self, sql, params=(), fetch=False):
+        conn = self._get_conn()
+        if not conn:
+            raise RuntimeError("No DB connection available for the share store.")
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                result = cur.fetchone() if fetch else cur.rowcount
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._put_conn(conn)
+
+    def get(self, share_id):
+        row = self._execute(
+            "SELECT content_hash, codec, payload FROM shared_recipes WHERE share_id = %s;", (share_id,), fetch=True
+        )
+        return (row[0], row[1], bytes(row[2])) if row else None
+
+    def insert(self, share_id, digest, codec, payload):
+        rowcount = self._execute(
+            "INSERT INTO shared_recipes (share_id, content_hash, codec, payload) VALUES (%s, %s, %s, %s) "
+            "ON CONFLICT (share_id) DO NOTHING;",
+            (share_id, digest, codec, payload)
+        )
+        return rowcount == 1
+
+
+# --- Store ---
+
+class ShareStore:
+    """
+    Content-addressed store for shared recipes. save() canonicalizes,
+    compresses and stores a recipe under a short prefix of its SHA-256
+    (the same recipe always gets the same ID, so re-sharing is free);
+    load() serves from an in-memory hot cache before touching the backend.
+    Shares are immutable, so cached entries never need invalidating.
+    """
+
+    def __init__(self, backend, codec='zlib', id_length=10, hot_cache_size=512):
+        if codec == 'br' and brotli is None:
+            logger.warning("SHARE_COMPRESSION=brotli but the brotli module is not installed; using zlib.")
+            codec = 'zlib'
+        self.backend = backend
+        self.codec = codec
+        self.id_length = id_length
+        self.hot = LRUCache(max_entries=hot_cache_size, ttl=0)
+        self._lock = threading.Lock()
+        self._counters = {"saves": 0, "dedup_hits": 0, "hot_hits": 0, "backend_hits": 0, "misses": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def save(self, recipe):
+        """Stores the recipe and returns its share ID. Raises ValueError for invalid recipes."""
+        canonical = canonicalize_recipe(recipe)
+        digest = content_hash(canonical)
+        payload = None
+        # Lengthen the ID on the (very unlikely) event of a prefix collision
+        for length in range(self.id_length, 44):
+            share_id = short_id(digest, length)
+            existing = self.backend.get(share_id)
+            if existing is not None:
+                if existing[0] == digest:
+                    self._count("dedup_hits")
+                    return share_id
+                continue
+            if payload is None:
+                payload = compress(canonical.encode('utf-8'), self.codec)
+            if self.backend.insert(share_id, digest, self.codec, payload):
+                self._count("saves")
+                self.hot.set(share_id, (json.loads(canonical), digest))
+                return share_id
+            # Lost a race for this ID; re-check it on the next pass
+            existing = self.backend.get(share_id)
+            if existing is not None and existing[0] == digest:
+                return share_id
+        raise ValueError("Could not allocate a share ID.")
+
+    def load(self, share_id):
+        """Returns (recipe dict, content hash) or None if the ID is unknown."""
+        cached = self.hot.get(share_id)
+        if cached is not None:
+            self._count("hot_hits")
+            return cached
+        row = self.backend.get(share_id)
+        if row is None:
+            self._count("misses")
+            return None
+        digest, codec, payload = row
+        entry = (json.loads(decompress(payload, codec).decode('utf-8')), digest)
+        self.hot.set(share_id, entry)
+        self._count("backend_hits")
+        return entry
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["hot_entries"] = len(self.hot)
+        return stats
+
+
+def build_share_store(get_conn=None, put_conn=None):
+    """
+    Builds the share store from environment variables:
+      SHARE_STORE_BACKEND      - 'sqlite' (default) or 'postgres'
+      SHARE_STORE_SQLITE_PATH  - file used by the sqlite backend
+      SHARE_COMPRESSION        - 'zlib' (default) or 'brotli'
+      SHARE_ID_LENGTH          - characters in a short ID (default 10)
+      SHARE_HOT_CACHE_SIZE     - recipes kept decoded in memory (default 512)
+    """
+    backend_name = os.getenv('SHARE_STORE_BACKEND', 'sqlite').lower()
+    backend = None
+    if backend_name == 'postgres' and get_conn and put_conn:
+        try:
+            backend = PostgresShareBackend(get_conn, put_conn)
+        except Exception as e:
+            logger.warning("Could not initialize Postgres share store: %s. Using SQLite.", e)
+    if backend is None:
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shared_recipes.sqlite3')
+        backend = SQLiteShareBackend(os.getenv('SHARE_STORE_SQLITE_PATH', default_path))
+    codec = 'br' if os.getenv('SHARE_COMPRESSION', 'zlib').lower() in ['br', 'brotli'] else 'zlib'
+    return ShareStore(
+        backend,
+        codec=codec,
+        id_length=int(os.getenv('SHARE_ID_LENGTH', '10')),
+        hot_cache_size=int(os.getenv('SHARE_HOT_CACHE_SIZE', '512')),
+    )
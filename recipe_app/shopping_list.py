@@ -0,0 +1,524 @@
+# shopping_list.py
+"""
+Server-side shopping lists for logged-in users (keyed on login_details.user_id).
+
+Every change bumps the list's version, and each item records the version
+that last touched it. A client syncs a whole edit session with one PATCH
+of ops made against the version it last saw (`base_version`). The reply
+holds everything that changed since that version, so it also picks up
+edits from other devices in the same round trip. Deleted items are kept
+as tombstones for a while so those deltas can report them.
+
+Merge rules when another device changed the list after base_version:
+  - updates only overwrite the fields they name, so edits to different
+    fields or items both survive
+  - add wins over delete: delete and clear skip items changed after base_version
+  - updates to items that have been deleted are dropped
+Skipped ops are returned as conflicts.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from categories import categorize, category_order
+from metrics import SHOPPING_LIST_SYNCS
+
+logger = logging.getLogger(__name__)
+
+OPS = ('add', 'update', 'delete', 'clear')
+MAX_ID_LENGTH = 64
+MAX_NAME_LENGTH = 200
+
+
+# --- Ops & Merge ---
+
+def _text(value, field):
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"'{field}' must be a non-empty string")
+    return ' '.join(value.split())[:MAX_NAME_LENGTH]
+
+def validate_op(op):
+    """Checks one PATCH op and returns it with only the known fields. Raises ValueError."""
+    if not isinstance(op, dict):
+        raise ValueError("Each op must be an object")
+    kind = op.get('op')
+    if kind not in OPS:
+        raise ValueError(f"Unknown op {kind!r}; expected one of {', '.join(OPS)}")
+    if kind == 'clear':
+        return {'op': kind, 'checked_only': bool(op.get('checked_only', False))}
+
+    item_id = op.get('id')
+    if not isinstance(item_id, str) or not item_id or len(item_id) > MAX_ID_LENGTH:
+        raise ValueError(f"'{kind}' needs an 'id' of 1-{MAX_ID_LENGTH} characters")
+    clean = {'op': kind, 'id': item_id}
+    if kind == 'delete':
+        return clean
+    if kind == 'add' or 'name' in op:
+        clean['name'] = _text(op.get('name'), 'name')
+    if 'checked' in op:
+        if not isinstance(op['checked'], bool):
+            raise ValueError("'checked' must be true or false")
+        clean['checked'] = op['checked']
+    if 'recipe' in op:
+        clean['recipe'] = _text(op['recipe'], 'recipe') if op['recipe'] is not None else None
+    if kind == 'update' and len(clean) == 2:
+        raise ValueError("'update' needs at least one of 'name', 'checked' or 'recipe'")
+    return clean
+
+def merge_ops(ops, existing, version, base_version, live_count, max_items):
+    """
+    Applies validated ops on top of `existing` ({id: item} for the items the
+    ops touch, tombstones included; every live item when there is a
+    'clear'). Returns (changed items, conflicts). Changed items carry
+    version + 1, and ops that change nothing are not counted.
+    """
+    new_version = version + 1
+    changed = {}
+    conflicts = []
+
+    def changed_elsewhere(item_id):
+        # Touched by another client after this one's base version (not by this PATCH)
+        item = existing.get(item_id)
+        return item is not None and item['version'] > base_version
+
+    def conflict(item_id, kind, reason):
+        conflicts.append({"id": item_id, "op": kind, "reason": reason})
+
+    for op in ops:
+        kind = op['op']
+        if kind == 'clear':
+            for item_id, item in list({**existing, **changed}.items()):
+                if item['deleted'] or (op['checked_only'] and not item['checked']):
+                    continue
+                if changed_elsewhere(item_id):
+                    conflict(item_id, kind, 'modified')
+                    continue
+                changed[item_id] = dict(item, deleted=True, version=new_version)
+                live_count -= 1
+            continue
+
+        item_id = op['id']
+        before = changed.get(item_id) or existing.get(item_id)
+        if kind == 'add' and (before is None or before['deleted']):
+            if before is not None and changed_elsewhere(item_id):
+                conflict(item_id, kind, 'deleted') # Another client removed it since
+                continue
+            if live_count >= max_items:
+                conflict(item_id, kind, 'full')
+                continue
+            item = {"id": item_id, "name": op['name'], "category": categorize(op['name']),
+                    "checked": op.get('checked', False), "recipe": op.get('recipe'), "deleted": False}
+            live_count += 1
+        elif kind == 'delete':
+            if before is None or before['deleted']:
+                continue
+            if changed_elsewhere(item_id):
+                conflict(item_id, kind, 'modified')
+                continue
+            item = dict(before, deleted=True)
+            live_count -= 1
+        else:
+            # update, or an add retried after it was applied
+            if before is None or before['deleted']:
+                conflict(item_id, kind, 'deleted')
+                continue
+            item = dict(before)
+            if 'name' in op and op['name'] != item['name']:
+                item['name'] = op['name']
+                item['category'] = categorize(op['name'])
+            for field in ('checked', 'recipe'):
+                if field in op:
+                    item[field] = op[field]
+            if all(item[field] == before[field] for field in ('name', 'checked', 'recipe')):
+                continue
+        item['version'] = new_version
+        changed[item_id] = item
+    return list(changed.values()), conflicts
+
+
+# --- Backends ---
+# Both backends store the same rows: one per list (its version, and the
+# highest version whose tombstones have been swept) and one per item.
+
+_ITEM_COLUMNS = "item_id, name, category, checked, recipe, version, deleted"
+
+def _item(row):
+    item_id, name, category, checked, recipe, version, deleted = row
+    return {"id": item_id, "name": name, "category": category, "checked": bool(checked),
+            "recipe": recipe, "version": version, "deleted": bool(deleted)}
+
+def _item_params(user_id, item, now):
+    return (user_id, item['id'], item['name'], item['category'], item['checked'], item['recipe'],
+            item['version'], item['deleted'], now)
+
+def _changes(rows):
+    """(version, pruned_version, items) from a lists LEFT JOIN items result."""
+    if not rows:
+        return 0, 0, []
+    return rows[0][0], rows[0][1], [_item(row[2:]) for row in rows if row[2] is not None]
+
+
+class SQLiteShoppingListBackend:
+    """Shopping lists in a SQLite file, shared by the host's worker processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS shopping_lists (
+                user_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0,
+                pruned_version INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            );
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS shopping_list_items (
+                user_id INTEGER NOT NULL,
+                item_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                category TEXT NOT NULL,
+                checked INTEGER NOT NULL DEFAULT 0,
+                recipe TEXT,
+                version INTEGER NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (user_id, item_id)
+            );
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS shopping_list_items_version_idx ON shopping_list_items (user_id, version);")
+        conn.execute("CREATE INDEX IF NOT EXISTS shopping_list_items_tombstone_idx ON shopping_list_items (updated_at) "
+                     "WHERE deleted = 1;")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, fn):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE;") # One writer per list at a time, across processes
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT;")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK;")
+            raise
+
+    def _changes(self, conn, user_id, since):
+        # One statement, so the version and the items come from the same snapshot
+        return _changes(conn.execute(
+            "SELECT l.version, l.pruned_version, i.item_id, i.name, i.category, i.checked, i.recipe, i.version, i.deleted "
+            "FROM shopping_lists l LEFT JOIN shopping_list_items i ON i.user_id = l.user_id "
+            "AND i.version > ? AND (i.deleted = 0 OR ?) WHERE l.user_id = ?;",
+            (since or 0, since is not None, user_id)
+        ).fetchall())
+
+    def version(self, user_id):
+        row = self._conn().execute("SELECT version FROM shopping_lists WHERE user_id = ?;", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def changes(self, user_id, since):
+        """(version, pruned_version, items): live items, or every item changed after `since` (tombstones included)."""
+        return self._changes(self._conn(), user_id, since)
+
+    def apply(self, user_id, ids, load_all, merge, since):
+        """Runs merge(version, existing, live_count) -> changed items under a lock, writes them, returns changes(since)."""
+        def apply(conn):
+            row = conn.execute("SELECT version FROM shopping_lists WHERE user_id = ?;", (user_id,)).fetchone()
+            version = row[0] if row else 0
+            rows = []
+            if ids:
+                rows += conn.execute(
+                    f"SELECT {_ITEM_COLUMNS} FROM shopping_list_items WHERE user_id = ? "
+                    f"AND item_id IN ({','.join('?' * len(ids))});", (user_id, *ids)
+                ).fetchall()
+            if load_all:
+                rows += conn.execute(
+                    f"SELECT {_ITEM_COLUMNS} FROM shopping_list_items WHERE user_id = ? AND deleted = 0;", (user_id,)
+                ).fetchall()
+            existing = {item['id']: item for item in map(_item, rows)}
+            live_count = conn.execute(
+                "SELECT COUNT(*) FROM shopping_list_items WHERE user_id = ? AND deleted = 0;", (user_id,)
+            ).fetchone()[0]
+
+            changed = merge(version, existing, live_count)
+            if changed:
+                now = time.time()
+                conn.executemany(
+                    "INSERT INTO shopping_list_items (user_id, item_id, name, category, checked, recipe, version, "
+                    "deleted, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (user_id, item_id) DO UPDATE SET name = excluded.name, category = excluded.category, "
+                    "checked = excluded.checked, recipe = excluded.recipe, version = excluded.version, "
+                    "deleted = excluded.deleted, updated_at = excluded.updated_at;",
+                    [_item_params(user_id, item, now) for item in changed]
+                )
+                conn.execute(
+                    "INSERT INTO shopping_lists (user_id, version, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (user_id) DO UPDATE SET version = excluded.version, updated_at = excluded.updated_at;",
+                    (user_id, version + 1, now)
+                )
+            return self._changes(conn, user_id, since)
+        return self._transaction(apply)
+
+    def sweep(self, before, limit):
+        """Forgets up to `limit` tombstones older than `before`, raising each list's pruned_version to match."""
+        def sweep(conn):
+            rows = conn.execute(
+                "SELECT user_id, item_id, version FROM shopping_list_items "
+                "WHERE deleted = 1 AND updated_at < ? LIMIT ?;", (before, limit)
+            ).fetchall()
+            pruned = {}
+            for user_id, _, version in rows:
+                pruned[user_id] = max(pruned.get(user_id, 0), version)
+            conn.executemany(
+                "UPDATE shopping_lists SET pruned_version = MAX(pruned_version, ?) WHERE user_id = ?;",
+                [(version, user_id) for user_id, version in pruned.items()]
+            )
+            conn.executemany("DELETE FROM shopping_list_items WHERE user_id = ? AND item_id = ?;",
+                             [(user_id, item_id) for user_id, item_id, _ in rows])
+            return len(rows)
+        return self._transaction(sweep)
+
+
+class PostgresShoppingListBackend:
+    """Shopping lists in Postgres, so every host sees the same lists."""
+
+    def __init__(self, get_conn, put_conn):
+        self._get_conn = get_conn
+        self._put_conn = put_conn
+        self._transaction(lambda cur: cur.execute("""
+            CREATE TABLE IF NOT EXISTS shopping_lists (
+                user_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0,
+                pruned_version INTEGER NOT NULL DEFAULT 0,
+                updated_at DOUBLE PRECISION NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS shopping_list_items (
+                user_id INTEGER NOT NULL,
+                item_id VARCHAR(64) NOT NULL,
+                name VARCHAR(200) NOT NULL,
+                category VARCHAR(64) NOT NULL,
+                checked BOOLEAN NOT NULL DEFAULT FALSE,
+                recipe VARCHAR(200),
+                version INTEGER NOT NULL,
+                deleted BOOLEAN NOT NULL DEFAULT FALSE,
+                updated_at DOUBLE PRECISION NOT NULL,
+                PRIMARY KEY (user_id, item_id)
+            );
+            CREATE INDEX IF NOT EXISTS shopping_list_items_version_idx ON shopping_list_items (user_id, version);
+            CREATE INDEX IF NOT EXISTS shopping_list_items_tombstone_idx ON shopping_list_items (updated_at)
+                WHERE deleted;
+        """))
+
+    def _transaction(self, fn):
+        conn = self._get_conn()
+        if not conn:
+            raise RuntimeError("No DB connection available for the shopping list store.")
+        try:
+            with conn.cursor() as cur:
+                result = fn(cur)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._put_conn(conn)
+
+    def _changes(self, cur, user_id, since):
+        cur.execute(
+            "SELECT l.version, l.pruned_version, i.item_id, i.name, i.category, i.checked, i.recipe, i.version, i.deleted "
+            "FROM shopping_lists l LEFT JOIN shopping_list_items i ON i.user_id = l.user_id "
+            "AND i.version > %s AND (NOT i.deleted OR %s) WHERE l.user_id = %s;",
+            (since or 0, since is not None, user_id)
+        )
+        return _changes(cur.fetchall())
+
+    def version(self, user_id):
+        def version(cur):
+            cur.execute("SELECT version FROM shopping_lists WHERE user_id = %s;", (user_id,))
+            row = cur.fetchone()
+            return row[0] if row else 0
+        return self._transaction(version)
+
+    def changes(self, user_id, since):
+        return self._transaction(lambda cur: self._changes(cur, user_id, since))
+
+    def apply(self, user_id, ids, load_all, merge, since):
+        def apply(cur):
+            now = time.time()
+            # Creating the row first means FOR UPDATE always has something to lock
+            cur.execute("INSERT INTO shopping_lists (user_id, updated_at) VALUES (%s, %s) "
+                        "ON CONFLICT (user_id) DO NOTHING;", (user_id, now))
+            cur.execute("SELECT version FROM shopping_lists WHERE user_id = %s FOR UPDATE;", (user_id,))
+            version = cur.fetchone()[0]
+            cur.execute(
+                f"SELECT {_ITEM_COLUMNS} FROM shopping_list_items WHERE user_id = %s "
+                "AND (item_id = ANY(%s) OR (%s AND NOT deleted));", (user_id, list(ids), load_all)
+            )
+            existing = {item['id']: item for item in map(_item, cur.fetchall())}
+            cur.execute("SELECT COUNT(*) FROM shopping_list_items WHERE user_id = %s AND NOT deleted;", (user_id,))
+            live_count = cur.fetchone()[0]
+
+            changed = merge(version, existing, live_count)
+            if changed:
+                cur.executemany(
+                    "INSERT INTO shopping_list_items (user_id, item_id, name, category, checked, recipe, version, "
+                    "deleted, updated_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) "
+                    "ON CONFLICT (user_id, item_id) DO UPDATE SET name = EXCLUDED.name, category = EXCLUDED.category, "
+                    "checked = EXCLUDED.checked, recipe = EXCLUDED.recipe, version = EXCLUDED.version, "
+                    "deleted = EXCLUDED.deleted, updated_at = EXCLUDED.updated_at;",
+                    [_item_params(user_id, item, now) for item in changed]
+                )
+                cur.execute("UPDATE shopping_lists SET version = %s, updated_at = %s WHERE user_id = %s;",
+                            (version + 1, now, user_id))
+            return self._changes(cur, user_id, since)
+        return self._transaction(apply)
+
+    def sweep(self, before, limit):
+        def sweep(cur):
+            cur.execute("""
+                WITH swept AS (
+                    DELETE FROM shopping_list_items WHERE (user_id, item_id) IN (
+                        SELECT user_id, item_id FROM shopping_list_items
+                        WHERE deleted AND updated_at < %s LIMIT %s
+                    ) RETURNING user_id, version
+                ), pruned AS (
+                    UPDATE shopping_lists l SET pruned_version = GREATEST(l.pruned_version, s.version)
+                    FROM (SELECT user_id, MAX(version) AS version FROM swept GROUP BY user_id) s
+                    WHERE l.user_id = s.user_id
+                )
+                SELECT COUNT(*) FROM swept;
+            """, (before, limit))
+            return cur.fetchone()[0]
+        return self._transaction(sweep)
+
+
+# --- Store ---
+
+class ShoppingListStore:
+    """
+    get() and patch() return list payloads:
+      full:  {"version": 7, "full": true, "items": [...], "categories": [aisle order]}
+      delta: {"version": 9, "full": false, "items": [changed items], "deleted": [ids], "categories": [...]}
+    Items are {"id", "name", "category", "checked", "recipe", "version"}.
+    A delta is only sent when the tombstones it needs haven't been swept.
+    """
+
+    def __init__(self, backend, max_items=500, max_ops=500, tombstone_ttl=30 * 86400, sweep_interval=3600):
+        self.backend = backend
+        self.max_items = max_items
+        self.max_ops = max_ops
+        self.tombstone_ttl = tombstone_ttl
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+
+    def version(self, user_id):
+        """The list's current version (0 for a list never written); a primary-key read."""
+        return self.backend.version(user_id)
+
+    def get(self, user_id, since=None):
+        return self._payload(user_id, since, self.backend.changes(user_id, since))
+
+    def patch(self, user_id, ops, base_version=None):
+        """
+        Applies a batch of ops in one transaction. Returns the payload of
+        changes since `base_version` (a full list without one) plus
+        "conflicts": [{"id", "op", "reason"}]. Raises ValueError for bad input.
+        """
+        if not isinstance(ops, list) or not ops:
+            raise ValueError("'ops' must be a non-empty list")
+        if len(ops) > self.max_ops:
+            raise ValueError(f"At most {self.max_ops} ops per request")
+        if base_version is not None and (not isinstance(base_version, int) or base_version < 0):
+            raise ValueError("'base_version' must be a non-negative integer")
+        ops = [validate_op(op) for op in ops]
+        ids = sorted({op['id'] for op in ops if 'id' in op})
+        load_all = any(op['op'] == 'clear' for op in ops)
+        conflicts = []
+        outcome = ['unchanged']
+
+        def merge(version, existing, live_count):
+            # Without a usable base version the client is treated as up to date
+            base = version if base_version is None or base_version > version else base_version
+            changed, merge_conflicts = merge_ops(ops, existing, version, base, live_count, self.max_items)
+            conflicts.extend(merge_conflicts)
+            outcome[0] = 'conflict' if merge_conflicts else ('applied' if changed else 'unchanged')
+            return changed
+
+        payload = self._payload(user_id, base_version, self.backend.apply(user_id, ids, load_all, merge, base_version))
+        payload['conflicts'] = conflicts
+        SHOPPING_LIST_SYNCS.inc(result=outcome[0])
+        self._maybe_sweep()
+        return payload
+
+    def _payload(self, user_id, since, changes):
+        version, pruned_version, items = changes
+        if since is not None and not pruned_version <= since <= version:
+            # Deletions before pruned_version are gone, or the client is ahead of us: send everything
+            since = None
+            version, pruned_version, items = self.backend.changes(user_id, None)
+        if since is None:
+            order = {category: n for n, category in enumerate(category_order())}
+            items.sort(key=lambda item: (order.get(item['category'], len(order)), item['name'].lower()))
+            return {"version": version, "full": True, "items": [_public(item) for item in items],
+                    "categories": category_order()}
+        return {
+            "version": version,
+            "full": False,
+            "items": [_public(item) for item in items if not item['deleted']],
+            "deleted": [item['id'] for item in items if item['deleted']],
+            "categories": category_order(),
+        }
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        try:
+            removed = self.backend.sweep(now - self.tombstone_ttl, 1000)
+        except Exception as e:
+            logger.warning("Could not sweep shopping list tombstones: %s", e)
+            return
+        if removed:
+            logger.info("Removed %d deleted shopping list items.", removed)
+
+def _public(item):
+    return {key: value for key, value in item.items() if key != 'deleted'}
+
+
+def build_shopping_list_store(get_conn=None, put_conn=None):
+    """
+    Builds the shopping list store from environment variables:
+      SHOPPING_LIST_BACKEND        - 'sqlite' (default) or 'postgres' (lists shared across hosts)
+      SHOPPING_LIST_SQLITE_PATH    - file used by the sqlite backend
+      SHOPPING_LIST_MAX_ITEMS      - items per list (default 500)
+      SHOPPING_LIST_MAX_OPS        - ops per PATCH (default 500)
+      SHOPPING_LIST_TOMBSTONE_TTL  - seconds deleted items are remembered for delta syncs (default 30 days)
+    """
+    backend_name = os.getenv('SHOPPING_LIST_BACKEND', 'sqlite').lower()
+    backend = None
+    if backend_name == 'postgres' and get_conn and put_conn:
+        try:
+            backend = PostgresShoppingListBackend(get_conn, put_conn)
+        except Exception as e:
+            logger.warning("Could not initialize Postgres shopping list store: %s. Using SQLite.", e)
+    if backend is None:
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shopping_lists.sqlite3')
+        backend = SQLiteShoppingListBackend(os.getenv('SHOPPING_LIST_SQLITE_PATH', default_path))
+    return ShoppingListStore(
+        backend,
+        max_items=int(os.getenv('SHOPPING_LIST_MAX_ITEMS', '500')),
+        max_ops=int(os.getenv('SHOPPING_LIST_MAX_OPS', '500')),
+        tombstone_ttl=float(os.getenv('SHOPPING_LIST_TOMBSTONE_TTL', str(30 * 86400))),
+    )
@@ -0,0 +1,81 @@
+# singleflight.py
+import threading
+
+class SingleFlightTimeout(Exception):
+    """Raised to a waiter whose bounded wait on an in-flight call expired."""
+
+
+class _Call:
+    """One in-flight call: the leader fills in result/error, waiters block on done."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls that share a key into one execution.
+    The first caller (the leader) runs the function; callers arriving while
+    it is in flight wait for and share its result, or re-raise its error.
+    Waiters can bound how long they wait so they can fall back instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {} # key -> _Call
+        self._counters = {"leaders": 0, "shared": 0, "timeouts": 0, "errors": 0}
+
+    def do(self, key, fn, timeout=None):
+        """
+        Runs fn() once per key at a time and returns its result.
+        Raises SingleFlightTimeout if this caller waited longer than timeout.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self._counters["leaders"] += 1
+                leader = True
+            else:
+                call.waiters += 1
+                leader = False
+
+        if not leader:
+            if not call.done.wait(timeout):
+                with self._lock:
+                    self._counters["timeouts"] += 1
+                raise SingleFlightTimeout(f"Timed out after {timeout}s waiting for in-flight call")
+            with self._lock:
+                self._counters["shared"] += 1
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self._counters["errors"] += 1
+            raise
+        finally:
+            # Forget the key before waking waiters so later callers start a fresh call
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        """Returns counters; 'shared' is the number of upstream calls saved."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = len(self._calls)
+        return stats
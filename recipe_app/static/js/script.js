@@ -27,7 +27,6 @@ document.addEventListener('DOMContentLoaded', function() {
     const shareFacebookLink = document.getElementById('share-facebook-link');
     const shareTwitterLink = document.getElementById('share-twitter-link');
     const shareWhatsappLink = document.getElementById('share-whatsapp-link'); // Added
-    const directShareBtn = document.getElementById('direct-share-btn'); // Added
     // Save Button Element
     const saveRecipeBtn = document.getElementById('save-recipe-btn'); // Added
 
@@ -91,17 +90,13 @@ document.addEventListener('DOMContentLoaded', function() {
             const payload = { ingredients, description, filters };
 
             try {
-                const response = await fetch('/generate', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json', 'Accept': 'application/json' },
-                    body: JSON.stringify(payload)
-                });
-                if (!response.ok) {
-                    let errorMsg = `HTTP error! Status: ${response.status}`;
-                    try { const errorData = await response.json(); errorMsg = errorData.error || `Server error ${response.status}`; } catch (e) {}
-                    throw new Error(errorMsg);
+                let data = null;
+                try {
+                    data = await generateRecipeStream(payload); // Progressive rendering over SSE
+                } catch (streamError) {
+                    console.warn("Streaming generation unavailable, falling back to /generate:", streamError);
                 }
-                const data = await response.json();
+                if (!data) data = await generateRecipeJson(payload);
                 if (typeof window.displayRecipe === 'function') {
                     window.displayRecipe(data);
                 } else {
@@ -118,6 +113,72 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    async function generateRecipeJson(payload) {
+        const response = await fetch('/generate', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Accept': 'application/json' },
+            body: JSON.stringify(payload)
+        });
+        if (!response.ok) {
+            let errorMsg = `HTTP error! Status: ${response.status}`;
+            try { const errorData = await response.json(); errorMsg = errorData.error || `Server error ${response.status}`; } catch (e) {}
+            throw new Error(errorMsg);
+        }
+        return response.json();
+    }
+
+    // Reads /generate/stream (Server-Sent Events) and renders fields as they arrive.
+    // Resolves with the final recipe object, or null if the stream ended without one.
+    async function generateRecipeStream(payload) {
+        const response = await fetch('/generate/stream', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+            body: JSON.stringify(payload)
+        });
+        if (!response.ok || !response.body) throw new Error(`Stream unavailable (status ${response.status})`);
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        const partial = { ingredients: [], steps: [] };
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const message = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let eventName = 'message', dataText = '';
+                message.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataText += line.slice(5).trim();
+                });
+                if (!dataText) continue;
+                const value = JSON.parse(dataText);
+                if (eventName === 'recipe') return value;
+                if (eventName === 'ingredient') partial.ingredients.push(value);
+                else if (eventName === 'step') partial.steps.push(value);
+                else partial[eventName] = value;
+                renderPartialRecipe(partial);
+            }
+        }
+        return null;
+    }
+
+    function renderPartialRecipe(partial) {
+        if (!recipeOutput) return;
+        let html = partial.title ? `<h3>${escapeHtml(partial.title)}</h3>` : '<p>Generating your recipe...</p>';
+        if (partial.description) html += `<p><em>${escapeHtml(partial.description)}</em></p>`;
+        if (partial.ingredients.length) {
+            html += '<h5>Ingredients:</h5><ul>' + partial.ingredients.map(i => `<li>${escapeHtml(String(i))}</li>`).join('') + '</ul>';
+        }
+        if (partial.steps.length) {
+            html += '<h5>Steps:</h5><ol>' + partial.steps.map(st => `<li>${escapeHtml(String(st))}</li>`).join('') + '</ol>';
+        }
+        recipeOutput.innerHTML = html;
+    }
+
     // --- Display Recipe Function ---
     window.displayRecipe = function(recipeData) {
         if (!recipeOutput || !recipeActions) {
@@ -169,16 +230,277 @@ document.addEventListener('DOMContentLoaded', function() {
 
 
     // --- Shopping List Logic ---
-    function loadShoppingList() { /* ... same implementation as before ... */ }
-    function saveShoppingList() { /* ... same implementation as before ... */ }
-    function categorizeIngredient(name) { /* ... same implementation as before ... */ }
-    function renderShoppingList() { /* ... same implementation as before ... */ }
-    function addShoppingListItem(itemName) { /* ... same implementation as before ... */ }
-    if (addToListBtn) { /* ... same listener as before ... */ }
-    if (manualAddBtn && manualAddItemInput) { /* ... same listener as before ... */ }
-    if (shoppingListItemsDiv) { /* ... same listener as before ... */ }
-    if (copyListBtn) { /* ... same listener as before ... */ }
-    if (clearListBtn) { /* ... same listener as before ... */ }
+    // Items are {id, name, category, checked, recipe}; aisles come from the server's category
+    // index. Logged-in users' lists live on the server: edits are applied locally, queued as ops
+    // and sent as one PATCH per burst of edits; the reply carries whatever other devices changed
+    // since our version. Logged-out users keep the list in localStorage only.
+    const SHOPPING_SYNC_KEY = 'recipeAppShoppingListSync'; // {version, pending} for the server copy
+    const SYNC_DELAY_MS = 800; // Edits made within this window go out in the same PATCH
+    const SYNC_RETRY_MS = 10000;
+    const syncEnabled = shoppingListSection?.dataset.sync === '1';
+    let listVersion = 0; // Server version our copy reflects
+    let pendingOps = []; // Local edits the server hasn't acknowledged
+    let categoryOrder = [];
+    let syncTimer = null;
+    let syncInFlight = false;
+
+    function newItemId() {
+        if (window.crypto && typeof window.crypto.randomUUID === 'function') return window.crypto.randomUUID();
+        return Date.now().toString(36) + Math.random().toString(36).slice(2, 10);
+    }
+
+    function loadShoppingList() {
+        try {
+            const stored = JSON.parse(localStorage.getItem(SHOPPING_LIST_KEY) || '[]');
+            // Older versions stored plain names or {name, checked}
+            shoppingList = Array.isArray(stored) ? stored.map(item => typeof item === 'string'
+                ? { id: newItemId(), name: item, category: null, checked: false, recipe: null }
+                : { id: item.id || newItemId(), name: String(item.name || ''), category: item.category || null,
+                    checked: !!item.checked, recipe: item.recipe || null }).filter(item => item.name) : [];
+            const sync = JSON.parse(localStorage.getItem(SHOPPING_SYNC_KEY) || 'null');
+            if (sync && syncEnabled) {
+                listVersion = sync.version || 0;
+                pendingOps = Array.isArray(sync.pending) ? sync.pending : [];
+            } else if (sync && !syncEnabled) {
+                // Logged out: that list belongs to the account, which keeps it on the server
+                shoppingList = [];
+                localStorage.removeItem(SHOPPING_SYNC_KEY);
+            }
+        } catch (e) {
+            console.error("Error loading shopping list:", e);
+            shoppingList = [];
+        }
+        if (syncEnabled && listVersion === 0 && pendingOps.length === 0) {
+            // First sync on this browser: the list kept while logged out joins the account's list
+            pendingOps = shoppingList.map(item => ({ op: 'add', id: item.id, name: item.name, checked: item.checked, recipe: item.recipe }));
+        }
+        saveShoppingList();
+        renderShoppingList();
+        if (syncEnabled) syncShoppingList();
+        else categorizeItems();
+    }
+
+    function saveShoppingList() {
+        try {
+            localStorage.setItem(SHOPPING_LIST_KEY, JSON.stringify(shoppingList));
+            if (syncEnabled) localStorage.setItem(SHOPPING_SYNC_KEY, JSON.stringify({ version: listVersion, pending: pendingOps }));
+        } catch (e) {
+            console.error("Error saving shopping list:", e);
+        }
+    }
+
+    // Applies one op to the local copy (the server applies the same op when it arrives)
+    function applyOpLocally(op) {
+        if (op.op === 'clear') {
+            shoppingList = shoppingList.filter(item => op.checked_only && !item.checked);
+            return;
+        }
+        const index = shoppingList.findIndex(item => item.id === op.id);
+        if (op.op === 'delete') {
+            if (index !== -1) shoppingList.splice(index, 1);
+        } else if (index === -1) {
+            if (op.op === 'add') shoppingList.push({ id: op.id, name: op.name, category: null, checked: !!op.checked, recipe: op.recipe || null });
+        } else {
+            const item = shoppingList[index];
+            if (op.name !== undefined && op.name !== item.name) { item.name = op.name; item.category = null; }
+            if (op.checked !== undefined) item.checked = op.checked;
+            if (op.recipe !== undefined) item.recipe = op.recipe;
+        }
+    }
+
+    function editShoppingList(ops) {
+        ops.forEach(applyOpLocally);
+        if (syncEnabled) pendingOps.push(...ops);
+        saveShoppingList();
+        renderShoppingList();
+        scheduleSync(SYNC_DELAY_MS);
+    }
+
+    function scheduleSync(delay) {
+        clearTimeout(syncTimer);
+        syncTimer = setTimeout(() => {
+            syncTimer = null;
+            if (syncEnabled) syncShoppingList(); else categorizeItems();
+        }, delay);
+    }
+
+    // Merges a /shopping-list payload (full list or delta), then replays edits the server hasn't seen yet
+    function applyServerList(data) {
+        if (data.full) {
+            shoppingList = data.items;
+        } else {
+            const removed = new Set(data.deleted || []);
+            const updates = new Map(data.items.map(item => [item.id, item]));
+            shoppingList = shoppingList.filter(item => !removed.has(item.id) && !updates.has(item.id)).concat(data.items);
+        }
+        if (data.categories) categoryOrder = data.categories;
+        listVersion = data.version;
+        pendingOps.forEach(applyOpLocally);
+        if (data.conflicts && data.conflicts.length) console.info("Shopping list edits superseded by another device:", data.conflicts);
+    }
+
+    // Sends queued edits as one PATCH, or asks for changes since our version when there are none
+    async function syncShoppingList() {
+        if (syncInFlight) { scheduleSync(SYNC_DELAY_MS); return; }
+        syncInFlight = true;
+        const sending = pendingOps.length;
+        try {
+            let response;
+            if (sending) {
+                response = await fetch('/shopping-list', {
+                    method: 'PATCH',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ base_version: listVersion, ops: pendingOps.slice(0, sending) })
+                });
+            } else {
+                // Unchanged lists are answered with 304 (the browser revalidates its cached copy)
+                response = await fetch(listVersion ? `/shopping-list?since=${listVersion}` : '/shopping-list', { cache: 'no-cache' });
+            }
+            if (response.status === 401) return; // Session ended; the local copy stays usable
+            if (response.status === 400) {
+                console.error("Shopping list edits rejected:", (await response.json()).error);
+                pendingOps.splice(0, sending); // Retrying the same ops would fail the same way
+                return;
+            }
+            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+            const data = await response.json();
+            pendingOps.splice(0, sending); // Ops queued while the request was out are kept
+            applyServerList(data);
+            saveShoppingList();
+            renderShoppingList();
+        } catch (error) {
+            console.warn("Shopping list sync failed; will retry:", error);
+            scheduleSync(SYNC_RETRY_MS);
+        } finally {
+            syncInFlight = false;
+            if (pendingOps.length && !syncTimer) scheduleSync(SYNC_DELAY_MS);
+        }
+    }
+
+    // For lists kept in the browser: one request categorizes every item still lacking an aisle
+    async function categorizeItems() {
+        const names = [...new Set(shoppingList.filter(item => !item.category).map(item => item.name))];
+        if (!names.length) return;
+        try {
+            const response = await fetch('/shopping-list/categorize', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ items: names })
+            });
+            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+            const data = await response.json();
+            categoryOrder = data.order || categoryOrder;
+            shoppingList.forEach(item => { if (!item.category && data.categories[item.name]) item.category = data.categories[item.name]; });
+            saveShoppingList();
+            renderShoppingList();
+        } catch (error) {
+            console.warn("Could not categorize shopping list items:", error);
+        }
+    }
+
+    function groupedShoppingList() {
+        const groups = new Map();
+        shoppingList.forEach(item => {
+            const category = item.category || 'Other';
+            if (!groups.has(category)) groups.set(category, []);
+            groups.get(category).push(item);
+        });
+        const rank = category => { const i = categoryOrder.indexOf(category); return i === -1 ? categoryOrder.length : i; };
+        groups.forEach(items => items.sort((a, b) => a.name.localeCompare(b.name)));
+        return [...groups.entries()].sort((a, b) => rank(a[0]) - rank(b[0]) || a[0].localeCompare(b[0]));
+    }
+
+    function renderShoppingList() {
+        if (!shoppingListItemsDiv) return;
+        if (copyListBtn) copyListBtn.disabled = shoppingList.length === 0;
+        if (clearListBtn) clearListBtn.disabled = shoppingList.length === 0;
+        if (shoppingList.length === 0) {
+            shoppingListItemsDiv.innerHTML = '<p><em>Your shopping list is empty. Add items from a recipe or manually.</em></p>';
+            return;
+        }
+        let html = '';
+        groupedShoppingList().forEach(([category, items]) => {
+            html += `<h5>${escapeHtml(category)}</h5><ul class="list-group list-group-flush">`;
+            items.forEach(item => {
+                const id = escapeHtml(item.id);
+                html += `<li class="list-group-item d-flex align-items-center${item.checked ? ' list-group-item-light' : ''}">
+                    <input class="form-check-input" type="checkbox" id="shop-${id}" data-id="${id}"${item.checked ? ' checked' : ''}>
+                    <label class="form-check-label flex-grow-1${item.checked ? ' text-decoration-line-through text-muted' : ''}" for="shop-${id}">${escapeHtml(item.name)}</label>
+                    <button class="btn btn-sm btn-delete-item" data-id="${id}" title="Remove" aria-label="Remove ${escapeHtml(item.name)}">&times;</button>
+                </li>`;
+            });
+            html += '</ul>';
+        });
+        shoppingListItemsDiv.innerHTML = html;
+    }
+
+    function addShoppingListItems(names, recipeTitle) {
+        const existing = new Set(shoppingList.filter(item => !item.checked).map(item => item.name.toLowerCase()));
+        const ops = [];
+        names.forEach(raw => {
+            const name = String(raw).trim().replace(/\s+/g, ' ');
+            if (!name || existing.has(name.toLowerCase())) return;
+            existing.add(name.toLowerCase());
+            ops.push({ op: 'add', id: newItemId(), name: name, recipe: recipeTitle || null });
+        });
+        if (ops.length) editShoppingList(ops);
+        return ops.length;
+    }
+
+    if (addToListBtn) {
+        addToListBtn.addEventListener('click', function() {
+            if (!currentRecipeData || !Array.isArray(currentRecipeData.ingredients)) {
+                alert("No recipe ingredients to add."); return;
+            }
+            const added = addShoppingListItems(currentRecipeData.ingredients.filter(ing => typeof ing === 'string' || typeof ing === 'number'), currentRecipeData.title);
+            if (!added) alert("Those ingredients are already on your shopping list.");
+        });
+    }
+
+    if (manualAddBtn && manualAddItemInput) {
+        const addManualItem = () => {
+            if (addShoppingListItems([manualAddItemInput.value])) manualAddItemInput.value = '';
+            manualAddItemInput.focus();
+        };
+        manualAddBtn.addEventListener('click', addManualItem);
+        manualAddItemInput.addEventListener('keydown', event => {
+            if (event.key === 'Enter') { event.preventDefault(); addManualItem(); }
+        });
+    }
+
+    if (shoppingListItemsDiv) {
+        shoppingListItemsDiv.addEventListener('change', event => {
+            const checkbox = event.target.closest('input[type="checkbox"][data-id]');
+            if (checkbox) editShoppingList([{ op: 'update', id: checkbox.dataset.id, checked: checkbox.checked }]);
+        });
+        shoppingListItemsDiv.addEventListener('click', event => {
+            const button = event.target.closest('.btn-delete-item[data-id]');
+            if (button) editShoppingList([{ op: 'delete', id: button.dataset.id }]);
+        });
+    }
+
+    if (copyListBtn) {
+        copyListBtn.addEventListener('click', async function() {
+            const text = groupedShoppingList().map(([category, items]) =>
+                `${category}:\n` + items.map(item => `- ${item.checked ? '[x] ' : ''}${item.name}`).join('\n')).join('\n\n');
+            try {
+                await navigator.clipboard.writeText(text);
+            } catch (e) {
+                if (!copyListTextarea) return;
+                copyListTextarea.value = text;
+                copyListTextarea.select();
+                document.execCommand('copy');
+            }
+            copyListBtn.textContent = 'Copied!';
+            setTimeout(() => { copyListBtn.textContent = 'Copy List'; }, 1500);
+        });
+    }
+
+    if (clearListBtn) {
+        clearListBtn.addEventListener('click', function() {
+            if (shoppingList.length && confirm("Remove all items from your shopping list?")) editShoppingList([{ op: 'clear' }]);
+        });
+    }
 
 
     // --- Recipe Sharing Logic (Stateless) ---
@@ -192,6 +514,57 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // Points the link box, social links and Web Share button at shareUrl
+    function applyShareLinks(shareUrl, recipeTitle) {
+        const shareText = `Check out this recipe: ${recipeTitle}`;
+
+        if(shareUrlInput) shareUrlInput.value = shareUrl;
+        if(shareEmailLink) shareEmailLink.href = `mailto:?subject=${encodeURIComponent(shareText)}&body=${encodeURIComponent('Recipe Link: ' + shareUrl)}`;
+        if(shareFacebookLink) shareFacebookLink.href = `https://www.facebook.com/sharer/sharer.php?u=${encodeURIComponent(shareUrl)}`;
+        if(shareTwitterLink) shareTwitterLink.href = `https://twitter.com/intent/tweet?url=${encodeURIComponent(shareUrl)}&text=${encodeURIComponent(shareText)}`;
+        // Setup WhatsApp Link
+        if(shareWhatsappLink) shareWhatsappLink.href = `https://wa.me/?text=${encodeURIComponent(shareText + ' - ' + shareUrl)}`;
+
+        // Setup Direct Share Button (looked up each time: it is replaced below)
+        const currentDirectShareBtn = document.getElementById('direct-share-btn');
+        if (currentDirectShareBtn) {
+            if (navigator.share) {
+                currentDirectShareBtn.style.display = 'inline-block';
+                // Detach previous listener if any to prevent duplicates
+                const newDirectShareBtn = currentDirectShareBtn.cloneNode(true);
+                currentDirectShareBtn.parentNode.replaceChild(newDirectShareBtn, currentDirectShareBtn);
+                // Add listener to the new button
+                newDirectShareBtn.addEventListener('click', async () => {
+                    try {
+                        await navigator.share({ title: recipeTitle, text: shareText, url: shareUrl });
+                        console.log('Recipe shared successfully via Web Share API');
+                    } catch (err) {
+                        console.error('Error using Web Share API:', err);
+                    }
+                });
+            } else {
+                currentDirectShareBtn.style.display = 'none';
+            }
+        }
+    }
+
+    // Asks the server for a short /s/<id> link; resolves to null if it can't
+    async function createShortShareUrl(recipe) {
+        try {
+            const response = await fetch('/share', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ recipe: recipe })
+            });
+            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+            const data = await response.json();
+            return data.url || null;
+        } catch (error) {
+            console.error("Error creating short share link:", error);
+            return null;
+        }
+    }
+
     if (shareModal) {
          shareModal.addEventListener('show.bs.modal', function (event) {
             if (!currentRecipeData) {
@@ -201,37 +574,15 @@ document.addEventListener('DOMContentLoaded', function() {
             if (!encodedData) {
                 alert("Could not generate sharing link."); event.preventDefault(); return;
             }
-            const shareUrl = `${window.location.origin}/share?data=${encodedData}`;
             const recipeTitle = currentRecipeData.title || "Recipe";
-            const shareText = `Check out this recipe: ${recipeTitle}`;
-
-            if(shareUrlInput) shareUrlInput.value = shareUrl;
-            if(shareEmailLink) shareEmailLink.href = `mailto:?subject=${encodeURIComponent(shareText)}&body=${encodeURIComponent('Recipe Link: ' + shareUrl)}`;
-            if(shareFacebookLink) shareFacebookLink.href = `https://www.facebook.com/sharer/sharer.php?u=${encodeURIComponent(shareUrl)}`;
-            if(shareTwitterLink) shareTwitterLink.href = `https://twitter.com/intent/tweet?url=${encodeURIComponent(shareUrl)}&text=${encodeURIComponent(shareText)}`;
-            // Setup WhatsApp Link
-            if(shareWhatsappLink) shareWhatsappLink.href = `https://wa.me/?text=${encodeURIComponent(shareText + ' - ' + shareUrl)}`;
-
-            // Setup Direct Share Button
-             if (directShareBtn) {
-                 if (navigator.share) {
-                     directShareBtn.style.display = 'inline-block';
-                     // Detach previous listener if any to prevent duplicates
-                     const newDirectShareBtn = directShareBtn.cloneNode(true);
-                     directShareBtn.parentNode.replaceChild(newDirectShareBtn, directShareBtn);
-                     // Add listener to the new button
-                     newDirectShareBtn.addEventListener('click', async () => {
-                         try {
-                             await navigator.share({ title: recipeTitle, text: shareText, url: shareUrl });
-                             console.log('Recipe shared successfully via Web Share API');
-                         } catch (err) {
-                             console.error('Error using Web Share API:', err);
-                         }
-                     });
-                 } else {
-                     directShareBtn.style.display = 'none';
-                 }
-             }
+            const sharedRecipe = currentRecipeData;
+
+            // Show the self-contained ?data= link straight away, then swap in the short link
+            applyShareLinks(`${window.location.origin}/share?data=${encodedData}`, recipeTitle);
+            createShortShareUrl(sharedRecipe).then(shortUrl => {
+                if (shortUrl && currentRecipeData === sharedRecipe) applyShareLinks(shortUrl, recipeTitle);
+            });
+
             if(copyLinkFeedback) copyLinkFeedback.style.display = 'none';
             if(copyShareLinkBtn) copyShareLinkBtn.disabled = false;
          });
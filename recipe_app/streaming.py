@@ -0,0 +1,142 @@
+# streaming.py
+import logging
+import re
+import time
+
+import requests
+
+import jsoncodec
+from cache import make_cache_key
+from gemini_client import get_gemini_client
+from metrics import LLM_PARSE_FAILURES
+from utils import (
+    GEMINI_MODEL, GENERATION_CONFIG, acquire_gemini_slot, gemini_breaker, gemini_limiter, get_cached_response, get_response_cache,
+    is_valid_recipe, recipe_or_mock
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Incremental Recipe Parser ---
+
+_JSON_STRING = r'"((?:[^"\\]|\\.)*)"'
+SCALAR_FIELDS = ['title', 'description', 'prep_time', 'cook_time']
+LIST_FIELDS = {'ingredients': 'ingredient', 'steps': 'step'}
+
+class RecipeStreamParser:
+    """
+    Pulls recipe fields out of a partially received JSON document.
+    Each call to feed() returns the (event, value) pairs that became
+    complete since the previous call, e.g. ('title', 'Pad Thai') or
+    ('ingredient', '200g rice noodles'), so they can be pushed to the
+    browser before the model has finished the whole object.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._sent_scalars = set()
+        self._sent_counts = {field: 0 for field in LIST_FIELDS}
+        self._scalar_patterns = {
+            field: re.compile(r'"%s"\s*:\s*%s' % (field, _JSON_STRING)) for field in SCALAR_FIELDS
+        }
+        self._list_patterns = {
+            field: re.compile(r'"%s"\s*:\s*\[' % field) for field in LIST_FIELDS
+        }
+        self._item_pattern = re.compile(r'\s*,?\s*' + _JSON_STRING)
+
+    def feed(self, text):
+        self.buffer += text
+        events = []
+
+        for field, pattern in self._scalar_patterns.items():
+            if field in self._sent_scalars:
+                continue
+            match = pattern.search(self.buffer)
+            if match:
+                self._sent_scalars.add(field)
+                events.append((field, jsoncodec.loads(f'"{match.group(1)}"')))
+
+        for field, event_name in LIST_FIELDS.items():
+            start = self._list_patterns[field].search(self.buffer)
+            if not start:
+                continue
+            items = []
+            pos = start.end()
+            while True:
+                match = self._item_pattern.match(self.buffer, pos)
+                if not match:
+                    break
+                items.append(jsoncodec.loads(f'"{match.group(1)}"'))
+                pos = match.end()
+            for item in items[self._sent_counts[field]:]:
+                events.append((event_name, item))
+            self._sent_counts[field] = max(self._sent_counts[field], len(items))
+
+        return events
+
+
+# --- Server-Sent Events ---
+
+def format_sse(event, data):
+    """Formats one SSE message with a JSON payload."""
+    return f"event: {event}\ndata: {jsoncodec.dumps(data)}\n\n"
+
+def _chunk_text(response_json):
+    """Returns the text carried by one streamGenerateContent chunk."""
+    candidates = response_json.get('candidates') or []
+    if not candidates:
+        return ""
+    parts = candidates[0].get('content', {}).get('parts') or []
+    return "".join(part.get('text', '') for part in parts)
+
+def stream_recipe_events(prompt, ingredients, deadline=None):
+    """
+    Generator of SSE messages for /generate/stream. Emits partial fields as
+    they arrive, then a final 'recipe' event carrying the validated object
+    (or mock_recipe on failure), exactly what /generate would have returned.
+    """
+    cache_key = make_cache_key(prompt, GENERATION_CONFIG, GEMINI_MODEL)
+    cached = get_cached_response(cache_key)
+    if cached is not None:
+        yield format_sse('recipe', cached)
+        return
+    cache = get_response_cache()
+
+    client = get_gemini_client()
+    parser = RecipeStreamParser()
+    recipe_data = None
+    if not client.api_key:
+        logger.error("GEMINI_API_KEY not found in environment variables.")
+    elif not acquire_gemini_slot(deadline):
+        pass # Over the outbound concurrency limit; serve the fallback
+    elif not gemini_breaker.allow_request():
+        gemini_limiter.release(ok=None)
+        logger.warning("Gemini circuit breaker is open, skipping streaming API call.")
+    else:
+        start = time.monotonic()
+        abandoned = False
+        try:
+            for chunk in client.stream_generate_content(GEMINI_MODEL, prompt, GENERATION_CONFIG, deadline=deadline):
+                for event, value in parser.feed(_chunk_text(chunk)):
+                    yield format_sse(event, value)
+            recipe_data = jsoncodec.loads(parser.buffer) if parser.buffer else None
+        except GeneratorExit:
+            abandoned = True # The client disconnected; that says nothing about Gemini's health
+            raise
+        except jsoncodec.JSONDecodeError:
+            logger.error("Failed to decode JSON from streamed LLM response.")
+            LLM_PARSE_FAILURES.inc(reason='invalid_json')
+        except requests.exceptions.RequestException as e:
+            logger.error("Error streaming from Gemini API: %s", e)
+        except Exception as e:
+            logger.exception("An unexpected error occurred during streaming API call: %s", e)
+        finally:
+            if abandoned:
+                gemini_breaker.release()
+                gemini_limiter.release(ok=None)
+            else:
+                gemini_breaker.record(recipe_data is not None, time.monotonic() - start)
+                gemini_limiter.release(recipe_data is not None) # Stream length isn't a latency signal
+
+    if is_valid_recipe(recipe_data):
+        cache.set(cache_key, recipe_data)
+    yield format_sse('recipe', recipe_or_mock(recipe_data, ingredients))
@@ -0,0 +1,230 @@
+# substitutions.py
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from itertools import chain, zip_longest
+
+from normalize import normalize_ingredient
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SEED_PATH = os.path.join(BASE_DIR, 'data', 'substitutions.json')
+DEFAULT_LEARNED_PATH = os.path.join(BASE_DIR, 'substitutions_learned.sqlite3')
+
+CONTEXTS = ('baking', 'savory')
+ANY_CONTEXT = 'any'
+MAX_SUBSTITUTES = 3 # Same cap as the LLM prompt and SUBSTITUTION_SCHEMA
+
+# Leading quantities, units and preparation words stripped from recipe lines like
+# "2 tbsp unsalted butter, softened". Only words that don't change what the
+# ingredient is belong here: "peanut butter" and "egg white" must stay whole.
+_QUANTITY_RE = re.compile(r"^[\d\s/.,½¼¾⅓⅔-]+")
+_STRIP_WORDS = {
+    "cup", "cups", "tbsp", "tablespoon", "tablespoons", "tsp", "teaspoon", "teaspoons", "g", "kg", "gram",
+    "grams", "ml", "l", "liter", "litre", "oz", "ounce", "ounces", "lb", "lbs", "pound", "pounds", "pinch",
+    "dash", "can", "cans", "large", "small", "medium", "of", "fresh", "unsalted", "salted", "chopped",
+    "minced", "diced", "sliced", "grated", "shredded", "finely", "roughly", "softened", "melted", "cold",
+}
+
+def _candidate_keys(ingredient):
+    """
+    Lookup keys for a recipe line: the whole name, then the name without
+    leading quantities, units and preparation words. Nothing else is dropped,
+    so a miss goes to the LLM rather than to a different ingredient.
+    """
+    cleaned = ingredient.lower().split(',')[0].split('(')[0]
+    words = _QUANTITY_RE.sub("", cleaned).split()
+    start = 0
+    while start < len(words) - 1 and words[start] in _STRIP_WORDS:
+        start += 1
+    keys = []
+    for key in (normalize_ingredient(" ".join(words)), normalize_ingredient(" ".join(words[start:]))):
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+def _base_name(substitute):
+    """"onion powder (1 tbsp per medium onion)" -> "onion powder", for comparing against the query."""
+    return normalize_ingredient(substitute.split('(')[0])
+
+
+class SubstitutionStore:
+    """
+    Local substitution knowledge base consulted before the LLM.
+
+    Seed entries come from a JSON file shipped with the app
+    ({ingredient: {context: [substitutes]}}); answers learned from the LLM
+    are persisted in a SQLite file so the store grows over time and is
+    shared by every worker on the host. Keys are normalized ingredient
+    names and must match the whole name: "peanut butter" is not "butter",
+    so it misses here and is asked of the LLM instead.
+    """
+
+    def __init__(self, seed_path=DEFAULT_SEED_PATH, learned_path=DEFAULT_LEARNED_PATH):
+        self.learned_path = learned_path
+        self._lock = threading.RLock()
+        self._entries = {}                  # key -> {context: [substitutes]}
+        self._local = threading.local()
+        self._counters = {"hits": 0, "misses": 0, "learned": 0}
+
+        self._load_seed(seed_path)
+        if learned_path:
+            try:
+                self._ensure_learned_schema()
+                self._load_learned()
+            except sqlite3.Error as e:
+                logger.warning("Learned substitution store unavailable (%s): %s", learned_path, e)
+                self.learned_path = None
+
+    # --- Loading ---
+
+    def _load_seed(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                seed = json.load(f)
+        except FileNotFoundError:
+            logger.warning("Substitution seed file not found at %s.", path)
+            return
+        except json.JSONDecodeError as e:
+            logger.error("Error loading substitution seed file %s: %s", path, e)
+            return
+        for ingredient, by_context in seed.items():
+            for context, substitutes in by_context.items():
+                self._index(normalize_ingredient(ingredient), context, substitutes)
+
+    def _learned_conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.learned_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            self._local.conn = conn
+        return conn
+
+    def _ensure_learned_schema(self):
+        self._learned_conn().execute("""
+            CREATE TABLE IF NOT EXISTS learned_substitutions (
+                ingredient_key TEXT NOT NULL,
+                context TEXT NOT NULL,
+                substitutes TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (ingredient_key, context)
+            );
+        """)
+
+    def _load_learned(self):
+        rows = self._learned_conn().execute(
+            "SELECT ingredient_key, context, substitutes FROM learned_substitutions;"
+        ).fetchall()
+        for key, context, substitutes in rows:
+            self._index(key, context, json.loads(substitutes))
+
+    def _index(self, key, context, substitutes):
+        if not key or not substitutes:
+            return
+        with self._lock:
+            self._entries.setdefault(key, {})[context or ANY_CONTEXT] = list(substitutes)
+
+    # --- Lookup ---
+
+    def _fetch_learned(self, key):
+        """Picks up entries another worker learned after this one started."""
+        if not self.learned_path:
+            return False
+        try:
+            rows = self._learned_conn().execute(
+                "SELECT context, substitutes FROM learned_substitutions WHERE ingredient_key = ?;", (key,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.error("Error reading learned substitutions: %s", e)
+            return False
+        for context, substitutes in rows:
+            self._index(key, context, json.loads(substitutes))
+        return bool(rows)
+
+    @staticmethod
+    def _pick(by_context, context, exclude):
+        """Up to MAX_SUBSTITUTES suggestions for `context`, never naming the ingredient asked about."""
+        if context and context in by_context:
+            candidates = by_context[context]
+        elif ANY_CONTEXT in by_context:
+            candidates = by_context[ANY_CONTEXT]
+        else:
+            # No generic entry: alternate between the contexts so each is represented
+            candidates = [s for s in chain.from_iterable(zip_longest(*by_context.values())) if s]
+        picked = []
+        for substitute in candidates:
+            if substitute not in picked and _base_name(substitute) not in exclude:
+                picked.append(substitute)
+        return picked[:MAX_SUBSTITUTES]
+
+    def lookup(self, ingredient, context=None):
+        """Returns a list of substitutes, or None if the store has no answer."""
+        if not ingredient or not isinstance(ingredient, str):
+            return None
+        keys = _candidate_keys(ingredient)
+        for key in keys:
+            with self._lock:
+                by_context = self._entries.get(key)
+            if by_context is None and self._fetch_learned(key):
+                with self._lock:
+                    by_context = self._entries.get(key)
+            if by_context:
+                result = self._pick(by_context, context, exclude=keys)
+                if result:
+                    self._count("hits")
+                    return result
+        self._count("misses")
+        return None
+
+    # --- Write-back ---
+
+    def add(self, ingredient, substitutes, context=None):
+        """Stores substitutes (e.g. an LLM answer) in memory and in the learned SQLite file."""
+        # Stored under the stripped name, so "2 tbsp tahini" and "tahini" share the answer
+        keys = _candidate_keys(ingredient) if isinstance(ingredient, str) else []
+        key = keys[-1] if keys else None
+        if not key or not substitutes:
+            return
+        context = context or ANY_CONTEXT
+        self._index(key, context, substitutes)
+        self._count("learned")
+        if self.learned_path:
+            try:
+                self._learned_conn().execute(
+                    "INSERT OR REPLACE INTO learned_substitutions (ingredient_key, context, substitutes, created_at) "
+                    "VALUES (?, ?, ?, ?);",
+                    (key, context, json.dumps(list(substitutes)), time.time())
+                )
+            except sqlite3.Error as e:
+                logger.error("Error saving learned substitution for %s: %s", key, e)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+        return stats
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_substitution_store():
+    """Returns the process-wide store, loading it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SubstitutionStore(
+                    seed_path=os.getenv('SUBSTITUTIONS_SEED_PATH', DEFAULT_SEED_PATH),
+                    learned_path=os.getenv('SUBSTITUTIONS_LEARNED_PATH', DEFAULT_LEARNED_PATH) or None,
+                )
+    return _store
@@ -0,0 +1,6 @@
+# conftest.py
+import os
+import sys
+
+# The app is a flat set of modules run from recipe_app/; make them importable from tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,14 @@
+# test_bench_load.py
+import pytest
+
+from bench.load import percentile
+
+
+@pytest.mark.parametrize("pct, expected", [(50, 50), (95, 95), (99, 99), (100, 100), (0, 1), (0.5, 1)])
+def test_percentile_nearest_rank(pct, expected):
+    assert percentile(list(range(1, 101)), pct) == expected
+
+def test_percentile_small_and_empty():
+    assert percentile([], 95) == 0.0
+    assert percentile([7], 99) == 7
+    assert percentile([1, 2, 3, 4], 50) == 2
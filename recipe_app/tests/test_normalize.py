@@ -0,0 +1,21 @@
+# test_normalize.py
+import pytest
+
+from normalize import normalize_ingredient, singularize
+
+
+@pytest.mark.parametrize("plural, singular", [
+    ("berries", "berry"), ("cherries", "cherry"), ("anchovies", "anchovy"), ("curries", "curry"),
+    ("cookies", "cookie"), ("pies", "pie"), ("chilies", "chili"), ("calories", "calorie"), ("ties", "tie"),
+    ("tomatoes", "tomato"), ("peaches", "peach"), ("carrots", "carrot"),
+])
+def test_singularize(plural, singular):
+    assert singularize(plural) == singular
+
+@pytest.mark.parametrize("word", ["asparagus", "couscous", "species", "hummus", "pea"])
+def test_singular_words_are_left_alone(word):
+    assert singularize(word) == word
+
+def test_normalize_ingredient_uses_synonyms_after_singularizing():
+    assert normalize_ingredient("  Chilies ") == normalize_ingredient("chili")
+    assert normalize_ingredient("Scallions") == "green onion"
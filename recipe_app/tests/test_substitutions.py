@@ -0,0 +1,44 @@
+# test_substitutions.py
+import pytest
+
+from substitutions import MAX_SUBSTITUTES, SubstitutionStore, _base_name
+
+
+@pytest.fixture
+def store():
+    return SubstitutionStore(learned_path=None) # Bundled seed data only
+
+
+@pytest.mark.parametrize("ingredient", [
+    "peanut butter", "apple butter", "cocoa butter", "egg white", "2 egg whites", "chicken",
+])
+def test_compound_names_do_not_borrow_a_shorter_entry(store, ingredient):
+    assert store.lookup(ingredient) is None
+
+@pytest.mark.parametrize("ingredient", ["almond milk", "coconut milk", "onion powder", "onion", "butter"])
+def test_results_never_suggest_the_ingredient_itself(store, ingredient):
+    key = _base_name(ingredient)
+    assert key not in {_base_name(s) for s in store.lookup(ingredient) or []}
+
+def test_onion_powder_entry_is_not_offered_for_itself(store):
+    assert all(not s.startswith("onion powder") for s in store.lookup("onion powder") or [])
+
+def test_merged_contexts_are_capped(store):
+    result = store.lookup("butter")
+    assert 0 < len(result) <= MAX_SUBSTITUTES
+    assert len(set(result)) == len(result)
+
+def test_context_selects_its_list(store):
+    assert "olive oil" in store.lookup("butter", context="savory")
+    assert "olive oil" not in store.lookup("butter", context="baking")
+
+@pytest.mark.parametrize("line", ["2 tbsp unsalted butter, softened", "1 cup melted butter", "Butter"])
+def test_quantities_and_preparation_words_are_stripped(store, line):
+    assert store.lookup(line, context="baking") == store.lookup("butter", context="baking")
+
+def test_learned_answers_are_keyed_on_the_stripped_name(tmp_path):
+    store = SubstitutionStore(seed_path=str(tmp_path / "missing.json"), learned_path=str(tmp_path / "learned.sqlite3"))
+    store.add("3 tbsp tahini", ["sunflower seed butter", "cashew butter"])
+    assert store.lookup("tahini") == ["sunflower seed butter", "cashew butter"]
+    assert SubstitutionStore(seed_path=str(tmp_path / "missing.json"),
+                             learned_path=str(tmp_path / "learned.sqlite3")).lookup("tahini")
@@ -1,13 +1,144 @@
 # utils.py
 import re
 import requests
-import json
+import base64
+import logging
 import os
+import time
+from cache import build_response_cache, make_cache_key
+from singleflight import SingleFlight, SingleFlightTimeout
+from circuit_breaker import CircuitBreaker, time_remaining
+from rate_limit import AdaptiveConcurrencyLimiter
+from gemini_client import get_gemini_client
+from model_router import ModelRouter
+from metrics import ADMISSION_REJECTIONS, GEMINI_CALL_DURATION, LLM_PARSE_FAILURES, RECIPE_FALLBACKS
+from logging_config import LazyJSON
+from schemas import RECIPE_SCHEMA, SUBSTITUTION_SCHEMA, multi_recipe_schema, compile_schema
+import jsoncodec
+
+logger = logging.getLogger(__name__)
+from substitutions import get_substitution_store
 
 # --- Gemini LLM Interaction ---
 
-def format_gemini_prompt(ingredients, filters, description):
-    """Formats the prompt for the Gemini API for recipe generation."""
+GEMINI_MODEL = "gemini-1.5-flash-latest"
+# Structured output: the model fills in schemas.py's fields and nothing else,
+# and stops at the token budget instead of rambling (a typical recipe is ~500)
+RECIPE_MAX_OUTPUT_TOKENS = 2048
+GENERATION_CONFIG = {
+    "responseMimeType": "application/json", # Request JSON output directly
+    "responseSchema": RECIPE_SCHEMA,
+    "maxOutputTokens": RECIPE_MAX_OUTPUT_TOKENS,
+}
+SUBSTITUTION_GENERATION_CONFIG = {
+    "responseMimeType": "application/json",
+    "responseSchema": SUBSTITUTION_SCHEMA,
+    "maxOutputTokens": 256,
+}
+
+def multi_recipe_generation_config(count):
+    """Generation config for a packed prompt answering `count` recipes at once."""
+    return {
+        "responseMimeType": "application/json",
+        "responseSchema": multi_recipe_schema(count),
+        "maxOutputTokens": RECIPE_MAX_OUTPUT_TOKENS * count,
+    }
+
+# Response cache shared by every call_gemini_api caller (/generate, /substitute).
+# Built lazily so .env has been loaded first; app.py may swap in a
+# Postgres-backed cache once the DB pool exists.
+response_cache = None
+
+def get_response_cache():
+    """Returns the module-level response cache, building it on first use."""
+    global response_cache
+    if response_cache is None:
+        response_cache = build_response_cache()
+    return response_cache
+
+def set_response_cache(cache):
+    """Replaces the module-level response cache (e.g. with a shared tier)."""
+    global response_cache
+    response_cache = cache
+
+def get_cache_stats():
+    """Returns hit/miss counters for the response cache."""
+    return get_response_cache().stats()
+
+# Read-only answers precomputed by `python -m warm_cache build`, memory-mapped
+# and checked before the response cache (settings: WARM_CACHE_*). Owned by
+# the app's Services and bound here per process (see app.py).
+warm_cache = None
+
+def get_warm_cache():
+    """Returns the bound warm cache, or None when disabled or not bound yet."""
+    return warm_cache
+
+def set_warm_cache(cache):
+    """Binds the warm cache call_gemini_api and friends consult."""
+    global warm_cache
+    warm_cache = cache
+
+def get_cached_response(cache_key):
+    """A cached Gemini answer by cache key: warm cache file first, then the response cache."""
+    warm = get_warm_cache()
+    if warm is not None:
+        value = warm.get(cache_key)
+        if value is not None:
+            return value
+    return get_response_cache().get(cache_key)
+
+# Concurrent callers with the same prompt fingerprint share one upstream call.
+# Waiters give up after GEMINI_SINGLEFLIGHT_WAIT seconds and fall back to mock data.
+gemini_flight = SingleFlight()
+
+def get_singleflight_stats():
+    """Returns counters for coalesced Gemini calls ('shared' = calls saved)."""
+    return gemini_flight.stats()
+
+# Opens after sustained Gemini errors/slowness so requests get the fallback
+# immediately instead of waiting out timeouts (settings: GEMINI_BREAKER_*).
+gemini_breaker = CircuitBreaker.from_env()
+
+def get_breaker_stats():
+    """Returns the Gemini circuit breaker state and counters."""
+    return gemini_breaker.stats()
+
+# Caps concurrent outbound Gemini calls per process, shrinking the cap when
+# Gemini errors or slows down (settings: GEMINI_CONCURRENCY_*).
+gemini_limiter = AdaptiveConcurrencyLimiter.from_env()
+
+def acquire_gemini_slot(deadline=None):
+    """Waits up to GEMINI_CONCURRENCY_WAIT seconds (within the deadline) for a Gemini call slot."""
+    wait = float(os.getenv('GEMINI_CONCURRENCY_WAIT', '0.5'))
+    remaining = time_remaining(deadline)
+    if remaining is not None:
+        wait = max(0.0, min(wait, remaining))
+    if gemini_limiter.acquire(timeout=wait):
+        return True
+    logger.warning("Too many concurrent Gemini calls (limit %d), skipping API call.", gemini_limiter.limit)
+    ADMISSION_REJECTIONS.inc(reason='gemini_concurrency')
+    return False
+
+# Picks the model(s) per request type and hedges slow calls (settings:
+# GEMINI_MODELS_*, GEMINI_HEDGE_*). Defaults to GEMINI_MODEL for every tier.
+model_router = None
+
+def get_model_router():
+    """Returns the module-level model router, building it on first use (after .env is loaded)."""
+    global model_router
+    if model_router is None:
+        model_router = ModelRouter.from_env(GEMINI_MODEL)
+    return model_router
+
+def get_router_stats():
+    """Returns per-tier hedge delay and per-model latency/win-rate stats."""
+    return get_model_router().stats()
+
+RECIPE_JSON_KEYS = "'title' (string), 'description' (string, optional), 'ingredients' (list of strings), 'steps' (list of strings), 'prep_time' (string, e.g., '15 minutes'), 'cook_time' (string, e.g., '30 minutes')"
+
+def _recipe_request_parts(ingredients, filters, description):
+    """Describes one recipe request (description, ingredients, preferences) as prompt sentences."""
     prompt_parts = []
     if description:
         prompt_parts.append(f"{description}.") # Start with general description
@@ -17,102 +148,218 @@ def format_gemini_prompt(ingredients, filters, description):
     else:
         prompt_parts.append("Generate a simple recipe.") # Fallback if no ingredients
 
-    # Add filters (example: dietary, cuisine)
+    # Add filters (example: dietary, cuisine). Sorted so key order never changes the prompt.
     if filters:
-        filter_str = ", ".join([f"{k}: {v}" for k, v in filters.items() if v])
+        filter_str = ", ".join([f"{k}: {v}" for k, v in sorted(filters.items()) if v])
         if filter_str:
              prompt_parts.append(f"Consider these preferences: {filter_str}.")
+    return prompt_parts
+
+def format_gemini_prompt(ingredients, filters, description):
+    """Formats the prompt for the Gemini API for recipe generation."""
+    prompt_parts = _recipe_request_parts(ingredients, filters, description)
 
     # Ask for specific JSON structure for recipes
-    prompt_parts.append("Please provide the recipe ONLY in JSON format with keys: 'title' (string), 'description' (string, optional), 'ingredients' (list of strings), 'steps' (list of strings), 'prep_time' (string, e.g., '15 minutes'), 'cook_time' (string, e.g., '30 minutes').")
+    prompt_parts.append(f"Please provide the recipe ONLY in JSON format with keys: {RECIPE_JSON_KEYS}.")
 
     return " ".join(prompt_parts)
 
-def call_gemini_api(prompt):
+def format_multi_recipe_prompt(recipe_requests):
+    """
+    Packs several recipe requests, each an (ingredients, filters, description)
+    tuple, into one prompt answered with {"recipes": [...]} in request order.
+    """
+    count = len(recipe_requests)
+    prompt_parts = [f"Generate {count} separate recipes, one for each numbered request below."]
+    for index, (ingredients, filters, description) in enumerate(recipe_requests, start=1):
+        prompt_parts.append(f"Request {index}: " + " ".join(_recipe_request_parts(ingredients, filters, description)))
+    prompt_parts.append(
+        "Please provide the recipes ONLY in JSON format as an object with a single key 'recipes' "
+        f"whose value is a list of exactly {count} recipe objects in the same order as the requests. "
+        f"Each recipe object has keys: {RECIPE_JSON_KEYS}."
+    )
+    return " ".join(prompt_parts)
+
+def call_gemini_api(prompt, validator=None, deadline=None, tier='generate', generation_config=GENERATION_CONFIG, on_fetched=None):
     """
     Calls the Google Gemini API expecting JSON output and returns the
     parsed JSON object or None on failure.
+    Responses are cached by a hash of the prompt and generation config.
+    If a validator is given, only results it accepts are returned and cached.
+    `deadline` (see circuit_breaker.deadline_after) bounds the whole call,
+    including waits on coalesced calls, retries and hedged attempts.
+    `tier` ('generate' or 'substitute') selects the models to route to;
+    `generation_config` sets the response schema and token budget.
+    `on_fetched(result)` runs only when this call fetched a new result from
+    Gemini, not for cache hits or calls that shared an identical in-flight one.
     """
-    api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
-        print("Error: GEMINI_API_KEY not found in environment variables.")
+    cache_key = make_cache_key(prompt, generation_config, GEMINI_MODEL)
+    cached = get_cached_response(cache_key)
+    if cached is not None:
+        return cached
+    cache = get_response_cache()
+
+    # Fail fast while Gemini is known to be unhealthy; callers serve their fallback
+    if gemini_breaker.is_open():
+        logger.warning("Gemini circuit breaker is open, skipping API call.")
         return None
 
-    # Using v1beta as shown in the original example. Use v1 if available/preferred.
-    # Ensure you use a model that supports JSON output mode well, like gemini-1.5-flash-latest
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={api_key}"
-
-    headers = {'Content-Type': 'application/json'}
-    data = {
-        "contents": [{
-            "parts": [{"text": prompt}]
-        }],
-        "generationConfig": {
-            "responseMimeType": "application/json", # Request JSON output directly
-        }
-        # Add safety settings if needed:
-        # "safetySettings": [
-        #     {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        #     {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        #     {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        #     {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}
-        # ]
-    }
+    def fetch():
+        if not acquire_gemini_slot(deadline):
+            return None
+        if not gemini_breaker.allow_request():
+            gemini_limiter.release(ok=None)
+            logger.warning("Gemini circuit breaker is open, skipping API call.")
+            return None
+        start = time.monotonic()
+        parsed_data = None
+        try:
+            parsed_data = get_model_router().call(
+                tier, lambda model, attempt_deadline, cancel: _request_gemini(prompt, attempt_deadline, model, cancel, generation_config),
+                validator=validator, deadline=deadline)
+        finally:
+            latency = time.monotonic() - start
+            gemini_limiter.release(parsed_data is not None, latency)
+            gemini_breaker.record(parsed_data is not None, latency)
+            GEMINI_CALL_DURATION.observe(latency, result='ok' if parsed_data is not None else 'no_data')
+        if parsed_data is not None:
+            cache.set(cache_key, parsed_data)
+            if on_fetched is not None:
+                on_fetched(parsed_data)
+        return parsed_data
 
+    wait_timeout = float(os.getenv('GEMINI_SINGLEFLIGHT_WAIT', '30'))
+    remaining = time_remaining(deadline)
+    if remaining is not None:
+        wait_timeout = max(0.0, min(wait_timeout, remaining))
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=60) # Use timeout
-        response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-        response_json = response.json()
-
-        # Check for prompt feedback which might indicate blocking even with 200 OK
-        if 'promptFeedback' in response_json and 'blockReason' in response_json['promptFeedback']:
-             print(f"Warning: Prompt potentially blocked. Reason: {response_json['promptFeedback']['blockReason']}")
-             # Optionally return None or specific error indicator here if needed
-
-        # Navigate the response structure
-        if 'candidates' in response_json and len(response_json['candidates']) > 0:
-            content = response_json['candidates'][0].get('content', {})
-            if 'parts' in content and len(content['parts']) > 0:
-                # Assuming the first part contains the JSON text
-                json_text = content['parts'][0].get('text', '{}')
-                try:
-                    # Parse the JSON string returned by the LLM
-                    parsed_data = json.loads(json_text)
-                    # Return the parsed data; validation happens in the calling function
-                    return parsed_data
-                except json.JSONDecodeError:
-                    print("Error: Failed to decode JSON from LLM response.")
-                    print("Received Text:", json_text)
-                    return None
-                except Exception as e: # Catch other potential errors during parsing
-                    print(f"Error processing LLM JSON response: {e}")
-                    print("Received Text:", json_text)
-                    return None
-            else:
-                print("Error: 'parts' not found in LLM response candidate content.")
-                print("Received JSON:", response_json)
-                return None
-        else:
-            # Log cases where candidates might be empty due to safety or other reasons
-            print("Error: No valid 'candidates' found in LLM response.")
-            if 'promptFeedback' in response_json:
-                 print("Prompt Feedback:", response_json['promptFeedback'])
-            else:
-                print("Received JSON:", response_json) # Print full response if no candidates
-            return None
+        return gemini_flight.do(cache_key, fetch, timeout=wait_timeout)
+    except SingleFlightTimeout:
+        logger.warning("Gave up waiting %.1fs for an identical in-flight Gemini call.", wait_timeout)
+        return None
+    except Exception as e:
+        logger.exception("An unexpected error occurred during coalesced API call: %s", e)
+        return None
+
+def get_precomputed_result(prompt, generation_config=GENERATION_CONFIG):
+    """The warm cache file's answer for a prompt, or None. Never touches a shared cache or the API."""
+    warm = get_warm_cache()
+    return warm.get(make_cache_key(prompt, generation_config, GEMINI_MODEL)) if warm is not None else None
+
+def get_cached_result(prompt, generation_config=GENERATION_CONFIG):
+    """The cached Gemini result for a prompt, or None. Never calls the API."""
+    return get_cached_response(make_cache_key(prompt, generation_config, GEMINI_MODEL))
+
+def _request_gemini(prompt, deadline=None, model=GEMINI_MODEL, cancel=None, generation_config=GENERATION_CONFIG):
+    """Performs one Gemini HTTP call (with retries) to `model`. Returns parsed JSON or None."""
+    client = get_gemini_client()
+    if not client.api_key:
+        logger.error("GEMINI_API_KEY not found in environment variables.")
+        return None
+
+    try:
+        # Pooled keep-alive session with connect/read timeouts and retry/backoff on 429/5xx
+        response_json = client.generate_content(model, prompt, generation_config, deadline=deadline, cancel=cancel)
+        return parse_gemini_response(response_json)
 
     except requests.exceptions.Timeout:
-        print("Error: API request timed out.")
+        logger.error("API request timed out.")
         return None
     except requests.exceptions.RequestException as e:
-        print(f"Error calling Gemini API: {e}")
+        logger.error("Error calling Gemini API: %s", e)
         return None
     except Exception as e:
         # Catch any other unexpected errors during the API call process
-        print(f"An unexpected error occurred during API call: {e}")
+        logger.exception("An unexpected error occurred during API call: %s", e)
+        return None
+
+def parse_gemini_response(response_json):
+    """
+    Extracts and parses the JSON text from a generateContent response.
+    Shared by the sync and async clients. Returns parsed JSON or None.
+    """
+    if not isinstance(response_json, dict):
+        logger.error("Unexpected LLM response type: %s", type(response_json).__name__)
+        LLM_PARSE_FAILURES.inc(reason='unexpected_type')
+        return None
+
+    # Check for prompt feedback which might indicate blocking even with 200 OK
+    if 'promptFeedback' in response_json and 'blockReason' in response_json['promptFeedback']:
+         logger.warning("Prompt potentially blocked. Reason: %s", response_json['promptFeedback']['blockReason'])
+         # Optionally return None or specific error indicator here if needed
+
+    # Navigate the response structure
+    if 'candidates' in response_json and len(response_json['candidates']) > 0:
+        candidate = response_json['candidates'][0]
+        if candidate.get('finishReason') == 'MAX_TOKENS':
+            # The JSON is cut off mid-way; don't bother parsing it
+            logger.error("LLM response hit maxOutputTokens before the JSON was complete.")
+            LLM_PARSE_FAILURES.inc(reason='max_tokens')
+            return None
+        content = candidate.get('content', {})
+        if 'parts' in content and len(content['parts']) > 0:
+            # Assuming the first part contains the JSON text
+            json_text = content['parts'][0].get('text', '{}')
+            try:
+                # Parse the JSON string returned by the LLM
+                parsed_data = jsoncodec.loads(json_text)
+                # Return the parsed data; validation happens in the calling function
+                return parsed_data
+            except jsoncodec.JSONDecodeError:
+                logger.error("Failed to decode JSON from LLM response.")
+                logger.debug("Received Text: %s", json_text)
+                LLM_PARSE_FAILURES.inc(reason='invalid_json')
+                return None
+            except Exception as e: # Catch other potential errors during parsing
+                logger.error("Error processing LLM JSON response: %s", e)
+                logger.debug("Received Text: %s", json_text)
+                LLM_PARSE_FAILURES.inc(reason='error')
+                return None
+        else:
+            logger.error("'parts' not found in LLM response candidate content.")
+            logger.debug("Received JSON: %s", LazyJSON(response_json))
+            LLM_PARSE_FAILURES.inc(reason='no_parts')
+            return None
+    else:
+        # Log cases where candidates might be empty due to safety or other reasons
+        logger.error("No valid 'candidates' found in LLM response.")
+        LLM_PARSE_FAILURES.inc(reason='no_candidates')
+        if 'promptFeedback' in response_json:
+             logger.warning("Prompt Feedback: %s", LazyJSON(response_json['promptFeedback']))
+        else:
+            logger.debug("Received JSON: %s", LazyJSON(response_json)) # Full response if no candidates
         return None
 
 
+# Compiled once from the same schemas sent as responseSchema
+_recipe_matches_schema = compile_schema(RECIPE_SCHEMA)
+_substitution_matches_schema = compile_schema(SUBSTITUTION_SCHEMA)
+
+def is_valid_recipe(recipe_data):
+    """Checks that parsed LLM output has the structure the frontend expects."""
+    return bool(recipe_data is not None
+            and _recipe_matches_schema(recipe_data)
+            and recipe_data['title'].strip())
+
+def is_valid_substitution(sub_response_data):
+    """Checks that parsed LLM output has the substitution structure."""
+    return sub_response_data is not None and _substitution_matches_schema(sub_response_data)
+
+def recipe_or_mock(recipe_data, ingredients):
+    """Returns recipe_data if it passes recipe validation, otherwise a mock recipe."""
+    # Perform recipe-specific validation
+    if is_valid_recipe(recipe_data):
+        logger.debug("Received valid recipe data")
+        return recipe_data
+    logger.warning("LLM call failed or returned invalid recipe structure, using mock recipe")
+    if recipe_data:
+        logger.debug("Received data (invalid structure): %s", LazyJSON(recipe_data, indent=2))
+        RECIPE_FALLBACKS.inc(reason='invalid_structure')
+    else:
+        logger.debug("Received no data from LLM API call")
+        RECIPE_FALLBACKS.inc(reason='no_data')
+    return mock_recipe(ingredients)
+
 def mock_recipe(ingredients):
     """Fallback mock recipe generator."""
     ing_list = ingredients if ingredients else ["basic items"]
@@ -155,43 +402,67 @@ def validate_password(password):
     #     return False, "Password must contain at least one lowercase letter."
     return True, ""
 
+# --- Recipe Sharing ---
+def decode_share_data(encoded_data):
+    """
+    Decodes a stateless share link payload (URL-safe Base64 of the recipe JSON).
+    Raises ValueError (binascii.Error / JSONDecodeError) on bad input.
+    """
+    # Need to add padding back if it was stripped during JS encoding
+    missing_padding = len(encoded_data) % 4
+    if missing_padding:
+        encoded_data += '=' * (4 - missing_padding)
+    decoded_bytes = base64.urlsafe_b64decode(encoded_data)
+    return jsoncodec.loads(decoded_bytes)
+
 # --- Ingredient Substitution (Updated Logic) ---
-STATIC_SUBSTITUTIONS = {
-    # Keep this empty or add very reliable, universal substitutions if desired
-    # "milk": ["oat milk", "soy milk", "almond milk", "coconut milk (for richness)"],
-}
 
-def get_substitutions(ingredient):
-    """Provides substitution suggestions using LLM."""
+def get_substitutions(ingredient, context=None, deadline=None):
+    """
+    Provides substitution suggestions. The local knowledge base is checked
+    first; the LLM is only queried on a miss and its answer is written back.
+    `context` is an optional usage hint such as 'baking' or 'savory'.
+    """
     if not ingredient or not isinstance(ingredient, str):
         return ["Invalid ingredient provided."]
 
-    ingredient_lower = ingredient.lower().strip()
-
-    # 1. Check static map (Optional)
-    # if ingredient_lower in STATIC_SUBSTITUTIONS:
-    #    print(f"Using static substitution for {ingredient}")
-    #    return STATIC_SUBSTITUTIONS[ingredient_lower]
+    # 1. Check local substitution store (seed data + previously learned answers)
+    store = get_substitution_store()
+    known = store.lookup(ingredient, context)
+    if known:
+        logger.debug("Using stored substitution for %s", ingredient)
+        return known
 
     # 2. LLM Query
-    print(f"Querying LLM for substitutes for: {ingredient}")
-    # Explicitly ask for the desired JSON format for substitutions
-    sub_prompt = (
+    logger.info("Querying LLM for substitutes for: %s", ingredient)
+    sub_prompt = format_substitution_prompt(ingredient, context)
+
+    # Call the modified API function
+    sub_response_data = call_gemini_api(sub_prompt, validator=is_valid_substitution, deadline=deadline,
+                                        tier='substitute', generation_config=SUBSTITUTION_GENERATION_CONFIG)
+    suggestions = process_substitution_response(ingredient, sub_response_data)
+    if is_valid_substitution(sub_response_data) and suggestions != ["No specific suggestions found."]:
+        store.add(ingredient, suggestions, context)
+    return suggestions
+
+def format_substitution_prompt(ingredient, context=None):
+    """Builds the substitution prompt, explicitly asking for the JSON format we parse."""
+    if context:
+        usage = f"The ingredient is being used for {context} cooking. "
+    else:
+        usage = "Consider variations if applicable (e.g., for baking vs savory). "
+    return (
         f"Suggest 1 to 3 common culinary substitutes for the ingredient: '{ingredient}'. "
-        "Consider variations if applicable (e.g., for baking vs savory). "
+        f"{usage}"
         "Return the answer ONLY as a valid JSON object with a single key 'substitutes' "
         "whose value is a list of strings (the names of the substitutes). Example: "
         '{"substitutes": ["substitute one", "substitute two"]}'
     )
 
-    # Call the modified API function
-    sub_response_data = call_gemini_api(sub_prompt)
-
+def process_substitution_response(ingredient, sub_response_data):
+    """Turns parsed LLM output into the list of suggestions /substitute returns."""
     # Validate the *specific* structure needed for substitutions
-    if (sub_response_data
-            and isinstance(sub_response_data, dict)
-            and 'substitutes' in sub_response_data
-            and isinstance(sub_response_data['substitutes'], list)):
+    if is_valid_substitution(sub_response_data):
 
         # Filter results to ensure they are non-empty strings
         suggestions = [
@@ -200,14 +471,14 @@ def get_substitutions(ingredient):
         ]
 
         if suggestions:
-             print(f"LLM Suggestions for {ingredient}: {suggestions}")
+             logger.debug("LLM suggestions for %s: %s", ingredient, suggestions)
              return suggestions
         else:
              # Case where LLM returns {"substitutes": []} or {"substitutes": [""]}
-             print(f"LLM returned empty suggestions list for {ingredient}.")
+             logger.info("LLM returned empty suggestions list for %s.", ingredient)
              return ["No specific suggestions found."]
     else:
         # Case where LLM failed or returned improperly formatted JSON
-        print(f"LLM call failed or gave unexpected JSON format for {ingredient} substitution.")
-        print(f"Received data: {sub_response_data}") # Log what was received
+        logger.warning("LLM call failed or gave unexpected JSON format for %s substitution.", ingredient)
+        logger.debug("Received data: %s", LazyJSON(sub_response_data)) # Log what was received
         return ["LLM suggestion could not be processed."]
\ No newline at end of file
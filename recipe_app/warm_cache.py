@@ -0,0 +1,343 @@
+# warm_cache.py
+"""
+Precomputed Gemini answers for popular requests, shipped as one read-only
+file so a fresh deploy serves the staples without a cold cache.
+
+    python -m warm_cache build --seed data/warm_seed.json
+    python -m warm_cache build --from-db 500 --concurrency 4 --rate 2
+    python -m warm_cache stats
+
+`build` runs each seed request (recipes and substitutions) through
+utils.call_gemini_api, with bounded concurrency and a calls-per-second
+cap, and writes the valid answers keyed exactly like the response cache
+(cache.make_cache_key). Entries already in the artifact are kept without
+calling Gemini again unless --refresh is given. `--from-db N` adds the N
+most generated ingredient/filter combinations from the recipes table.
+
+File layout (little-endian):
+
+    header   magic 'RWC1', version, entry count, created_at
+    index    count x (sha256 key digest, offset, length), sorted by digest
+    payloads zlib-compressed JSON, back to back
+
+App processes memory-map the file (WARM_CACHE_PATH) and binary-search the
+index, so a hit costs a few microseconds and every worker on the host
+shares one copy through the page cache. A replaced file is picked up
+within WARM_CACHE_RELOAD_INTERVAL seconds.
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import jsoncodec
+from metrics import WARM_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'RWC1'
+VERSION = 1
+HEADER = struct.Struct('<4sIId') # magic, version, count, created_at
+RECORD = struct.Struct('<32sQI') # key digest, payload offset, payload length
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'warm_cache.bin')
+
+
+# --- Reader ---
+
+class WarmCache:
+    """
+    Read-only view of a warm cache file. get() returns a freshly decoded
+    value (callers may modify it) or None. A missing file just means every
+    lookup misses until one appears.
+    """
+
+    def __init__(self, path, reload_interval=30.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+        self._count = 0
+        self._created_at = None
+        self._identity = None # (st_ino, st_mtime_ns) of the mapped file
+        self._checked_at = 0.0
+        self._open()
+
+    def _open(self):
+        """(Re)maps the file if it changed since the last check."""
+        self._checked_at = time.monotonic()
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            identity = None
+        else:
+            identity = (st.st_ino, st.st_mtime_ns)
+        if identity == self._identity:
+            return
+        mapped, count, created_at = None, 0, None
+        handle = None
+        if identity is not None:
+            try:
+                handle = open(self.path, 'rb')
+                mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, count, created_at = HEADER.unpack_from(mapped, 0)
+                if magic != MAGIC or version != VERSION:
+                    raise ValueError(f"not a version {VERSION} warm cache file")
+            except (OSError, ValueError, struct.error) as e:
+                logger.error("Ignoring warm cache %s: %s", self.path, e)
+                if mapped is not None:
+                    mapped.close()
+                if handle is not None:
+                    handle.close()
+                mapped, handle, count, created_at = None, None, 0, None
+        # The old mapping isn't closed: a concurrent get() may still be reading it, so it is
+        # released by the garbage collector once the last reader is done
+        self._map, self._file, self._count, self._created_at = mapped, handle, count, created_at
+        self._identity = identity
+        if mapped is not None:
+            logger.info("Warm cache %s mapped (%d entries).", self.path, count)
+
+    def _maybe_reload(self):
+        if self.reload_interval and time.monotonic() - self._checked_at >= self.reload_interval:
+            with self._lock:
+                if time.monotonic() - self._checked_at >= self.reload_interval:
+                    self._open()
+
+    def _find(self, mapped, count, digest):
+        """(offset, length) of `digest` in the sorted index, or None."""
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = HEADER.size + mid * RECORD.size
+            probe = mapped[start:start + 32]
+            if probe < digest:
+                lo = mid + 1
+            elif probe > digest:
+                hi = mid
+            else:
+                return RECORD.unpack_from(mapped, start)[1:]
+        return None
+
+    def get(self, key):
+        self._maybe_reload()
+        mapped, count = self._map, self._count
+        if mapped is None:
+            return None
+        try:
+            found = self._find(mapped, count, bytes.fromhex(key))
+        except ValueError:
+            found = None
+        if found is None:
+            WARM_CACHE_LOOKUPS.inc(result='miss')
+            return None
+        offset, length = found
+        WARM_CACHE_LOOKUPS.inc(result='hit')
+        return jsoncodec.loads(zlib.decompress(mapped[offset:offset + length]))
+
+    def items(self):
+        """Yields (key, value) for every entry (used when rebuilding the file)."""
+        mapped, count = self._map, self._count
+        for i in range(count if mapped is not None else 0):
+            digest, offset, length = RECORD.unpack_from(mapped, HEADER.size + i * RECORD.size)
+            yield digest.hex(), jsoncodec.loads(zlib.decompress(mapped[offset:offset + length]))
+
+    def __len__(self):
+        return self._count
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "entries": self._count,
+            "bytes": len(self._map) if self._map is not None else 0,
+            "created_at": self._created_at,
+        }
+
+
+def build_warm_cache():
+    """
+    Returns the warm cache configured from environment variables, or None when disabled:
+      WARM_CACHE_ENABLED          - 1 (default) or 0
+      WARM_CACHE_PATH             - artifact written by `python -m warm_cache build` (default: warm_cache.bin
+                                    next to this module, whatever the working directory)
+      WARM_CACHE_RELOAD_INTERVAL  - seconds between checks for a replaced file (default 30; 0 = never)
+    """
+    if os.getenv('WARM_CACHE_ENABLED', '1').lower() not in ['true', '1', 't', 'yes', 'on']:
+        return None
+    return WarmCache(os.getenv('WARM_CACHE_PATH', DEFAULT_PATH),
+                     reload_interval=float(os.getenv('WARM_CACHE_RELOAD_INTERVAL', '30')))
+
+
+# --- Writer ---
+
+def write_warm_cache(path, entries):
+    """
+    Writes {cache_key: value} to `path` atomically (temp file + rename), so
+    running workers only ever map a complete file. Returns the byte size.
+    """
+    records = sorted((bytes.fromhex(key), zlib.compress(jsoncodec.dumps_bytes(value), 9))
+                     for key, value in entries.items())
+    offset = HEADER.size + RECORD.size * len(records)
+    index = bytearray()
+    for digest, payload in records:
+        index += RECORD.pack(digest, offset, len(payload))
+        offset += len(payload)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(records), time.time()))
+        f.write(index)
+        for _, payload in records:
+            f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return offset
+
+
+# --- Build Pipeline ---
+
+def load_seed(path):
+    """
+    Reads a seed file: {"recipes": [{"ingredients": [...], "filters": {...},
+    "description": "..."}, ...], "substitutions": [{"ingredient": "...",
+    "context": "baking"}, ...]}. Returns (recipe specs, substitution specs).
+    """
+    with open(path, encoding='utf-8') as f:
+        seed = json.load(f)
+    return seed.get('recipes', []), seed.get('substitutions', [])
+
+def top_requests_from_db(limit):
+    """The `limit` ingredient/filter combinations generated most often (descriptions aren't stored)."""
+    from app import app, get_services # Imported here: only the CLI needs the app's DB settings
+    with get_services(app).db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT ingredients, filters, COUNT(*) AS uses FROM recipes "
+                "GROUP BY ingredients, filters ORDER BY uses DESC LIMIT %s;", (limit,)
+            )
+            return [{"ingredients": list(ingredients), "filters": filters or {}} for ingredients, filters, _ in cur.fetchall()]
+
+def _jobs(recipe_specs, substitution_specs):
+    """{cache_key: (prompt, validator, tier, generation_config)} for every distinct seed request."""
+    from cache import make_cache_key
+    from normalize import normalize_request
+    from utils import (
+        GEMINI_MODEL, GENERATION_CONFIG, SUBSTITUTION_GENERATION_CONFIG, format_gemini_prompt,
+        format_substitution_prompt, is_valid_recipe, is_valid_substitution
+    )
+    jobs = {}
+    for spec in recipe_specs:
+        # Normalized exactly like /generate, so the keys match live requests
+        normalized = normalize_request(spec.get('ingredients') or [], spec.get('filters') or {}, spec.get('description') or '')
+        prompt = format_gemini_prompt(normalized.ingredients, normalized.filters, normalized.description)
+        jobs[make_cache_key(prompt, GENERATION_CONFIG, GEMINI_MODEL)] = (prompt, is_valid_recipe, 'generate', GENERATION_CONFIG)
+    for spec in substitution_specs:
+        prompt = format_substitution_prompt(spec['ingredient'].strip(), spec.get('context'))
+        jobs[make_cache_key(prompt, SUBSTITUTION_GENERATION_CONFIG, GEMINI_MODEL)] = (
+            prompt, is_valid_substitution, 'substitute', SUBSTITUTION_GENERATION_CONFIG)
+    return jobs
+
+def build(output, recipe_specs, substitution_specs, concurrency=4, rate=2.0, refresh=False, timeout=60.0):
+    """
+    Generates every seed request not already in `output` (all of them with
+    `refresh`) and rewrites the file. Returns a summary dict.
+    """
+    from circuit_breaker import deadline_after
+    from rate_limit import MemoryRateBackend
+    from utils import call_gemini_api
+
+    jobs = _jobs(recipe_specs, substitution_specs)
+    entries = {}
+    if not refresh:
+        existing = WarmCache(output, reload_interval=0)
+        entries = {key: value for key, value in existing.items() if key in jobs}
+    reused = len(entries)
+    todo = [key for key in jobs if key not in entries]
+    logger.info("Warm cache: %d requests, %d already built, %d to generate.", len(jobs), len(entries), len(todo))
+
+    pacer = MemoryRateBackend()
+    pacer_lock = threading.Lock()
+    def pace():
+        # One token per call, refilled `rate` times a second (no bursts)
+        while True:
+            with pacer_lock:
+                decision = pacer.take('warm-cache', rate, 1, 1)
+            if decision.allowed:
+                return
+            time.sleep(decision.retry_after)
+
+    def generate(key):
+        prompt, validator, tier, generation_config = jobs[key]
+        if rate:
+            pace()
+        return key, call_gemini_api(prompt, validator=validator, deadline=deadline_after(timeout),
+                                    tier=tier, generation_config=generation_config)
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='warm-cache') as executor:
+        for done, (key, value) in enumerate(executor.map(generate, todo), start=1):
+            validator = jobs[key][1]
+            if value is not None and validator(value):
+                entries[key] = value
+            else:
+                failed += 1
+            if done % 50 == 0:
+                logger.info("Warm cache: %d/%d generated (%d failed).", done, len(todo), failed)
+
+    size = write_warm_cache(output, entries)
+    return {"path": output, "entries": len(entries), "generated": len(todo) - failed,
+            "reused": reused, "failed": failed, "bytes": size}
+
+
+# --- CLI ---
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    load_dotenv() # Same settings as the app (GEMINI_*, WARM_CACHE_PATH, DB_*)
+    from logging_config import configure_logging
+    configure_logging()
+
+    parser = argparse.ArgumentParser(description="Build or inspect the precomputed warm cache.")
+    parser.add_argument('command', choices=['build', 'stats'])
+    parser.add_argument('--output', default=os.getenv('WARM_CACHE_PATH', DEFAULT_PATH))
+    parser.add_argument('--seed', action='append', default=[], help="Seed JSON file (repeatable)")
+    parser.add_argument('--from-db', type=int, default=0, metavar='N',
+                        help="Also warm the N most generated ingredient/filter combinations")
+    parser.add_argument('--concurrency', type=int, default=4, help="Gemini calls in flight")
+    parser.add_argument('--rate', type=float, default=2.0, help="Gemini calls started per second (0 = unlimited)")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Budget per request in seconds")
+    parser.add_argument('--refresh', action='store_true', help="Regenerate entries already in the file")
+    args = parser.parse_args(argv)
+
+    if args.command == 'stats':
+        print(json.dumps(WarmCache(args.output, reload_interval=0).stats(), indent=2))
+        return 0
+
+    recipe_specs, substitution_specs = [], []
+    for path in args.seed:
+        recipes, substitutions = load_seed(path)
+        recipe_specs += recipes
+        substitution_specs += substitutions
+    if args.from_db:
+        recipe_specs += top_requests_from_db(args.from_db)
+    if not recipe_specs and not substitution_specs:
+        parser.error("nothing to build; pass --seed and/or --from-db")
+
+    # Answers must come from Gemini, not from the artifact being rebuilt
+    os.environ['WARM_CACHE_ENABLED'] = '0'
+    if args.refresh:
+        os.environ['GEMINI_CACHE_ENABLED'] = '0'
+    summary = build(args.output, recipe_specs, substitution_specs, concurrency=args.concurrency,
+                    rate=args.rate, refresh=args.refresh, timeout=args.timeout)
+    print(json.dumps(summary, indent=2))
+    return 0 if summary['entries'] else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())